@@ -0,0 +1,103 @@
+"""create TST tables
+
+Revision ID: 3c5f8a1e2b7d
+Revises:
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5f8a1e2b7d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'experiment',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('laboratory', sa.String(), nullable=True),
+        sa.Column('researcher', sa.String(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+    )
+    op.create_table(
+        'experiment_metadata',
+        sa.Column('experiment_id', sa.Integer(), nullable=False),
+        sa.Column('section', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('value', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['experiment_id'], ['experiment.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('experiment_id', 'section', 'name'),
+    )
+    op.create_table(
+        'test',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('experiment_id', sa.Integer(), nullable=False),
+        sa.Column('number', sa.Integer(), nullable=False),
+        sa.Column('stress_ratio', sa.Float(), nullable=True),
+        sa.Column('maximum_stress', sa.Float(), nullable=True),
+        sa.Column('loading_rate', sa.Float(), nullable=True),
+        sa.Column('run_out', sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(['experiment_id'], ['experiment.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('experiment_id', 'number'),
+    )
+    op.create_table(
+        'measurement',
+        sa.Column('test_id', sa.Integer(), nullable=False),
+        sa.Column('row', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('machine_n_cycles', sa.BigInteger(), nullable=True),
+        sa.Column('machine_load', sa.Float(), nullable=True),
+        sa.Column('machine_displacement', sa.Float(), nullable=True),
+        sa.Column('image_index', sa.Float(), nullable=True),
+        sa.Column('camera_n_cycles', sa.Float(), nullable=True),
+        sa.Column('exx', sa.Float(), nullable=True),
+        sa.Column('eyy', sa.Float(), nullable=True),
+        sa.Column('exy', sa.Float(), nullable=True),
+        sa.Column('crack_length', sa.Float(), nullable=True),
+        sa.Column('th_time', sa.Float(), nullable=True),
+        sa.Column('th_n_cycles', sa.Float(), nullable=True),
+        sa.Column('th_specimen_max', sa.Float(), nullable=True),
+        sa.Column('th_specimen_mean', sa.Float(), nullable=True),
+        sa.Column('th_chamber', sa.Float(), nullable=True),
+        sa.Column('th_uppergrips', sa.Float(), nullable=True),
+        sa.Column('th_lowergrips', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['test_id'], ['test.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('test_id', 'row'),
+    )
+    op.create_index('ix_measurement_test_n_cycles', 'measurement',
+                    ['test_id', 'machine_n_cycles'])
+    op.create_table(
+        'hys_measurement',
+        sa.Column('test_id', sa.Integer(), nullable=False),
+        sa.Column('row', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('n_cycles', sa.BigInteger(), nullable=True),
+        sa.Column('creep', sa.Float(), nullable=True),
+        sa.Column('hysteresis_area', sa.Float(), nullable=True),
+        sa.Column('stiffness', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['test_id'], ['test.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('test_id', 'row'),
+    )
+    op.create_index('ix_hys_measurement_test_n_cycles', 'hys_measurement',
+                    ['test_id', 'n_cycles'])
+
+
+def downgrade():
+    op.drop_index('ix_hys_measurement_test_n_cycles',
+                  table_name='hys_measurement')
+    op.drop_table('hys_measurement')
+    op.drop_index('ix_measurement_test_n_cycles', table_name='measurement')
+    op.drop_table('measurement')
+    op.drop_table('test')
+    op.drop_table('experiment_metadata')
+    op.drop_table('experiment')
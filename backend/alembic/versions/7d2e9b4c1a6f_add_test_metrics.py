@@ -0,0 +1,31 @@
+"""add test metrics
+
+Revision ID: 7d2e9b4c1a6f
+Revises: 3c5f8a1e2b7d
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e9b4c1a6f'
+down_revision = '3c5f8a1e2b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('test', sa.Column('total_dissipated_energy', sa.Float(),
+                                    nullable=True))
+    op.add_column('test', sa.Column('strain_at_failure', sa.Float(),
+                                    nullable=True))
+    op.add_column('test', sa.Column('stiffness_degradation', sa.Float(),
+                                    nullable=True))
+
+
+def downgrade():
+    op.drop_column('test', 'stiffness_degradation')
+    op.drop_column('test', 'strain_at_failure')
+    op.drop_column('test', 'total_dissipated_energy')
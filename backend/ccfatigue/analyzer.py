@@ -1,71 +1,205 @@
+import hashlib
 import io
+import math
 import os
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from tempfile import NamedTemporaryFile, SpooledTemporaryFile
-from typing import Any, Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
 
 import pandas as pd
 from pandas.core.frame import DataFrame
 
-from ccfatigue import plotter
-from ccfatigue.model import SnCurveMethod, SnCurveResult
+from ccfatigue import bootstrap, cache, instrumentation, plotter, sncurve
+from ccfatigue.config import settings
+from ccfatigue.model import (
+    SnCurve, SnCurveBand, SnCurveEngine, SnCurveMethod, SnCurveResult)
 from ccfatigue.plotter import DataKey, Line, Plot
 
 ROUND_DECIMAL = 8
+SN_CURVE_DIRECTORY = '../CCFatigue_modules/2_S-NCurves'
 
+# Fortran runs are I/O bound subprocesses: threads are enough to keep
+# max_workers executables running at once without blocking the event loop.
+executor = ThreadPoolExecutor(max_workers=settings.fortran_max_workers)
+output_cache = cache.get_cache('fortran', settings.fortran_cache_bytes,
+                               settings.shared_cache_enabled)
 
-def run_fortran(exec_path: str, input_file: SpooledTemporaryFile) -> bytes:
+
+@lru_cache(maxsize=None)
+def hash_executable(exec_path: str, mtime_ns: int, size: int) -> str:
+    with open(exec_path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def get_executable_hash(exec_path: str) -> str:
+    stat = os.stat(exec_path)
+    return hash_executable(os.path.abspath(exec_path),
+                           stat.st_mtime_ns,
+                           stat.st_size)
+
+
+def execute_fortran(exec_path: str, input_data: bytes) -> bytes:
     with NamedTemporaryFile() as tmp_file:
-        input_file.seek(0)
-        tmp_file.write(input_file.read())
+        tmp_file.write(input_data)
         tmp_file.flush()
         split_path = os.path.split(exec_path)
         directory = os.path.abspath(split_path[0])
         print(f'executing {os.path.abspath(exec_path)} {tmp_file.name}')
-        ouput = subprocess.check_output([
-            f'./{split_path[1]}',
-            tmp_file.name,
-        ], cwd=directory)
-        return ouput
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            ouput = subprocess.check_output([
+                f'./{split_path[1]}',
+                tmp_file.name,
+            ], cwd=directory, timeout=settings.fortran_timeout)
+            outcome = 'ok'
+            return ouput
+        except subprocess.TimeoutExpired:
+            outcome = 'timeout'
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            instrumentation.subprocess_total.inc(executable=split_path[1],
+                                                 outcome=outcome)
+            instrumentation.subprocess_seconds.observe(
+                seconds, executable=split_path[1])
+            instrumentation.record(f'subprocess_{split_path[1]}', seconds)
 
 
-def create_dataframe(output: bytes, method: SnCurveMethod) -> DataFrame:
+def run_fortran(exec_path: str, input_data: bytes) -> bytes:
+    '''Run exec_path on input_data, reusing the output of any previous run
+    of the same executable on the same input.'''
+    key = (hashlib.sha256(input_data).hexdigest(),
+           os.path.basename(exec_path),
+           get_executable_hash(exec_path))
+    return output_cache.get_or_compute(
+        key, lambda: execute_fortran(exec_path, input_data))
+
+
+def read_input(input_file: SpooledTemporaryFile) -> bytes:
+    input_file.seek(0)
+    return input_file.read()
+
+
+def get_columns(method: SnCurveMethod) -> List[DataKey]:
     if method in [SnCurveMethod.LIN_LOG, SnCurveMethod.LOG_LOG]:
-        widths = [17, 12, 12, 12, 12]
-        columns = [DataKey.R_RATIO,
-                   DataKey.N_CYCLES,
-                   DataKey.STRESS_PARAM,
-                   DataKey.LOW,
-                   DataKey.HIGH]
+        return [DataKey.R_RATIO,
+                DataKey.N_CYCLES,
+                DataKey.STRESS_PARAM,
+                DataKey.LOW,
+                DataKey.HIGH]
     elif method in [SnCurveMethod.SENDECKYJ, SnCurveMethod.WHITNEY]:
-        widths = [17, 12, 12]
-        columns = [DataKey.R_RATIO, DataKey.N_CYCLES, DataKey.STRESS_PARAM]
+        return [DataKey.R_RATIO, DataKey.N_CYCLES, DataKey.STRESS_PARAM]
     else:
         raise ValueError(f'unknown {method.name}')
-    df: DataFrame = pd.read_fwf(io.BytesIO(output), widths=widths, header=None)
-    df.columns = [column.key for column in columns]
-    return df.fillna('')
-
-
-def create_line(output: bytes, method: SnCurveMethod, r_ratio: float) -> Any:
-    df = create_dataframe(output, method)
-    round_df = df.round({DataKey.R_RATIO.key: ROUND_DECIMAL})
-    selected_df = round_df[round_df[DataKey.R_RATIO.key] == r_ratio]
-    n_cycles = selected_df[DataKey.N_CYCLES.key].to_list()
-    stress_param = selected_df[DataKey.STRESS_PARAM.key].to_list()
-    return Line(
-        data={
-            DataKey.N_CYCLES: n_cycles,
-            DataKey.STRESS_PARAM: stress_param,
-        },
-        legend_label=f'{method.value} {r_ratio}',
-    )
+
+
+def create_dataframe(output: bytes, method: SnCurveMethod) -> DataFrame:
+    '''Parse the curve rows of a Fortran output in a single pass.
+
+    Parameter lines hold a single value and Whitney debug lines one value
+    too many, so curve rows are the lines with exactly one value per column.
+    '''
+    columns = get_columns(method)
+    df: DataFrame = pd.read_csv(io.BytesIO(output),
+                                sep=r'\s+',
+                                header=None,
+                                names=range(len(columns) + 1),
+                                dtype=float)
+    selected = df[df[len(columns) - 1].notna() & df[len(columns)].isna()]
+    selected = selected.drop(columns=len(columns))
+    selected.columns = [column.key for column in columns]
+    return selected
+
+
+def to_list(values: pd.Series) -> List[Optional[float]]:
+    '''JSON compliant values, None standing for the non-finite ones.'''
+    return [v if math.isfinite(v) else None for v in values.tolist()]
+
+
+def create_curves(df: DataFrame, method: SnCurveMethod) -> List[SnCurve]:
+    columns = [column.key for column in get_columns(method)[1:]]
+    df = df.round({DataKey.R_RATIO.key: ROUND_DECIMAL})
+    return [
+        SnCurve(r_ratio=r_ratio,
+                **{column: to_list(group[column]) for column in columns})
+        for r_ratio, group in df.groupby(DataKey.R_RATIO.key, sort=False)
+    ]
+
+
+def create_lines(curves: List[SnCurve],
+                 method: SnCurveMethod,
+                 r_ratios: List[float]) -> List[Line]:
+    by_r_ratio = {curve.r_ratio: curve for curve in curves}
+    lines = []
+    for r_ratio in r_ratios:
+        curve = by_r_ratio.get(round(r_ratio, ROUND_DECIMAL))
+        lines.append(Line(
+            data={
+                DataKey.N_CYCLES: curve.n_cycles if curve else [],
+                DataKey.STRESS_PARAM: curve.stress_parameter if curve else [],
+            },
+            legend_label=f'{method.value} {r_ratio}',
+        ))
+    return lines
+
+
+def create_band_lines(bands: List[SnCurveBand],
+                      method: SnCurveMethod,
+                      r_ratios: List[float],
+                      confidence: float) -> List[Line]:
+    by_r_ratio = {round(band.r_ratio, ROUND_DECIMAL): band for band in bands}
+    lines = []
+    for r_ratio in r_ratios:
+        band = by_r_ratio.get(round(r_ratio, ROUND_DECIMAL))
+        for bound in ['low', 'high']:
+            lines.append(Line(
+                data={
+                    DataKey.N_CYCLES: band.n_cycles if band else [],
+                    DataKey.STRESS_PARAM: getattr(band, bound) if band
+                    else [],
+                },
+                legend_label=f'{method.value} {r_ratio} '
+                             f'{confidence:g}% {bound}',
+            ))
+    return lines
+
+
+def run_method(method: SnCurveMethod,
+               input_data: bytes,
+               engine: SnCurveEngine) -> Tuple[bytes, DataFrame]:
+    '''Fit method on input_data, return the text output and the curves.'''
+    with instrumentation.span(f'sn_curve_{engine.value}') as span:
+        if engine == SnCurveEngine.NUMPY:
+            df, parameters = sncurve.fit(sncurve.read_input(input_data),
+                                         method)
+            output = sncurve.render(df, parameters)
+        else:
+            output = run_fortran(
+                f'{SN_CURVE_DIRECTORY}/S-N-Curve-{method.value}', input_data)
+            df = create_dataframe(output, method)
+        span.rows = input_data.count(b'\n')
+    return output, df
 
 
 def run_sn_curve(file: SpooledTemporaryFile,
                  methods: List[SnCurveMethod],
                  r_ratios: List[float],
+                 engine: SnCurveEngine = SnCurveEngine.FORTRAN,
+                 replicates: int = 0,
+                 confidence: float = 95,
+                 seed: int = 0,
+                 progress: Optional[Callable[[float], None]] = None
                  ) -> SnCurveResult:
+    '''
+    With replicates, the confidence % bootstrap band of every method,
+    computed with the NumPy fits whatever the engine, is added to the
+    result and drawn as two more lines per R ratio. progress, if given, is
+    called with the fraction of the methods done.
+    '''
     plot = Plot(
         title='S-N Curves',
         x_axis=DataKey.N_CYCLES,
@@ -73,15 +207,38 @@ def run_sn_curve(file: SpooledTemporaryFile,
         tooltips=[DataKey.N_CYCLES, DataKey.STRESS_PARAM],
         x_axis_type='log',
     )
+    input_data = read_input(file)
+    futures = {
+        method: executor.submit(instrumentation.in_context(run_method),
+                                method, input_data, engine)
+        for method in methods
+    }
+    band_futures = {}
+    if replicates > 0:
+        datasets = sncurve.read_input(input_data)
+        band_futures = {
+            method: executor.submit(
+                instrumentation.in_context(bootstrap.run_bootstrap),
+                datasets, method, replicates, confidence, seed)
+            for method in methods
+        }
     outputs: Dict[SnCurveMethod, bytes] = {}
-    for method in methods:
-        output = run_fortran(
-            f'../CCFatigue_modules/2_S-NCurves/S-N-Curve-{method.value}',
-            file)
+    curves: Dict[SnCurveMethod, List[SnCurve]] = {}
+    bands: Dict[SnCurveMethod, List[SnCurveBand]] = {}
+    for method, future in futures.items():
+        output, df = future.result()
         outputs[method] = output
-        for r_ratio in r_ratios:
-            plot.lines.append(create_line(output, method, r_ratio))
+        curves[method] = create_curves(df, method)
+        plot.lines.extend(create_lines(curves[method], method, r_ratios))
+        if method in band_futures:
+            bands[method] = band_futures[method].result()
+            plot.lines.extend(create_band_lines(bands[method], method,
+                                                r_ratios, confidence))
+        if progress is not None:
+            progress(len(outputs) / len(futures))
     return SnCurveResult(
         outputs=outputs,
+        curves=curves,
+        bands=bands,
         plot=plotter.export_plot(plot)
     )
@@ -0,0 +1,268 @@
+'''
+Benchmarks of the dashboard, S-N curve and plotting hot paths.
+
+    pipenv run python -m ccfatigue.benchmark --save benchmark.json
+    pipenv run python -m ccfatigue.benchmark --baseline benchmark.json
+
+Fixtures are built once under cache/benchmark from the Data/TST_* tests
+and the S-N input.txt of CCFatigue_modules, and scaled synthetically: rows
+are tiled (cycle numbers shifted so every copy follows the previous one)
+and tests are duplicated under new numbers. Every case runs in its own
+interpreter, so the peak RSS reported is its own. The wall time is the
+median over the repeats, each starting with empty in-memory caches.
+
+With --baseline, a case regresses when its wall time, peak RSS or payload
+grows by more than --threshold, and the command exits with status 1.
+'''
+import argparse
+import io
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date
+from typing import Any, Callable, Dict, List, Tuple
+
+WORK_DIRECTORY: str = './cache/benchmark'
+TST_DIRECTORY: str = '../Data/TST_Khalooei_2021-10_FA'
+SN_INPUT: str = '../CCFatigue_modules/2_S-NCurves/input.txt'
+BASE_TESTS: List[int] = [1, 2]
+LABORATORY: str = 'CCLAB'
+RESEARCHER: str = 'Benchmark'
+EXPERIENCE_TYPE: str = 'FA'
+DATE: date = date(2021, 10, 1)
+CASES: List[str] = ['dashboard_cold', 'dashboard_warm', 'sn_curve',
+                    'export_bokeh', 'export_compact']
+METRICS: List[str] = ['wall_ms', 'peak_rss_mb', 'payload_bytes']
+
+
+def get_fixture_directory(rows: int, tests: int) -> str:
+    return os.path.abspath(os.path.join(WORK_DIRECTORY,
+                                        f'rows{rows}_tests{tests}'))
+
+
+def tile_cycles(df: Any, rows: int, column: str) -> Any:
+    '''rows copies of df, the cycle numbers of each copy following the
+    previous one.'''
+    import pandas as pd
+
+    span = df[column].max() + 1
+    copies = []
+    for i in range(rows):
+        copy = df.copy()
+        copy[column] += i * span
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def build_fixture(rows: int, tests: int) -> str:
+    '''Data tree of dashboarder with the base tests scaled, and the S-N
+    input with every sample repeated rows times.'''
+    import numpy as np
+    import pandas as pd
+
+    from ccfatigue import dashboarder, metrics
+
+    directory = get_fixture_directory(rows, tests)
+    if os.path.exists(os.path.join(directory, 'ready')):
+        return directory
+    shutil.rmtree(directory, ignore_errors=True)
+    dashboarder.DATA_DIRECTORY = os.path.join(directory, 'data')
+    for data_in in ['STD', 'HYS']:
+        os.makedirs(os.path.dirname(dashboarder.get_filepath(
+            data_in, LABORATORY, RESEARCHER, EXPERIENCE_TYPE, DATE, 0)))
+    columns = ['Machine_N_cycles', 'Machine_Load', 'Machine_Displacement']
+    for number in BASE_TESTS:
+        path = os.path.join(TST_DIRECTORY,
+                            f'TST_{DATE:%Y-%m}_{EXPERIENCE_TYPE}_'
+                            f'{number:02d}.csv')
+        std_df = pd.read_csv(path, encoding='utf-8-sig',
+                             usecols=columns).dropna()
+        std_df = tile_cycles(std_df, rows, 'Machine_N_cycles')
+        hys_df = metrics.get_cycle_metrics(
+            std_df['Machine_N_cycles'].to_numpy(dtype=float),
+            std_df['Machine_Displacement'].to_numpy(dtype=float),
+            std_df['Machine_Load'].to_numpy(dtype=float)
+        )[metrics.CYCLE_COLUMNS]
+        for copy in range(tests):
+            test_number = copy * len(BASE_TESTS) + number
+            for data_in, df in [('STD', std_df), ('HYS', hys_df)]:
+                filepath = dashboarder.get_filepath(
+                    data_in, LABORATORY, RESEARCHER, EXPERIENCE_TYPE, DATE,
+                    test_number)
+                if copy == 0:
+                    df.to_csv(filepath, index=False)
+                else:
+                    first = dashboarder.get_filepath(
+                        data_in, LABORATORY, RESEARCHER, EXPERIENCE_TYPE,
+                        DATE, number)
+                    shutil.copyfile(first, filepath)
+    samples = np.loadtxt(SN_INPUT)
+    np.savetxt(os.path.join(directory, 'input.txt'),
+               np.repeat(samples, rows, axis=0), fmt='%g')
+    open(os.path.join(directory, 'ready'), 'w').close()
+    return directory
+
+
+def get_test_numbers(tests: int) -> List[int]:
+    return list(range(1, tests * len(BASE_TESTS) + 1))
+
+
+def setup(directory: str) -> None:
+    '''Point the data, columnar and shared caches at the fixture.'''
+    from ccfatigue import cache, dashboarder, storage
+
+    dashboarder.DATA_DIRECTORY = os.path.join(directory, 'data')
+    storage.CACHE_DIRECTORY = os.path.join(directory, 'csv')
+    cache.CACHE_DIRECTORY = os.path.join(directory, 'shared')
+
+
+def clear_caches(directory: str) -> None:
+    from ccfatigue import cache
+
+    for c in cache.caches.values():
+        c.clear()
+    shutil.rmtree(os.path.join(directory, 'shared'), ignore_errors=True)
+
+
+def prepare_case(case: str,
+                 directory: str,
+                 tests: int) -> Callable[[], Any]:
+    '''Set up case outside of the timing, return the timed call.'''
+    from ccfatigue import dashboarder, plotter
+
+    test_numbers = get_test_numbers(tests)
+
+    def generate_dashboard() -> Any:
+        dashboard = dashboarder.generate_dashboard(
+            LABORATORY, RESEARCHER, EXPERIENCE_TYPE, DATE, test_numbers)
+        return dashboard.dict(exclude={'timings'})
+
+    if case == 'dashboard_cold':
+        def run() -> Any:
+            shutil.rmtree(os.path.join(directory, 'csv'), ignore_errors=True)
+            return generate_dashboard()
+        return run
+    if case == 'dashboard_warm':
+        generate_dashboard()
+        return generate_dashboard
+    if case == 'sn_curve':
+        from ccfatigue import analyzer
+        from ccfatigue.model import SnCurveEngine, SnCurveMethod
+
+        with open(os.path.join(directory, 'input.txt'), 'rb') as file:
+            input_data = file.read()
+        return lambda: analyzer.run_sn_curve(
+            io.BytesIO(input_data), list(SnCurveMethod), [-1, 0.1, 10],
+            SnCurveEngine.NUMPY).dict()
+    plot_format = plotter.PlotFormat(case.split('_')[1])
+    loaded = list(dashboarder.executor.map(
+        lambda number: dashboarder.load_test(LABORATORY, RESEARCHER,
+                                             EXPERIENCE_TYPE, DATE, number),
+        test_numbers))
+    plot = dashboarder.generate_stress_strain(
+        [dashboarder.Test(number=n, color=color, total_dissipated_energy=0,
+                          strain_at_failure=None)
+         for n, color in zip(test_numbers,
+                             dashboarder.get_colors(len(test_numbers)))],
+        [std_df for std_df, _, _ in loaded],
+        [hyst_df for _, hyst_df, _ in loaded])
+    return lambda: plotter.export_plot(plot, plot_format=plot_format)
+
+
+def run_case(case: str, rows: int, tests: int,
+             repeats: int) -> Dict[str, float]:
+    directory = get_fixture_directory(rows, tests)
+    setup(directory)
+    run = prepare_case(case, directory, tests)
+    times = []
+    for _ in range(repeats):
+        clear_caches(directory)
+        start = time.perf_counter()
+        result = run()
+        times.append((time.perf_counter() - start) * 1000)
+    payload = json.dumps(result, default=str).encode()
+    # ru_maxrss is in kB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'wall_ms': statistics.median(times), 'peak_rss_mb': peak,
+            'payload_bytes': len(payload)}
+
+
+def run_isolated(case: str, rows: int, tests: int,
+                 repeats: int) -> Dict[str, float]:
+    output = subprocess.run(
+        [sys.executable, '-m', 'ccfatigue.benchmark', '--child', case,
+         str(rows), str(tests), '--repeats', str(repeats)],
+        capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def get_scales(scales: List[int]) -> List[Tuple[int, int]]:
+    '''(rows, tests) factors: the base, then rows and tests scaled apart.'''
+    pairs = [(1, 1)]
+    for scale in scales:
+        if scale != 1:
+            pairs += [(scale, 1), (1, scale)]
+    return pairs
+
+
+def compare(results: Dict[str, Dict[str, float]],
+            baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    regressions = []
+    for name, values in results.items():
+        for metric in METRICS:
+            reference = baseline.get(name, {}).get(metric)
+            if reference and values[metric] > reference * (1 + threshold):
+                regressions.append(
+                    f'{name} {metric}: {values[metric]:.1f} '
+                    f'> {reference:.1f} +{threshold:.0%}')
+    return regressions
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description='Hot path benchmarks')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--scales', nargs='+', type=int, default=[1, 10],
+                        help='row and test multipliers, e.g. 1 10 100')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare with this results file')
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        case, rows, tests = args.child
+        print(json.dumps(run_case(case, int(rows), int(tests),
+                                  args.repeats)))
+        return
+
+    results = {}
+    for rows, tests in get_scales(args.scales):
+        build_fixture(rows, tests)
+        for case in args.cases:
+            name = f'{case}@rows{rows}x_tests{tests}x'
+            results[name] = run_isolated(case, rows, tests, args.repeats)
+            values = results[name]
+            print(f'{name:>40}: {values["wall_ms"]:9.1f} ms '
+                  f'{values["peak_rss_mb"]:8.1f} MB '
+                  f'{values["payload_bytes"]:>11,d} B', flush=True)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
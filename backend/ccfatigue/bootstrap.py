@@ -0,0 +1,290 @@
+'''
+Bootstrap confidence bands of the S-N curves of ccfatigue.sncurve.
+
+Every replicate resamples the specimens of each stress level with
+replacement and refits the curve; the band is given by percentiles of the
+refitted curves at the cycles of the curve. Replicates are refitted in
+batches with array operations, in chunks spread over a process pool. Each
+chunk draws from its own stream of a SeedSequence, so the bands only depend
+on the seed, not on the number of workers.
+
+LinLog and LogLog are refitted in closed form. The Weibull shapes of
+Whitney are roots of the likelihood equation, found by bisection instead of
+the grid scan of the single fit. Sendeckyj maximizes the Weibull shape over
+a grid of (S, C) around the optimum of the full sample rather than along
+the search path of the single fit.
+'''
+import multiprocessing
+import os
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from numpy.random import SeedSequence
+
+from ccfatigue import instrumentation, sncurve
+from ccfatigue.config import settings
+from ccfatigue.model import SnCurveBand, SnCurveMethod
+from ccfatigue.sncurve import Dataset
+
+BISECTION_ITERATIONS: int = 50
+# Sendeckyj grid: S steps on either side, C decades on either side
+SENDECKYJ_S_STEPS: int = 10
+SENDECKYJ_C_DECADES: float = 1
+SENDECKYJ_C_POINTS: int = 21
+
+
+@lru_cache(maxsize=None)
+def get_executor() -> ProcessPoolExecutor:
+    '''Created on first use: a pool created in the gunicorn master would
+    share its queues with every forked worker.'''
+    return ProcessPoolExecutor(
+        max_workers=settings.bootstrap_max_workers or os.cpu_count(),
+        mp_context=multiprocessing.get_context('forkserver'))
+
+
+def resample(dataset: Dataset,
+             rng: np.random.Generator,
+             replicates: int) -> np.ndarray:
+    '''Row indices of the replicates, drawn within each stress level.'''
+    bounds = dataset.get_level_bounds()
+    return np.concatenate([
+        rng.integers(start, end, size=(replicates, end - start))
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ], axis=1)
+
+
+def refit_linear(dataset: Dataset,
+                 method: SnCurveMethod,
+                 n_cycles: np.ndarray,
+                 rows: np.ndarray,
+                 centre: Optional[Dict[str, float]]) -> np.ndarray:
+    log_scale = method == SnCurveMethod.LOG_LOG
+    stress = dataset.stress[rows]
+    x = np.log10(stress) if log_scale else stress
+    y = np.log10(dataset.n_cycles[rows])
+    x_mean = x.mean(axis=1, keepdims=True)
+    y_mean = y.mean(axis=1, keepdims=True)
+    b = (np.sum((x - x_mean) * (y - y_mean), axis=1, keepdims=True)
+         / np.sum((x - x_mean) ** 2, axis=1, keepdims=True))
+    a = y_mean - b * x_mean
+    if log_scale:
+        return 10 ** (-a / b) * n_cycles ** (1 / b)
+    return -a / b + np.log10(n_cycles) / b
+
+
+def solve_shape(log_x: np.ndarray,
+                weights: np.ndarray,
+                log_mean: np.ndarray,
+                low: float,
+                high: float) -> np.ndarray:
+    '''
+    Root k in [low, high] of the Weibull likelihood equation, for every row:
+
+        sum(w x^k ln x) / sum(w x^k) - log_mean - 1 / k = 0
+
+    or high when there is none, as sncurve.first_root. Weights are 1 for a
+    failure, the number of runouts for a runout term and 0 for no term.
+    '''
+    top = np.max(np.where(weights > 0, log_x, -np.inf), axis=1,
+                 keepdims=True)
+    log_x = np.where(weights > 0, log_x, top)
+
+    def equation(k: np.ndarray) -> np.ndarray:
+        power = weights * np.exp(k[:, np.newaxis] * (log_x - top))
+        return ((power * log_x).sum(axis=1) / power.sum(axis=1)
+                - log_mean - 1 / k)
+
+    lows = np.full(len(log_x), low)
+    highs = np.full(len(log_x), high)
+    at_low = equation(lows) >= 0
+    found = equation(highs) >= 0
+    for _ in range(BISECTION_ITERATIONS):
+        middles = (lows + highs) / 2
+        positive = equation(middles) >= 0
+        highs = np.where(positive, middles, highs)
+        lows = np.where(positive, lows, middles)
+    return np.where(at_low, low, np.where(found, highs, high))
+
+
+def refit_whitney(dataset: Dataset,
+                  method: SnCurveMethod,
+                  n_cycles: np.ndarray,
+                  rows: np.ndarray,
+                  centre: Optional[Dict[str, float]]) -> np.ndarray:
+    bounds = dataset.get_level_bounds()
+    stress = dataset.stress[rows]
+    lives = dataset.n_cycles[rows]
+    levels, characteristics = [], []
+    log_terms, weight_terms = [], []
+    # the Fortran program does not reset this sum between stress levels
+    cumulated = 0.0
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        life = lives[:, start:end]
+        failed = life < sncurve.WHITNEY_RUNOUT
+        n_failed = failed.sum(axis=1)
+        runouts = (end - start) - n_failed
+        mean = np.where(failed, life, 0).sum(axis=1) / (end - start)
+        log_x = np.where(failed, np.log(life / mean[:, np.newaxis]), 0)
+        log_ratio = np.log(sncurve.WHITNEY_RUNOUT / mean)
+        shape = solve_shape(
+            np.column_stack((log_x, log_ratio)),
+            np.column_stack((failed, runouts)),
+            log_x.sum(axis=1) / n_failed, 0.001, 90)
+        cumulated = cumulated + np.where(
+            failed, np.exp(shape[:, np.newaxis] * log_x), 0).sum(axis=1)
+        scale = ((cumulated + runouts * np.exp(shape * log_ratio))
+                 / n_failed) ** (1 / shape)
+        characteristic = scale * mean
+        levels.append(stress[:, start:end].mean(axis=1))
+        characteristics.append(characteristic)
+        log_terms += [
+            np.where(failed,
+                     np.log(life / characteristic[:, np.newaxis]), 0),
+            np.log(sncurve.WHITNEY_RUNOUT / characteristic)[:, np.newaxis],
+        ]
+        weight_terms += [failed, runouts[:, np.newaxis]]
+
+    log_x = np.concatenate(log_terms, axis=1)
+    weights = np.concatenate(weight_terms, axis=1).astype(float)
+    failures = np.concatenate(weight_terms[::2], axis=1)
+    total_failed = failures.sum(axis=1)
+    shape = solve_shape(
+        log_x, weights,
+        np.sum(np.concatenate(log_terms[::2], axis=1), axis=1) / total_failed,
+        0.0001, 30)
+    scale = (np.sum(weights * np.exp(shape[:, np.newaxis] * log_x), axis=1)
+             / total_failed) ** (1 / shape)
+
+    x = np.log10(np.column_stack(levels))
+    y = np.log10(scale[:, np.newaxis] * np.column_stack(characteristics))
+    x_mean = x.mean(axis=1, keepdims=True)
+    y_mean = y.mean(axis=1, keepdims=True)
+    slope = (np.sum((x - x_mean) * (y - y_mean), axis=1, keepdims=True)
+             / np.sum((x - x_mean) ** 2, axis=1, keepdims=True))
+    intercept = y_mean - slope * x_mean
+    so = 10 ** (-intercept / slope)
+    power_law = -1 / slope
+    return (so
+            * (-np.log(dataset.reliability / 100))
+            ** (power_law / shape[:, np.newaxis])
+            * n_cycles ** (-power_law))
+
+
+def refit_sendeckyj(dataset: Dataset,
+                    method: SnCurveMethod,
+                    n_cycles: np.ndarray,
+                    rows: np.ndarray,
+                    centre: Optional[Dict[str, float]]) -> np.ndarray:
+    s = centre['s'] + sncurve.SENDECKYJ_S_STEP * np.arange(
+        -SENDECKYJ_S_STEPS, SENDECKYJ_S_STEPS + 1)
+    s = s[s > 0]
+    c = centre['c'] * np.logspace(-SENDECKYJ_C_DECADES, SENDECKYJ_C_DECADES,
+                                  SENDECKYJ_C_POINTS)
+    s, c = [grid.ravel()[:, np.newaxis] for grid in np.meshgrid(s, c)]
+    count = rows.shape[1]
+    # (replicate, (S, C) pair, specimen)
+    stress = dataset.stress[rows][:, np.newaxis]
+    ratio = dataset.residual_strength[rows][:, np.newaxis] / stress
+    failed = (dataset.stress == dataset.residual_strength)[rows]
+    n_failed = failed.sum(axis=1)
+    log_equivalent = np.log(stress) + s * np.log(
+        (dataset.n_cycles[rows][:, np.newaxis] - 1) * c + ratio ** (1 / s))
+    log_g = (np.sum(np.where(failed[:, np.newaxis], log_equivalent, 0),
+                    axis=2) / n_failed[:, np.newaxis])
+    log_x = log_equivalent - log_g[..., np.newaxis]
+    alpha = (np.log(np.log(count / (count + 1)) / np.log(1 / (count + 1)))
+             / (log_x.min(axis=2) - log_x.max(axis=2)))
+    active = np.ones(alpha.shape, dtype=bool)
+    for _ in range(100):
+        power = np.exp(alpha[..., np.newaxis] * log_x)
+        a = power.sum(axis=2)
+        b = (log_x * power).sum(axis=2)
+        d = (log_x ** 2 * power).sum(axis=2)
+        delta = (a - alpha * b) / (alpha * d)
+        active &= np.abs(delta / alpha) > 1e-6
+        alpha = np.where(active, alpha + delta, alpha)
+        if not active.any():
+            break
+    alpha[active] = np.nan
+
+    best = np.argmax(np.where(np.isnan(alpha), -np.inf, alpha), axis=1)
+    replicates = np.arange(len(best))
+    alpha = alpha[replicates, best][:, np.newaxis]
+    log_x = log_x[replicates, best]
+    s_best, c_best = s[best], c[best]
+    g = np.exp(log_g[replicates, best])[:, np.newaxis]
+    beta = g * (np.sum(np.exp(alpha * log_x), axis=1, keepdims=True)
+                / n_failed[:, np.newaxis]) ** (1 / alpha)
+    a = -(1 - c_best) / c_best
+    return (beta
+            * (-np.log(dataset.reliability / 100)) ** (1 / alpha)
+            * (1 / ((n_cycles - a) * c_best)) ** s_best)
+
+
+REFITS: Dict[SnCurveMethod, Callable] = {
+    SnCurveMethod.LIN_LOG: refit_linear,
+    SnCurveMethod.LOG_LOG: refit_linear,
+    SnCurveMethod.SENDECKYJ: refit_sendeckyj,
+    SnCurveMethod.WHITNEY: refit_whitney,
+}
+
+
+def refit_chunk(method: SnCurveMethod,
+                datasets: List[Dataset],
+                centres: List[Optional[Dict[str, float]]],
+                seed: SeedSequence,
+                replicates: int) -> List[np.ndarray]:
+    '''Curves of replicates resamplings of every dataset, run in a worker
+    process.'''
+    rng = np.random.default_rng(seed)
+    n_cycles = sncurve.get_n_cycles(method)
+    with np.errstate(all='ignore'):
+        return [REFITS[method](dataset, method, n_cycles,
+                               resample(dataset, rng, replicates), centre)
+                for dataset, centre in zip(datasets, centres)]
+
+
+def to_list(values: np.ndarray) -> List[Optional[float]]:
+    return [float(v) if np.isfinite(v) else None for v in values]
+
+
+def run_bootstrap(datasets: List[Dataset],
+                  method: SnCurveMethod,
+                  replicates: int,
+                  confidence: float,
+                  seed: int) -> List[SnCurveBand]:
+    '''confidence % bands of method from replicates resamplings.'''
+    n_cycles = sncurve.get_n_cycles(method)
+    centres = [None] * len(datasets)
+    if method == SnCurveMethod.SENDECKYJ:
+        centres = [parameters for parameters, _, _, _ in get_executor().map(
+            sncurve.fit_sendeckyj, datasets, repeat(method),
+            repeat(n_cycles))]
+    chunk_size = settings.bootstrap_chunk_size
+    sizes = [min(chunk_size, replicates - start)
+             for start in range(0, replicates, chunk_size)]
+    seeds = SeedSequence(seed).spawn(len(sizes))
+    with instrumentation.span(f'bootstrap_{method.value}', replicates):
+        futures = [get_executor().submit(refit_chunk, method, datasets,
+                                         centres, chunk_seed, size)
+                   for chunk_seed, size in zip(seeds, sizes)]
+        chunks = [future.result() for future in futures]
+    tail = (100 - confidence) / 2
+    bands = []
+    for i, dataset in enumerate(datasets):
+        curves = np.concatenate([chunk[i] for chunk in chunks])
+        curves[~np.isfinite(curves)] = np.nan
+        # no finite replicate at some cycles: the band stays open there
+        valid = ~np.all(np.isnan(curves), axis=0)
+        low = np.full(len(n_cycles), np.nan)
+        high = np.full(len(n_cycles), np.nan)
+        low[valid], high[valid] = np.nanpercentile(
+            curves[:, valid], [tail, 100 - tail], axis=0)
+        bands.append(SnCurveBand(r_ratio=dataset.r_ratio,
+                                 n_cycles=n_cycles.tolist(),
+                                 low=to_list(low),
+                                 high=to_list(high)))
+    return bands
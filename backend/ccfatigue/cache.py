@@ -0,0 +1,176 @@
+'''
+Bounded in-process LRU caches with an optional shared on-disk tier.
+
+Every gunicorn worker holds its own memory tier. When a directory is
+configured, entries are also pickled there so that workers can reuse each
+other's results. The directory is bounded by the same size as the memory
+tier, the least recently used files being removed first.
+'''
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from ccfatigue.model import CacheStats
+
+CACHE_DIRECTORY: str = './cache'
+
+
+def sizeof(value: Any) -> int:
+    '''Rough size in bytes of a cached value.'''
+    if hasattr(value, 'memory_usage'):
+        # DataFrame, checked by duck typing to keep pandas off the import path
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v)
+                                          for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class LruCache:
+    def __init__(self,
+                 name: str,
+                 max_bytes: int,
+                 directory: Optional[str] = None,
+                 measure: Callable[[Any], int] = sizeof):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.directory = (os.path.join(directory, name)
+                          if directory else None)
+        self.measure = measure
+        self.entries: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_path(self, key: Hashable) -> str:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, f'{digest}.pkl')
+
+    def read_disk(self, key: Hashable) -> Tuple[bool, Any]:
+        if not self.directory:
+            return False, None
+        try:
+            with open(self.get_path(key), 'rb') as file:
+                stored_key, value = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False, None
+        if stored_key != key:
+            return False, None
+        try:
+            # the modification time orders the files for eviction
+            os.utime(self.get_path(key))
+        except OSError:
+            pass
+        return True, value
+
+    def write_disk(self, key: Hashable, value: Any) -> None:
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory,
+                                         delete=False) as file:
+            pickle.dump((key, value), file, pickle.HIGHEST_PROTOCOL)
+        os.replace(file.name, self.get_path(key))
+        self.prune_disk()
+
+    def prune_disk(self) -> None:
+        '''Remove the oldest files until the directory fits in max_bytes.'''
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.pkl'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # removed by another worker
+                pass
+            total -= size
+
+    def store(self, key: Hashable, value: Any) -> None:
+        size = self.measure(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key][0]
+        found, value = self.read_disk(key)
+        with self.lock:
+            if found:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        if found:
+            self.store(key, value)
+        return found, value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.store(key, value)
+        self.write_disk(key, value)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        found, value = self.get(key)
+        if not found:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self.lock:
+            return CacheStats(
+                name=self.name,
+                hits=self.hits,
+                disk_hits=self.disk_hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                entries=len(self.entries),
+                bytes=self.bytes,
+                max_bytes=self.max_bytes,
+            )
+
+
+caches: Dict[str, LruCache] = {}
+
+
+def get_cache(name: str, max_bytes: int, shared: bool = False) -> LruCache:
+    if name not in caches:
+        caches[name] = LruCache(name, max_bytes,
+                                CACHE_DIRECTORY if shared else None)
+    return caches[name]
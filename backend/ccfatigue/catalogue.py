@@ -0,0 +1,195 @@
+'''
+Index of the TST_{Researcher}_{Date}_{Type} experiment folders.
+
+The index is kept in memory, sorted by date, and refreshed at most every
+catalogue_refresh_seconds: a folder is only read again when its mtime (files
+added, removed or renamed) or the mtime of its metadata file changed. A
+folder that cannot be read, such as one with a malformed metadata file, is
+left out of the index until it changes.
+'''
+import bisect
+import glob
+import json
+import os
+import re
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from ccfatigue.config import settings
+from ccfatigue.model import Experience, ExperiencePage
+
+FOLDER_PATTERN = re.compile(
+    r'TST_(?P<researcher>.+)_(?P<date>\d{4}-\d{2})_(?P<type>[A-Z]+)$')
+TEST_PATTERN = re.compile(r'_(?P<number>\d+)\.csv$')
+
+
+def parse_folder_name(folder: str) -> Dict[str, object]:
+    name = os.path.basename(os.path.normpath(folder))
+    match = FOLDER_PATTERN.match(name)
+    if match is None:
+        raise ValueError(f'{name} is not a TST_{{Researcher}}_{{Date}}_'
+                         '{Type} folder')
+    return {
+        'name': name,
+        'researcher': match['researcher'],
+        'date': date.fromisoformat(match['date'] + '-01'),
+        'type': match['type'],
+    }
+
+
+def find_files(folder: str, prefix: str) -> List[Tuple[int, str]]:
+    '''(test number, path) of the {prefix}_*_###.csv files of folder.'''
+    files = []
+    for path in glob.glob(os.path.join(folder, '**', f'{prefix}_*.csv'),
+                          recursive=True):
+        match = TEST_PATTERN.search(path)
+        if match and 'metadata' not in os.path.basename(path):
+            files.append((int(match['number']), path))
+    return sorted(files)
+
+
+def find_metadata_file(folder: str, extension: str) -> Optional[str]:
+    paths = glob.glob(os.path.join(folder, f'*_metadata.{extension}'))
+    return paths[0] if paths else None
+
+
+def read_experiment_metadata(folder: str) -> Dict[str, Dict]:
+    '''Sections of the metadata file of folder, ValueError if it is not an
+    object of objects.'''
+    path = find_metadata_file(folder, 'json')
+    if path is None:
+        return {}
+    with open(path, encoding='utf-8-sig') as file:
+        metadata = json.load(file)
+    if not (isinstance(metadata, dict)
+            and all(isinstance(v, dict) for v in metadata.values())):
+        raise ValueError(f'{path} is not an object of sections')
+    return metadata
+
+
+def get_mtime(path: Optional[str]) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns if path else None
+    except FileNotFoundError:
+        return None
+
+
+class Entry:
+    '''
+    An indexed folder and the mtimes it was read at. experience is None
+    when the folder could not be read, error telling why.
+    '''
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.folder_mtime = get_mtime(folder)
+        self.metadata_path = find_metadata_file(folder, 'json')
+        self.metadata_mtime = get_mtime(self.metadata_path)
+        self.experience: Optional[Experience] = None
+        self.error: Optional[str] = None
+        try:
+            self.experience = self.read_experience()
+        except (ValueError, OSError) as e:
+            self.error = str(e)
+
+    def read_experience(self) -> Experience:
+        folder = self.folder
+        experiment = parse_folder_name(folder)
+        metadata = read_experiment_metadata(folder)
+        test_numbers = sorted({n for n, _ in find_files(folder, 'TST')})
+        return Experience(
+            id=experiment['name'],
+            laboratory=metadata.get('Experience', {}).get('Laboratory'),
+            researcher=experiment['researcher'],
+            type=experiment['type'],
+            date=experiment['date'],
+            n_tests=len(test_numbers),
+            test_numbers=test_numbers,
+        )
+
+    def is_stale(self) -> bool:
+        return (get_mtime(self.folder) != self.folder_mtime
+                or get_mtime(self.metadata_path) != self.metadata_mtime)
+
+
+class Catalogue:
+
+    def __init__(self, directory: str, refresh_seconds: float):
+        self.directory = directory
+        self.refresh_seconds = refresh_seconds
+        self.entries: Dict[str, Entry] = {}
+        # experiences sorted by date, and their dates, swapped as a pair
+        self.index: Tuple[List[Experience], List[date]] = ([], [])
+        self.refreshed = -float('inf')
+        self.lock = threading.Lock()
+
+    def scan(self) -> bool:
+        '''Read the new and changed folders, forget the removed ones.'''
+        names = set()
+        changed = False
+        if not os.path.isdir(self.directory):
+            changed = bool(self.entries)
+            self.entries.clear()
+            return changed
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if not item.is_dir() or not FOLDER_PATTERN.match(item.name):
+                    continue
+                names.add(item.name)
+                entry = self.entries.get(item.name)
+                if entry is None or entry.is_stale():
+                    entry = Entry(item.path)
+                    if entry.error is not None:
+                        print(f'{item.name}: skipped, {entry.error}',
+                              flush=True)
+                    self.entries[item.name] = entry
+                    changed = True
+        for name in set(self.entries) - names:
+            del self.entries[name]
+            changed = True
+        return changed
+
+    def refresh(self, force: bool = False) -> None:
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.refreshed < self.refresh_seconds:
+                return
+            if self.scan():
+                experiences = sorted(
+                    (entry.experience for entry in self.entries.values()
+                     if entry.experience is not None),
+                    key=lambda e: (e.date, e.id))
+                self.index = (experiences, [e.date for e in experiences])
+            self.refreshed = now
+
+    def query(self,
+              researcher: Optional[str] = None,
+              experience_type: Optional[str] = None,
+              date_min: Optional[date] = None,
+              date_max: Optional[date] = None,
+              min_tests: Optional[int] = None,
+              max_tests: Optional[int] = None,
+              offset: int = 0,
+              limit: int = 50) -> ExperiencePage:
+        self.refresh()
+        experiences, dates = self.index
+        start = 0 if date_min is None else bisect.bisect_left(dates,
+                                                              date_min)
+        end = (len(dates) if date_max is None
+               else bisect.bisect_right(dates, date_max))
+        matches = [
+            e for e in experiences[start:end]
+            if (researcher is None
+                or e.researcher.lower() == researcher.lower())
+            and (experience_type is None or e.type == experience_type)
+            and (min_tests is None or e.n_tests >= min_tests)
+            and (max_tests is None or e.n_tests <= max_tests)
+        ]
+        return ExperiencePage(total=len(matches), offset=offset, limit=limit,
+                              experiences=matches[offset:offset + limit])
+
+
+catalogue = Catalogue(settings.catalogue_directory,
+                      settings.catalogue_refresh_seconds)
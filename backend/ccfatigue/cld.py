@@ -0,0 +1,143 @@
+'''
+Constant life diagrams, ported from CCFatigue_modules/3_CLD.
+
+A diagram is built from the S-N curves of sncurve.fit and returned as a
+vectorized function giving the allowable stress amplitude for arrays of
+numbers of cycles and mean stresses.
+'''
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+from pandas.core.frame import DataFrame
+
+from ccfatigue.model import CldMethod
+from ccfatigue.plotter import DataKey
+
+# (n_cycles, mean stresses) -> allowable stress amplitudes
+Amplitude = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+class StaticStrength:
+    '''Static strengths, as positive values, and critical R ratio.'''
+
+    def __init__(self, ucs: float, uts: float, r_critical: float):
+        self.ucs = abs(ucs)
+        self.uts = uts
+        self.r_critical = r_critical
+
+
+def get_amplitude_mean(r_ratio: np.ndarray,
+                       stress: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''Amplitude and mean of cycles of maximum absolute stress, the
+    compressive one when |R| > 1.'''
+    compressive = np.abs(r_ratio) > 1
+    ratio = np.where(compressive, 1 / r_ratio, r_ratio)
+    sign = np.where(compressive, -1, 1)
+    return (1 - ratio) * stress / 2, sign * (1 + ratio) * stress / 2
+
+
+def fit_power_law(n_cycles: np.ndarray,
+                  stress: np.ndarray) -> Tuple[float, float]:
+    '''Fit stress = a * n_cycles ** -b by regression of log10(n_cycles) on
+    log10(stress), as the Fortran programs do.'''
+    x, y = np.log10(stress), np.log10(n_cycles)
+    slope = (np.sum((x - x.mean()) * (y - y.mean()))
+             / np.sum((x - x.mean()) ** 2))
+    intercept = y.mean() - slope * x.mean()
+    return 10 ** (-intercept / slope), -1 / slope
+
+
+def get_curve(curves: DataFrame,
+              r_ratio: float) -> Tuple[np.ndarray, np.ndarray]:
+    curve = curves[np.isclose(curves[DataKey.R_RATIO.key], r_ratio)]
+    if curve.empty:
+        raise ValueError(f'no S-N curve for R ratio {r_ratio}')
+    return (curve[DataKey.N_CYCLES.key].to_numpy(),
+            curve[DataKey.STRESS_PARAM.key].to_numpy())
+
+
+def create_linear(curves: DataFrame, static: StaticStrength) -> Amplitude:
+    '''Symmetric linear diagram crossing the mean stress axis at the
+    maximum stress of the critical R ratio curve.'''
+    a, b = fit_power_law(*get_curve(curves, static.r_critical))
+
+    def amplitude(n_cycles: np.ndarray, means: np.ndarray) -> np.ndarray:
+        return np.maximum(a * n_cycles ** -b - np.abs(means), 0)
+    return amplitude
+
+
+def create_kawai(curves: DataFrame, static: StaticStrength) -> Amplitude:
+    '''Anisomorphic diagram of Kawai, its apex on the critical R ratio
+    curve.'''
+    a, b = fit_power_law(*get_curve(curves, static.r_critical))
+    strength = (static.ucs + static.uts) / 2
+    r_critical = np.array(static.r_critical)
+
+    def amplitude(n_cycles: np.ndarray, means: np.ndarray) -> np.ndarray:
+        max_stress = a * n_cycles ** -b
+        apex_amplitude, apex_mean = get_amplitude_mean(r_critical, max_stress)
+        exponent = 2 - max_stress / strength
+        with np.errstate(invalid='ignore'):
+            distance = np.where(
+                means >= apex_mean,
+                (means - apex_mean) / (static.uts - apex_mean),
+                (apex_mean - means) / (apex_mean + static.ucs))
+            values = apex_amplitude * (
+                1 - np.clip(distance, 0, 1) ** exponent)
+        return np.nan_to_num(np.maximum(values, 0))
+    return amplitude
+
+
+def create_piecewise_linear(curves: DataFrame,
+                            static: StaticStrength) -> Amplitude:
+    '''Linear interpolation between the S-N curves of every R ratio, closed
+    by the static strengths at zero amplitude.'''
+    r_ratios = np.unique(curves[DataKey.R_RATIO.key].to_numpy())
+    fits = []
+    for r_ratio in r_ratios:
+        n_cycles, stress = get_curve(curves, r_ratio)
+        amplitudes, _ = get_amplitude_mean(np.array(r_ratio), stress)
+        fits.append(fit_power_law(n_cycles, amplitudes))
+    a, b = np.array(fits).T
+    # every R ratio is a ray of the diagram: mean = slope * amplitude
+    unit_amplitudes, unit_means = get_amplitude_mean(r_ratios,
+                                                     np.ones(len(r_ratios)))
+    slopes = unit_means / unit_amplitudes
+    order = np.argsort(slopes)
+    a, b, slopes = a[order], b[order], slopes[order]
+
+    def amplitude(n_cycles: np.ndarray, means: np.ndarray) -> np.ndarray:
+        n_cycles, means = np.broadcast_arrays(n_cycles, means)
+        ray_amplitudes = a * n_cycles[..., None] ** -b
+        # vertices from the compressive to the tensile strength
+        shape = ray_amplitudes.shape[:-1] + (1,)
+        vertex_amplitudes = np.concatenate(
+            [np.zeros(shape), ray_amplitudes, np.zeros(shape)], axis=-1)
+        vertex_means = np.concatenate(
+            [np.full(shape, -static.ucs), ray_amplitudes * slopes,
+             np.full(shape, static.uts)], axis=-1)
+        segment = np.clip(
+            np.sum(vertex_means < means[..., None], axis=-1), 1,
+            vertex_means.shape[-1] - 1)[..., None]
+        x0, x1, y0, y1 = [
+            np.take_along_axis(vertices, index, axis=-1)[..., 0]
+            for vertices in [vertex_means, vertex_amplitudes]
+            for index in [segment - 1, segment]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = y0 + (y1 - y0) * (means - x0) / (x1 - x0)
+        inside = (means > -static.ucs) & (means < static.uts)
+        return np.where(inside, np.nan_to_num(np.maximum(values, 0)), 0)
+    return amplitude
+
+
+CLDS: Dict[CldMethod, Callable[[DataFrame, StaticStrength], Amplitude]] = {
+    CldMethod.LINEAR: create_linear,
+    CldMethod.KAWAI: create_kawai,
+    CldMethod.PIECEWISE_LINEAR: create_piecewise_linear,
+}
+
+
+def create(curves: DataFrame,
+           method: CldMethod,
+           static: StaticStrength) -> Amplitude:
+    return CLDS[method](curves, static)
@@ -0,0 +1,38 @@
+'''
+Conditional GET: entity tags and 304 Not Modified responses.
+
+An ETag is a digest of everything a response depends on, typically the
+fingerprints of the source files and the request parameters, so it can be
+checked before any data is loaded.
+'''
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Response
+
+CACHE_CONTROL: str = 'no-cache'
+
+
+def make_etag(*parts: Any) -> str:
+    return '"' + hashlib.sha1(repr(parts).encode()).hexdigest() + '"'
+
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    '''Whether an If-None-Match header lists etag, weakly compared.'''
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag
+                                   for tag in tags]
+
+
+def set_etag(response: Response, etag: str) -> None:
+    '''Let clients cache the response but revalidate it on every use.'''
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = CACHE_CONTROL
+
+
+def not_modified(etag: str) -> Response:
+    response = Response(status_code=304)
+    set_etag(response, etag)
+    return response
@@ -16,6 +16,41 @@ settings = Dynaconf(
         Validator('postgres_user', default='ccfatigue'),
         Validator('postgres_password', must_exist=True),
         Validator('postgres_db', default='ccfatigue'),
+        Validator('postgres_pool_min_size', default=1),
+        Validator('postgres_pool_max_size', default=10),
+        Validator('postgres_statement_cache_size', default=100),
+        Validator('postgres_command_timeout', default=30),
+        Validator('postgres_echo', default=False),
+        Validator('postgres_retry_seconds', default=10),
+        Validator('dataframe_cache_bytes', default=256 * 1024 * 1024),
+        Validator('plot_cache_bytes', default=64 * 1024 * 1024),
+        Validator('shared_cache_enabled', default=False),
+        Validator('gzip_minimum_size', default=1024),
+        Validator('gzip_level', default=6),
+        Validator('profiling_enabled', default=False),
+        Validator('decimation', default='lttb'),
+        Validator('decimation_max_points', default=2000),
+        Validator('fortran_timeout', default=60),
+        Validator('fortran_max_workers', default=4),
+        Validator('fortran_cache_bytes', default=64 * 1024 * 1024),
+        Validator('bootstrap_max_workers', default=0),
+        Validator('bootstrap_chunk_size', default=100),
+        Validator('bootstrap_max_replicates', default=10_000),
+        Validator('cycle_counting_chunk_size', default=1_000_000),
+        Validator('cycle_counting_max_matrix_size', default=1024),
+        Validator('pipeline_max_workers', default=4),
+        Validator('dashboard_max_workers', default=8),
+        Validator('jobs_directory', default='./cache/jobs'),
+        Validator('jobs_max_workers', default=2),
+        Validator('jobs_max_attempts', default=3),
+        Validator('jobs_interval_seconds', default=1),
+        Validator('jobs_retention_seconds', default=7 * 24 * 3600),
+        Validator('ingest_batch_size', default=100_000),
+        Validator('catalogue_directory', default='../Data'),
+        Validator('catalogue_refresh_seconds', default=10),
+        Validator('watcher_manifest', default='./cache/ingest_manifest.json'),
+        Validator('watcher_interval_seconds', default=30),
+        Validator('watcher_max_workers', default=4),
     ],
 )
 
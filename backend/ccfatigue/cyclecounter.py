@@ -0,0 +1,366 @@
+'''
+Cycle counting of load histories, ported from the
+CCFatigue_modules/1_CycleCounting executables.
+
+Histories are read in chunks and reduced to their turning points with NumPy.
+The counters run a single pass over a stack of unclosed reversals that is
+carried from one chunk to the next, so the cost is linear in the number of
+samples and the memory does not depend on the length of the history. Range-mean
+counting reads the raw samples, as its Fortran program does.
+Counted cycles are summarised in the same range/mean matrix as the Fortran
+output, except that the Fortran cells overlap by 1% of their width and count
+a cycle lying on a boundary in both cells: here every cycle is counted once.
+'''
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.errors import EmptyDataError
+
+from ccfatigue.config import settings
+from ccfatigue.model import CycleBin, CycleCountingMethod, CycleCountingResult
+
+MATRIX_SIZE: int = 64
+HALF: float = 0.5
+FULL: float = 1.0
+
+# (ranges, means, counts), one entry per counted cycle
+Cycles = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class History:
+    '''
+    Load history read by chunks, each pass starting over. The sample and
+    turning point totals are those of the last complete pass.
+    '''
+
+    def __init__(self):
+        self.n_samples = 0
+        self.n_turning_points = 0
+
+    def read_samples(self) -> Iterator[np.ndarray]:
+        raise NotImplementedError
+
+    def read_points(self) -> Iterator[np.ndarray]:
+        n_turning_points = 0
+        for points in stream_turning_points(self.read_samples()):
+            n_turning_points += len(points)
+            yield points
+        self.n_turning_points = n_turning_points
+
+
+class ArrayHistory(History):
+    '''In-memory history, read as a single chunk.'''
+
+    def __init__(self, values: np.ndarray):
+        super().__init__()
+        self.values = np.asarray(values, dtype=float)
+
+    def read_samples(self) -> Iterator[np.ndarray]:
+        yield self.values
+        self.n_samples = len(self.values)
+
+
+class HistoryReader(History):
+    '''Chunked reader of the first column of a headerless text file.'''
+
+    def __init__(self, file: BinaryIO, chunk_size: int):
+        super().__init__()
+        self.file = file
+        self.chunk_size = chunk_size
+
+    def read_samples(self) -> Iterator[np.ndarray]:
+        self.file.seek(0)
+        n_samples = 0
+        try:
+            reader = pd.read_csv(self.file, header=None, usecols=[0],
+                                 dtype=float, chunksize=self.chunk_size)
+        except EmptyDataError:
+            self.n_samples = 0
+            return
+        # closing the reader detaches it from the file, whereas a reader
+        # dropped by a partial pass would close the file
+        with reader:
+            for df in reader:
+                values = df[0].to_numpy()
+                n_samples += len(values)
+                yield values
+        self.n_samples = n_samples
+
+
+def get_turning_points(values: np.ndarray) -> np.ndarray:
+    '''Keep the first and last samples and every reversal of values.'''
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return values
+    values = values[np.r_[True, values[1:] != values[:-1]]]
+    if len(values) < 3:
+        return values
+    slopes = np.sign(np.diff(values))
+    reversals = slopes[1:] != slopes[:-1]
+    return values[np.r_[True, reversals, True]]
+
+
+def stream_turning_points(chunks: Iterable[np.ndarray]
+                          ) -> Iterator[np.ndarray]:
+    '''
+    Turning points of a chunked history. The last point of a chunk is held
+    back until the next chunk tells whether it is a reversal.
+    '''
+    # last emitted turning point, if any, followed by the pending point
+    carry = np.empty(0)
+    for chunk in chunks:
+        emitted = max(len(carry) - 1, 0)
+        points = get_turning_points(np.concatenate([carry, chunk]))
+        yield points[emitted:-1]
+        carry = points[-2:]
+    yield carry[max(len(carry) - 1, 0):]
+
+
+def count_stack(points: List[float],
+                half_start: bool,
+                stack: List[float]) -> List[Tuple[float, float, float]]:
+    '''
+    Three-point counting of ASTM E1049: a range that is not longer than the
+    following one closes a full cycle. With half_start, a range involving the
+    first point of the history is counted as a half cycle instead.
+    Return the counted (range, mean, count), leaving the residue in stack.
+    '''
+    cycles = []
+    for point in points:
+        stack.append(point)
+        while len(stack) >= 3:
+            x = abs(stack[-1] - stack[-2])
+            y = abs(stack[-2] - stack[-3])
+            if x < y:
+                break
+            mean = (stack[-2] + stack[-3]) / 2
+            if half_start and len(stack) == 3:
+                cycles.append((y, mean, HALF))
+                del stack[0]
+            else:
+                cycles.append((y, mean, FULL))
+                del stack[-3:-1]
+    return cycles
+
+
+def to_cycles(cycles: List[Tuple[float, float, float]]) -> Cycles:
+    array = np.array(cycles, dtype=float).reshape(-1, 3)
+    return array[:, 0], array[:, 1], array[:, 2]
+
+
+def count_half_cycles(points: np.ndarray) -> Cycles:
+    '''Count every range between consecutive points as a half cycle.'''
+    points = np.asarray(points, dtype=float)
+    ranges = np.abs(np.diff(points))
+    means = (points[1:] + points[:-1]) / 2
+    return ranges, means, np.full(len(ranges), HALF)
+
+
+def concat_cycles(parts: Iterable[Cycles]) -> Cycles:
+    return tuple(np.concatenate(arrays)
+                 for arrays in zip(to_cycles([]), *parts))
+
+
+def stream_stack(chunks: Iterable[np.ndarray],
+                 half_start: bool,
+                 count_residue: bool) -> Iterator[Cycles]:
+    stack: List[float] = []
+    for points in chunks:
+        yield to_cycles(count_stack(points.tolist(), half_start, stack))
+    if count_residue:
+        yield count_half_cycles(np.array(stack))
+
+
+def count_rainflow(history: History) -> Iterator[Cycles]:
+    '''Rainflow counting, the residue being counted as half cycles.'''
+    return stream_stack(history.read_points(), half_start=True,
+                        count_residue=True)
+
+
+def count_simplified_rainflow(history: History) -> Iterator[Cycles]:
+    '''
+    Rainflow counting of the history rearranged to start and end at its
+    highest peak, which leaves only full cycles. The history is read three
+    times: to find the peak, then from the peak to the end, then from the
+    beginning to the peak.
+    '''
+    top, top_index, first, last, size = -np.inf, 0, None, None, 0
+    for points in history.read_points():
+        if len(points) == 0:
+            continue
+        i = int(np.argmax(points))
+        if points[i] > top:
+            top, top_index = points[i], size + i
+        if first is None:
+            first = points[0]
+        last = points[-1]
+        size += len(points)
+    if size < 3:
+        return
+    # a closed history would repeat its boundary point
+    begin = 1 if first == last else 0
+
+    def read_rearranged() -> Iterator[np.ndarray]:
+        offset = 0
+        for points in history.read_points():
+            start = max(top_index - offset, 0)
+            if start < len(points):
+                yield points[start:]
+            offset += len(points)
+        offset = 0
+        for points in history.read_points():
+            start = max(begin - offset, 0)
+            end = min(top_index + 1 - offset, len(points))
+            if start < end:
+                yield points[start:end]
+            offset += len(points)
+            if offset > top_index:
+                break
+
+    yield from stream_stack(stream_turning_points(read_rearranged()),
+                            half_start=False, count_residue=False)
+
+
+def count_range_pair(history: History) -> Iterator[Cycles]:
+    '''Range-pair counting, the residue being discarded.'''
+    return stream_stack(history.read_points(), half_start=False,
+                        count_residue=False)
+
+
+def count_range_mean(history: History) -> Iterator[Cycles]:
+    '''
+    Simple range counting: every pair of consecutive samples is a half cycle,
+    whether or not they are turning points and even if they are equal.
+    '''
+    last = np.empty(0)
+    for samples in history.read_samples():
+        samples = np.concatenate([last, samples[~np.isnan(samples)]])
+        yield count_half_cycles(samples)
+        last = samples[-1:]
+
+
+COUNTERS: Dict[CycleCountingMethod, Callable[[History],
+                                             Iterator[Cycles]]] = {
+    CycleCountingMethod.RAINFLOW: count_rainflow,
+    CycleCountingMethod.SIMPLIFIED_RAINFLOW: count_simplified_rainflow,
+    CycleCountingMethod.RANGE_PAIR: count_range_pair,
+    CycleCountingMethod.RANGE_MEAN: count_range_mean,
+}
+
+
+def count_cycles(values: np.ndarray, method: CycleCountingMethod) -> Cycles:
+    '''Count the cycles of an in-memory history.'''
+    return concat_cycles(COUNTERS[method](ArrayHistory(values)))
+
+
+def get_bin_indexes(values: np.ndarray,
+                    low: float,
+                    high: float,
+                    size: int) -> np.ndarray:
+    width = (high - low) / size if high > low else 1.0
+    indexes = np.floor((values - low) / width).astype(np.int64)
+    return np.clip(indexes, 0, size - 1)
+
+
+def get_bin_centers(low: float, high: float, size: int) -> np.ndarray:
+    width = (high - low) / size
+    return low + (np.arange(size) + 0.5) * width
+
+
+def get_bounds(values: np.ndarray) -> Tuple[float, float]:
+    return float(values.min()), float(values.max())
+
+
+def merge_bounds(a: Tuple[float, float],
+                 b: Tuple[float, float]) -> Tuple[float, float]:
+    return min(a[0], b[0]), max(a[1], b[1])
+
+
+def add_to_matrix(matrix: np.ndarray,
+                  cycles: Cycles,
+                  range_bounds: Tuple[float, float],
+                  mean_bounds: Tuple[float, float]) -> None:
+    ranges, means, counts = cycles
+    size = matrix.shape[0]
+    cells = (get_bin_indexes(ranges, *range_bounds, size) * size
+             + get_bin_indexes(means, *mean_bounds, size))
+    matrix += np.bincount(cells, weights=counts,
+                          minlength=size * size).reshape(size, size)
+
+
+def create_matrix(cycles: Cycles,
+                  size: int) -> Tuple[np.ndarray,
+                                      Tuple[float, float],
+                                      Tuple[float, float]]:
+    '''size*size histogram of the cycle counts over (range, mean).'''
+    matrix = np.zeros((size, size))
+    if len(cycles[0]) == 0:
+        return matrix, (0.0, 0.0), (0.0, 0.0)
+    range_bounds, mean_bounds = get_bounds(cycles[0]), get_bounds(cycles[1])
+    add_to_matrix(matrix, cycles, range_bounds, mean_bounds)
+    return matrix, range_bounds, mean_bounds
+
+
+def create_bins(matrix: np.ndarray,
+                range_bounds: Tuple[float, float],
+                mean_bounds: Tuple[float, float]) -> List[CycleBin]:
+    '''
+    One bin per non-empty cell of the range/mean matrix, with the R ratio of
+    its center and the percentage of cycles in the following cells.
+    '''
+    size = matrix.shape[0]
+    range_indexes, mean_indexes = np.nonzero(matrix)
+    n_cycles = matrix[range_indexes, mean_indexes]
+    ranges = get_bin_centers(*range_bounds, size)[range_indexes]
+    means = get_bin_centers(*mean_bounds, size)[mean_indexes]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_ratios = (2 * means - ranges) / (2 * means + ranges)
+    total = n_cycles.sum()
+    cumulative = (total - np.cumsum(n_cycles)) * 100 / total
+    return [
+        CycleBin(range=r, mean=m, r_ratio=rr, n_cycles=n, cumulative=c)
+        for r, m, rr, n, c in zip(ranges.tolist(), means.tolist(),
+                                  np.nan_to_num(r_ratios).tolist(),
+                                  n_cycles.tolist(), cumulative.tolist())
+    ]
+
+
+def run_cycle_counting(file: BinaryIO,
+                       method: CycleCountingMethod,
+                       matrix_size: int = MATRIX_SIZE,
+                       chunk_size: int = settings.cycle_counting_chunk_size
+                       ) -> CycleCountingResult:
+    '''
+    Count the cycles of the uploaded history by chunks. As in the Fortran
+    programs, the matrix spans the ranges and means of the counted cycles:
+    a first pass over the upload finds them, a second one fills the matrix.
+    '''
+    reader = HistoryReader(file, chunk_size)
+    count = COUNTERS[method]
+    range_bounds, mean_bounds = (np.inf, -np.inf), (np.inf, -np.inf)
+    n_cycles = 0.0
+    for cycles in count(reader):
+        if len(cycles[0]) == 0:
+            continue
+        range_bounds = merge_bounds(range_bounds, get_bounds(cycles[0]))
+        mean_bounds = merge_bounds(mean_bounds, get_bounds(cycles[1]))
+        n_cycles += float(cycles[2].sum())
+    matrix = np.zeros((matrix_size, matrix_size))
+    if range_bounds[0] <= range_bounds[1]:
+        for cycles in count(reader):
+            add_to_matrix(matrix, cycles, range_bounds, mean_bounds)
+    else:
+        range_bounds, mean_bounds = (0.0, 0.0), (0.0, 0.0)
+    if method == CycleCountingMethod.RANGE_MEAN:
+        # the counter reads the samples only
+        for _ in reader.read_points():
+            pass
+    return CycleCountingResult(
+        method=method,
+        n_samples=reader.n_samples,
+        n_turning_points=reader.n_turning_points,
+        n_cycles=n_cycles,
+        bins=create_bins(matrix, range_bounds, mean_bounds),
+    )
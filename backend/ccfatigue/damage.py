@@ -0,0 +1,55 @@
+'''
+Palmgren-Miner damage summation, ported from
+CCFatigue_modules/5_DammageSummation.
+
+The allowable number of cycles of every counted cycle is found by bisection
+on log10(N) of a constant life diagram, for all cycles and load factors at
+once.
+'''
+from typing import List
+
+import numpy as np
+
+from ccfatigue.cld import Amplitude
+from ccfatigue.model import CycleBin, FatigueLife
+
+MIN_LOG_CYCLES: float = 0
+MAX_LOG_CYCLES: float = 25
+BISECTIONS: int = 60
+
+
+def get_allowable_cycles(amplitude: Amplitude,
+                         amplitudes: np.ndarray,
+                         means: np.ndarray) -> np.ndarray:
+    '''Number of cycles at which the diagram allows the given amplitudes,
+    infinite below its lowest curve.'''
+    low = np.full(amplitudes.shape, MIN_LOG_CYCLES)
+    high = np.full(amplitudes.shape, MAX_LOG_CYCLES)
+    for _ in range(BISECTIONS):
+        middle = (low + high) / 2
+        survives = amplitude(10 ** middle, means) >= amplitudes
+        low = np.where(survives, middle, low)
+        high = np.where(survives, high, middle)
+    n_cycles = 10 ** low
+    n_cycles[amplitude(10 ** high, means) >= amplitudes] = np.inf
+    return n_cycles
+
+
+def sum_damage(amplitude: Amplitude,
+               bins: List[CycleBin],
+               factors: List[float]) -> List[FatigueLife]:
+    '''Damage of one pass of the spectrum scaled by each factor, and the
+    number of passes to failure, None when the spectrum does no damage.'''
+    ranges = np.array([b.range for b in bins])
+    means = np.array([b.mean for b in bins])
+    counts = np.array([b.n_cycles for b in bins])
+    scales = np.array(factors)[:, None]
+    amplitudes, means = scales * ranges / 2, scales * means
+    n_cycles = get_allowable_cycles(amplitude, amplitudes, means)
+    damages = np.sum(counts / n_cycles, axis=1)
+    max_stresses = np.max(amplitudes + means, axis=1, initial=0)
+    return [
+        FatigueLife(factor=f, max_stress=s, damage=d,
+                    n_blocks=1 / d if d > 0 else None)
+        for f, s, d in zip(factors, max_stresses.tolist(), damages.tolist())
+    ]
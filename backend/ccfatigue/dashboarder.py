@@ -1,15 +1,18 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
-import pandas as pd
 from bokeh import palettes
 from pandas.core.frame import DataFrame
 from pydantic import BaseModel
 
-from ccfatigue import plotter
-from ccfatigue.plotter import DataKey, Line, Plot
+from ccfatigue import (
+    cache, conditional, instrumentation, metrics, plotter, pyramid, storage)
+from ccfatigue.config import settings
+from ccfatigue.plotter import DataKey, Decimation, Line, Plot, PlotFormat
 
 DATA_DIRECTORY: str = '../data/'
 
@@ -17,27 +20,42 @@ INTERVAL: int = 10
 LOOP_SPACING: int = 1000
 MAGNITUDE: int = -3
 
+STD_COLUMNS: List[str] = ['Machine_N_cycles',
+                          'Machine_Load',
+                          'Machine_Displacement']
+HYS_COLUMNS: List[str] = ['n_cycles', 'creep', 'hysteresis_area', 'stiffness']
+
+dataframe_cache = cache.get_cache('dataframe',
+                                  settings.dataframe_cache_bytes,
+                                  settings.shared_cache_enabled)
+plot_cache = cache.get_cache('plot',
+                             settings.plot_cache_bytes,
+                             settings.shared_cache_enabled)
+executor = ThreadPoolExecutor(max_workers=settings.dashboard_max_workers)
+
 
 class Test(BaseModel):
     number: int
     color: str
     total_dissipated_energy: int
+    strain_at_failure: Optional[float]
 
 
 class Dashboard(BaseModel):
     tests: List[Test]
+    timings: Dict[str, float]
     stress_strain: Any
     creep: Any
     hysteresis_area: Any
     stiffness: Any
 
 
-def get_dataframe(data_in: str,
-                  laboratory: str,
-                  researcher: str,
-                  experience_type: str,
-                  date: date,
-                  test_number: int) -> DataFrame:
+def get_filepath(data_in: str,
+                 laboratory: str,
+                 researcher: str,
+                 experience_type: str,
+                 date: date,
+                 test_number: int) -> str:
     formatted_date = date.isoformat()
     filename = f'{data_in}_{formatted_date}_{experience_type}_{test_number:03d}.csv'
     filepath = os.path.join(DATA_DIRECTORY,
@@ -47,7 +65,32 @@ def get_dataframe(data_in: str,
                             formatted_date,
                             data_in,
                             filename)
-    return pd.read_csv(os.path.abspath(filepath))
+    return os.path.abspath(filepath)
+
+
+def get_source(filepath: str) -> Tuple:
+    '''Identify the current content of a data file for cache keys.'''
+    fingerprint = storage.get_fingerprint(filepath)
+    return (filepath, fingerprint['mtime_ns'], fingerprint['size'])
+
+
+def get_dataframe(data_in: str,
+                  laboratory: str,
+                  researcher: str,
+                  experience_type: str,
+                  date: date,
+                  test_number: int,
+                  columns: Optional[List[str]] = None) -> DataFrame:
+    filepath = get_filepath(data_in, laboratory, researcher, experience_type,
+                            date, test_number)
+    key = (get_source(filepath), tuple(columns or ()))
+
+    def read() -> DataFrame:
+        with instrumentation.span('read_csv') as span:
+            df = storage.read_csv(filepath, columns)
+            span.rows = len(df)
+        return df
+    return dataframe_cache.get_or_compute(key, read)
 
 
 def compute_sub_indexes(df: DataFrame) -> List[int]:
@@ -62,35 +105,57 @@ def compute_sub_indexes(df: DataFrame) -> List[int]:
     return sub_index
 
 
+def extract_loops(n_cycles: np.ndarray,
+                  columns: List[np.ndarray],
+                  sub_index: List[int]) -> List[List[np.ndarray]]:
+    '''Extract the rows of each cycle in sub_index as slices of columns.
+
+    The cycle column is sorted once (skipped when already monotonic) and
+    every requested cycle is located with a single searchsorted pass, so the
+    cost is O(rows + loops * log(rows)) instead of O(rows * loops).
+    '''
+    n_cycles = np.asarray(n_cycles)
+    if n_cycles.size > 1 and np.any(n_cycles[1:] < n_cycles[:-1]):
+        order = np.argsort(n_cycles, kind='stable')
+        n_cycles = n_cycles[order]
+        columns = [np.asarray(column)[order] for column in columns]
+    else:
+        columns = [np.asarray(column) for column in columns]
+    sub_index = np.asarray(sub_index)
+    starts = np.searchsorted(n_cycles, sub_index, side='left')
+    ends = np.searchsorted(n_cycles, sub_index, side='right')
+    return [[column[start:end] for column in columns]
+            for start, end in zip(starts, ends)]
+
+
 def create_sub_hystloops(df: DataFrame,
                          sub_index: List[int]) -> List[Dict[DataKey, List]]:
     # Conditional plotting of hysteresis loops - we only plot the loops specified by sub_index
+    with instrumentation.span('extract_loops', len(df)):
+        loops = extract_loops(df.Machine_N_cycles.to_numpy(),
+                              [df.Machine_N_cycles.to_numpy(),
+                               df.Machine_Displacement.to_numpy(),
+                               df.Machine_Load.to_numpy()],
+                              sub_index)
     sub_hystloops = []
-    for j in range(len(sub_index)):
-        sub_hystloops_strain = []
-        sub_hystloops_stress = []
-        sub_hystloops_ncycles = []
-        for i in range(len(df)):
-            if df.Machine_N_cycles[i] == sub_index[j]:
-                sub_hystloops_strain.append(df.Machine_Displacement[i])
-                sub_hystloops_stress.append(df.Machine_Load[i])
-                sub_hystloops_ncycles.append(df.Machine_N_cycles[i])
+    for ncycles, strain, stress in loops:
         # make curve closed // Optional
-        if len(sub_hystloops_ncycles) != 0:
-            sub_hystloops_strain.append(sub_hystloops_strain[0])
-            sub_hystloops_stress.append(sub_hystloops_stress[0])
-            sub_hystloops_ncycles.append(sub_hystloops_ncycles[0])
-        sub_hystloops.append({DataKey.N_CYCLES: sub_hystloops_ncycles,
-                              DataKey.STRAIN: sub_hystloops_strain,
-                              DataKey.STRESS: sub_hystloops_stress})
+        if len(ncycles) != 0:
+            ncycles = np.append(ncycles, ncycles[0])
+            strain = np.append(strain, strain[0])
+            stress = np.append(stress, stress[0])
+        sub_hystloops.append({DataKey.N_CYCLES: ncycles.tolist(),
+                              DataKey.STRAIN: strain.tolist(),
+                              DataKey.STRESS: stress.tolist()})
     return sub_hystloops
 
 
 def generate_stress_strain(tests: List[Test],
                            std_dfs: List[DataFrame],
                            hyst_dfs: List[DataFrame]) -> Plot:
-    sub_hystloops = [create_sub_hystloops(std_df, compute_sub_indexes(hyst_df))
-                     for std_df, hyst_df in zip(std_dfs, hyst_dfs)]
+    sub_hystloops = [
+        create_sub_hystloops(std_df, compute_sub_indexes(hyst_df))
+        for std_df, hyst_df in zip(std_dfs, hyst_dfs)]
     lines = [
         Line(
             data=loop,
@@ -113,8 +178,8 @@ def generate_creep(tests: List[Test],
                    hyst_dfs: List[DataFrame]) -> Plot:
     lines = [Line(
         data={
-            DataKey.N_CYCLES: hyst_df['n_cycles'].to_list(),
-            DataKey.CREEP: hyst_df['creep'].to_list(),
+            DataKey.N_CYCLES: hyst_df['n_cycles'].to_numpy(),
+            DataKey.CREEP: hyst_df['creep'].to_numpy(),
         },
         legend_label=test.number,
         color=test.color,
@@ -124,6 +189,8 @@ def generate_creep(tests: List[Test],
         x_axis=DataKey.N_CYCLES,
         y_axis=DataKey.CREEP,
         tooltips=[DataKey.CREEP, DataKey.N_CYCLES],
+        decimation=Decimation(settings.decimation),
+        max_points=settings.decimation_max_points,
         lines=lines,
     )
 
@@ -132,8 +199,8 @@ def generate_hyst_area(tests: List[Test],
                        hyst_dfs: List[DataFrame]) -> Plot:
     lines = [Line(
         data={
-            DataKey.N_CYCLES: hyst_df['n_cycles'].to_list(),
-            DataKey.HYST_AREA: hyst_df['hysteresis_area'].to_list(),
+            DataKey.N_CYCLES: hyst_df['n_cycles'].to_numpy(),
+            DataKey.HYST_AREA: hyst_df['hysteresis_area'].to_numpy(),
         },
         legend_label=test.number,
         color=test.color,
@@ -143,6 +210,8 @@ def generate_hyst_area(tests: List[Test],
         x_axis=DataKey.N_CYCLES,
         y_axis=DataKey.HYST_AREA,
         tooltips=[DataKey.HYST_AREA, DataKey.N_CYCLES],
+        decimation=Decimation(settings.decimation),
+        max_points=settings.decimation_max_points,
         lines=lines,
     )
 
@@ -151,8 +220,8 @@ def generate_stiffness(tests: List[Test],
                        hyst_dfs: List[DataFrame]) -> Plot:
     lines = [Line(
         data={
-            DataKey.N_CYCLES: hyst_df['n_cycles'].to_list(),
-            DataKey.STIFNESS: hyst_df['stiffness'].to_list(),
+            DataKey.N_CYCLES: hyst_df['n_cycles'].to_numpy(),
+            DataKey.STIFNESS: hyst_df['stiffness'].to_numpy(),
         },
         legend_label=test.number,
         color=test.color,
@@ -162,45 +231,189 @@ def generate_stiffness(tests: List[Test],
         x_axis=DataKey.N_CYCLES,
         y_axis=DataKey.STIFNESS,
         tooltips=[DataKey.STIFNESS, DataKey.N_CYCLES],
+        decimation=Decimation(settings.decimation),
+        max_points=settings.decimation_max_points,
         lines=lines,
     )
 
 
-def get_total_dissipated_energy(hyst_df: DataFrame) -> int:
-    return np.sum(hyst_df['hysteresis_area'])
+def get_total_dissipated_energy(hys_filepath: str, hyst_df: DataFrame) -> int:
+    return storage.read_derived(
+        hys_filepath, 'energy',
+        lambda: {'total': float(np.sum(hyst_df['hysteresis_area']))}
+    )['total']
 
 
-def generate_dashboard(laboratory: str,
+def get_strain_at_failure(std_filepath: str,
+                          std_df: DataFrame) -> Optional[float]:
+    def compute() -> Dict:
+        cycles = metrics.get_cycle_metrics(
+            std_df['Machine_N_cycles'].to_numpy(dtype=float),
+            std_df['Machine_Displacement'].to_numpy(dtype=float),
+            std_df['Machine_Load'].to_numpy(dtype=float))
+        return metrics.get_test_metrics(cycles)
+
+    return storage.read_derived(std_filepath, 'metrics',
+                                compute)['strain_at_failure']
+
+
+def get_plot(name: str,
+             sources: Tuple,
+             generate: Callable[[], Plot],
+             plot_format: PlotFormat = PlotFormat.BOKEH) -> Any:
+    def export() -> Any:
+        with instrumentation.span(f'generate_{name}'):
+            plot = generate()
+        return plotter.export_plot(plot, plot_format=plot_format)
+    return plot_cache.get_or_compute((name, sources, plot_format), export)
+
+
+def get_colors(n: int) -> List[str]:
+    '''The palette cycled over n tests.'''
+    return [palettes.Category10_10[i % 10] for i in range(n)]
+
+
+def get_elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
+def get_test_source(laboratory: str,
+                    researcher: str,
+                    experience_type: str,
+                    date: date,
+                    test_number: int) -> Tuple:
+    '''Test number and STD and HYS file fingerprints, all a dashboard of
+    the test depends on.'''
+    return (test_number,) + tuple(
+        get_source(get_filepath(data_in, laboratory, researcher,
+                                experience_type, date, test_number))
+        for data_in in ['STD', 'HYS'])
+
+
+def get_dashboard_etag(laboratory: str,
                        researcher: str,
                        experience_type: str,
                        date: date,
-                       test_numbers: List[int]) -> Dashboard:
-    colors = list(palettes.Category10_10)[:len(test_numbers)]
-    std_dfs = [get_dataframe('STD', laboratory, researcher, experience_type,
-                             date, test_number)
-               for test_number in test_numbers]
-    hyst_dfs = [get_dataframe('HYS', laboratory, researcher, experience_type,
-                              date, test_number)
-                for test_number in test_numbers]
-    tests = [
-        Test(
-            number=test_number,
-            color=color,
-            total_dissipated_energy=get_total_dissipated_energy(hyst_df)
-        )
-        for test_number, color, hyst_df in zip(test_numbers, colors, hyst_dfs)
-    ]
-    return Dashboard(
-        tests=tests,
-        stress_strain=plotter.export_plot(
-            generate_stress_strain(tests, std_dfs, hyst_dfs)),
-        creep=plotter.export_plot(generate_creep(tests, hyst_dfs)),
-        hysteresis_area=plotter.export_plot(
-            generate_hyst_area(tests, hyst_dfs)),
-        stiffness=plotter.export_plot(generate_stiffness(tests, hyst_dfs)),
+                       test_numbers: List[int],
+                       plot_format: PlotFormat) -> str:
+    '''ETag of a dashboard, from file metadata only.'''
+    sources = tuple(get_test_source(laboratory, researcher, experience_type,
+                                    date, test_number)
+                    for test_number in test_numbers)
+    return conditional.make_etag(sources, plot_format.value,
+                                 settings.decimation,
+                                 settings.decimation_max_points)
+
+
+def get_series_range_etag(laboratory: str,
+                          researcher: str,
+                          experience_type: str,
+                          date: date,
+                          test_number: int,
+                          *params: Any) -> str:
+    filepath = get_filepath('HYS', laboratory, researcher, experience_type,
+                            date, test_number)
+    return conditional.make_etag(get_source(filepath), params)
+
+
+def load_test(laboratory: str,
+              researcher: str,
+              experience_type: str,
+              date: date,
+              test_number: int) -> Tuple[DataFrame, DataFrame, Tuple]:
+    '''STD and HYS dataframes of a test, and their sources for cache keys.'''
+    std_df = get_dataframe('STD', laboratory, researcher, experience_type,
+                           date, test_number, STD_COLUMNS)
+    hyst_df = get_dataframe('HYS', laboratory, researcher, experience_type,
+                            date, test_number, HYS_COLUMNS)
+    source = get_test_source(laboratory, researcher, experience_type, date,
+                             test_number)
+    return std_df, hyst_df, source
+
+
+def derive_test(source: Tuple,
+                color: str,
+                std_df: DataFrame,
+                hyst_df: DataFrame) -> Test:
+    test_number, std_source, hys_source = source
+    return Test(
+        number=test_number,
+        color=color,
+        total_dissipated_energy=get_total_dissipated_energy(hys_source[0],
+                                                            hyst_df),
+        strain_at_failure=get_strain_at_failure(std_source[0], std_df),
     )
 
 
+def generate_dashboard(laboratory: str,
+                       researcher: str,
+                       experience_type: str,
+                       date: date,
+                       test_numbers: List[int],
+                       plot_format: PlotFormat = PlotFormat.BOKEH
+                       ) -> Dashboard:
+    '''
+    Tests are loaded and derived on the dashboard executor, one task per
+    test, then the four figures are built on it concurrently. The wall time
+    of every stage, and of every figure, is reported in timings (ms).
+    '''
+    timings = {}
+    start = time.perf_counter()
+    colors = get_colors(len(test_numbers))
+    loaded = list(executor.map(
+        instrumentation.in_context(
+            lambda test_number: load_test(laboratory, researcher,
+                                          experience_type, date,
+                                          test_number)),
+        test_numbers))
+    std_dfs = [std_df for std_df, _, _ in loaded]
+    hyst_dfs = [hyst_df for _, hyst_df, _ in loaded]
+    sources = tuple(source for _, _, source in loaded)
+    timings['load'] = get_elapsed_ms(start)
+
+    start = time.perf_counter()
+    tests = list(executor.map(instrumentation.in_context(derive_test),
+                              sources, colors, std_dfs, hyst_dfs))
+    timings['derive'] = get_elapsed_ms(start)
+
+    def build(name: str, generate: Callable[[], Plot]) -> Any:
+        start = time.perf_counter()
+        plot = get_plot(name, sources, generate, plot_format)
+        timings[f'plot_{name}'] = get_elapsed_ms(start)
+        return plot
+
+    start = time.perf_counter()
+    plots = {
+        name: executor.submit(instrumentation.in_context(build), name,
+                              generate)
+        for name, generate in [
+            ('stress_strain',
+             lambda: generate_stress_strain(tests, std_dfs, hyst_dfs)),
+            ('creep', lambda: generate_creep(tests, hyst_dfs)),
+            ('hysteresis_area', lambda: generate_hyst_area(tests, hyst_dfs)),
+            ('stiffness', lambda: generate_stiffness(tests, hyst_dfs)),
+        ]
+    }
+    plots = {name: future.result() for name, future in plots.items()}
+    timings['plots'] = get_elapsed_ms(start)
+    return Dashboard(tests=tests, timings=timings, **plots)
+
+
+def get_series_range(laboratory: str,
+                     researcher: str,
+                     experience_type: str,
+                     date: date,
+                     test_number: int,
+                     column: str,
+                     n_cycles_min: float,
+                     n_cycles_max: float,
+                     max_points: int) -> Tuple[int, np.ndarray, np.ndarray]:
+    filepath = get_filepath('HYS', laboratory, researcher, experience_type,
+                            date, test_number)
+    return pyramid.query(filepath, column, n_cycles_min, n_cycles_max,
+                         max_points)
+
+
 def main():
     dashboard = generate_dashboard(laboratory='CCLAB',
                                    researcher='Vahid',
@@ -0,0 +1,333 @@
+'''
+Off-axis fatigue failure criteria, ported from
+CCFatigue_modules/4_FatigueFailure.
+
+Every criterion predicts the maximum cyclic stress of a unidirectional
+laminate loaded at an off-axis angle, for a grid of angles, R ratios and
+numbers of cycles evaluated in a single broadcast NumPy call.
+'''
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ccfatigue import cld, plotter
+from ccfatigue.model import (
+    FailureCriterion, FailureEnvelope, FailureResult, SnModel)
+from ccfatigue.plotter import DataKey, Line, Plot
+from ccfatigue.sncurve import Dataset
+
+
+class Laminate:
+    '''Static strengths of the unidirectional ply. The compressive ones are
+    only needed by Shokrieh-Taheri for R >= 1.'''
+
+    def __init__(self,
+                 tensile_axial: float,
+                 tensile_transverse: float,
+                 shear: float,
+                 compressive_axial: Optional[float] = None,
+                 compressive_transverse: Optional[float] = None):
+        self.tensile_axial = tensile_axial
+        self.tensile_transverse = tensile_transverse
+        self.shear = shear
+        self.compressive_axial = compressive_axial
+        self.compressive_transverse = compressive_transverse
+
+
+class SnFit:
+    '''S-N curve: stress = a * N ** -b, or a + b * log10(N) in Lin-Log.'''
+
+    def __init__(self, model: SnModel, a: float, b: float):
+        self.model = model
+        self.a = a
+        self.b = b
+
+    def stress(self, n_cycles: np.ndarray) -> np.ndarray:
+        if self.model == SnModel.LOG_LOG:
+            return self.a * n_cycles ** -self.b
+        return self.a + self.b * np.log10(n_cycles)
+
+
+def fit_sn(dataset: Dataset, model: SnModel) -> SnFit:
+    if model == SnModel.LOG_LOG:
+        return SnFit(model, *cld.fit_power_law(dataset.n_cycles,
+                                                dataset.stress))
+    # regression of log10(N) on the stress, N being the dependent variable
+    slope, intercept = np.polyfit(dataset.stress, np.log10(dataset.n_cycles),
+                                  1)
+    return SnFit(model, -intercept / slope, 1 / slope)
+
+
+class FailureInputs:
+    '''
+    Data of a criterion: the S-N curves of the axial, transverse and shear
+    tests for FTPF and Sims-Brogdon; two of the transverse, shear and
+    reference tests and the static strengths for Hashin-Rotem, which also
+    takes the static strength of the reference tests (Tsai-Hill's by
+    default); the reference off-axis tests and the static strengths for the
+    others.
+    '''
+
+    def __init__(self,
+                 model: SnModel = SnModel.LOG_LOG,
+                 laminate: Optional[Laminate] = None,
+                 reference: Optional[Dataset] = None,
+                 reference_angle: float = 0,
+                 reference_strength: Optional[float] = None,
+                 axial: Optional[Dataset] = None,
+                 transverse: Optional[Dataset] = None,
+                 shear: Optional[Dataset] = None):
+        self.model = model
+        self.laminate = laminate
+        self.reference = reference
+        self.reference_angle = reference_angle
+        self.reference_strength = reference_strength
+        self.axial = axial
+        self.transverse = transverse
+        self.shear = shear
+
+    def require(self, criterion: FailureCriterion, *names: str) -> None:
+        missing = [name for name in names if getattr(self, name) is None]
+        if missing:
+            raise ValueError(f'{criterion.value} needs {", ".join(missing)}')
+
+
+def get_projections(angles: np.ndarray) -> Tuple[np.ndarray, np.ndarray,
+                                                np.ndarray]:
+    '''cos^4, sin^4 and sin^2 cos^2 of angles in degrees.'''
+    theta = np.radians(angles)
+    cos2, sin2 = np.cos(theta) ** 2, np.sin(theta) ** 2
+    return cos2 ** 2, sin2 ** 2, sin2 * cos2
+
+
+def get_static_strength(laminate: Laminate, angles: np.ndarray) -> np.ndarray:
+    '''Tsai-Hill off-axis tensile strength.'''
+    c4, s4, s2c2 = get_projections(angles)
+    x, y, s = (laminate.tensile_axial, laminate.tensile_transverse,
+               laminate.shear)
+    return (c4 / x ** 2 + s4 / y ** 2
+            + s2c2 * (1 / s ** 2 - 1 / x ** 2)) ** -0.5
+
+
+def evaluate_quadratic(inputs: FailureInputs,
+                       criterion: FailureCriterion,
+                       angles: np.ndarray,
+                       n_cycles: np.ndarray) -> np.ndarray:
+    inputs.require(criterion, 'axial', 'transverse', 'shear')
+    x, y, s = (fit_sn(dataset, inputs.model).stress(n_cycles)
+               for dataset in [inputs.axial, inputs.transverse, inputs.shear])
+    interaction = (1 / (x * y) if criterion == FailureCriterion.FTPF
+                   else 1 / x ** 2)
+    c4, s4, s2c2 = get_projections(angles)
+    with np.errstate(invalid='ignore'):
+        return (c4 / x ** 2 + s4 / y ** 2
+                + s2c2 * (1 / s ** 2 - interaction)) ** -0.5
+
+
+def evaluate_ftpf(inputs: FailureInputs,
+                  angles: np.ndarray,
+                  r_ratios: np.ndarray,
+                  n_cycles: np.ndarray) -> np.ndarray:
+    '''Fatigue Tsai-Hill, the S-N curves standing for the strengths.'''
+    return evaluate_quadratic(inputs, FailureCriterion.FTPF, angles,
+                              n_cycles)
+
+
+def evaluate_sims_brogdon(inputs: FailureInputs,
+                          angles: np.ndarray,
+                          r_ratios: np.ndarray,
+                          n_cycles: np.ndarray) -> np.ndarray:
+    return evaluate_quadratic(inputs, FailureCriterion.SIMS_BROGDON, angles,
+                              n_cycles)
+
+
+def evaluate_fawaz_ellyin(inputs: FailureInputs,
+                          angles: np.ndarray,
+                          r_ratios: np.ndarray,
+                          n_cycles: np.ndarray) -> np.ndarray:
+    '''Reference S-N curve scaled by the ratio of static strengths f and by
+    the R ratio function g.'''
+    inputs.require(FailureCriterion.FAWAZ_ELLYIN, 'reference', 'laminate')
+    reference = fit_sn(inputs.reference, inputs.model)
+    reference_r_ratio = inputs.reference.r_ratio
+    static = get_static_strength(inputs.laminate, angles)
+    reference_static = get_static_strength(inputs.laminate,
+                                           inputs.reference_angle)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g = np.where(
+            (r_ratios == reference_r_ratio) | (r_ratios <= 0), 1,
+            np.where(r_ratios == 1, 0,
+                     np.abs((1 - r_ratios) / (1 - reference_r_ratio))))
+    if inputs.model == SnModel.LIN_LOG:
+        f = static / reference_static
+        return f * reference.a + f * g * reference.b * np.log10(n_cycles)
+    f = np.log10(static) / np.log10(reference_static)
+    return reference.a ** f * n_cycles ** -(f * g * reference.b)
+
+
+def evaluate_kawai(inputs: FailureInputs,
+                   angles: np.ndarray,
+                   r_ratios: np.ndarray,
+                   n_cycles: np.ndarray) -> np.ndarray:
+    '''Modified Fawaz-Ellyin criterion of Kawai, on the non-dimensional
+    effective stress of the reference tests.'''
+    inputs.require(FailureCriterion.KAWAI, 'reference', 'laminate')
+    reference = inputs.reference
+    reference_static = get_static_strength(inputs.laminate,
+                                           inputs.reference_angle)
+    normalized = reference.stress / reference_static
+    effective = (0.5 * (1 - reference.r_ratio) * normalized
+                 / (1 - 0.5 * (1 + reference.r_ratio) * normalized))
+    # log10(2N) = -n* log10(effective stress), fitted through the origin
+    x, y = np.log10(effective), np.log10(2 * reference.n_cycles)
+    exponent = -np.sum(x * y) / np.sum(x ** 2)
+    omega = 1 / get_static_strength(inputs.laminate, angles)
+    sigma = (2 * n_cycles) ** (-1 / exponent)
+    return 2 * sigma / (omega * ((1 - r_ratios) + (1 + r_ratios) * sigma))
+
+
+def evaluate_shokrieh_taheri(inputs: FailureInputs,
+                             angles: np.ndarray,
+                             r_ratios: np.ndarray,
+                             n_cycles: np.ndarray) -> np.ndarray:
+    '''Strain energy criterion of Shokrieh and Taheri-Behrooz.'''
+    inputs.require(FailureCriterion.SHOKRIEH_TAHERI, 'reference', 'laminate')
+    laminate, reference = inputs.laminate, inputs.reference
+
+    def transform(angles: np.ndarray, r_ratios: np.ndarray) -> np.ndarray:
+        c4, s4, s2c2 = get_projections(angles)
+        compressive = r_ratios >= 1
+        if np.any(compressive) and None in [laminate.compressive_axial,
+                                            laminate.compressive_transverse]:
+            raise ValueError(f'{FailureCriterion.SHOKRIEH_TAHERI.value} '
+                             'needs the compressive strengths for R >= 1')
+        x = np.where(compressive, np.abs(laminate.compressive_axial or 0),
+                     laminate.tensile_axial)
+        y = np.where(compressive,
+                     np.abs(laminate.compressive_transverse or 0),
+                     laminate.tensile_transverse)
+        return c4 / x ** 2 + s4 / y ** 2 + s2c2 / laminate.shear ** 2
+
+    reference_r_ratio = np.array(reference.r_ratio)
+    energy = ((1 - reference_r_ratio ** 2) * reference.stress ** 2
+              * transform(np.array(inputs.reference_angle),
+                          reference_r_ratio))
+    a, b = cld.fit_power_law(reference.n_cycles, energy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(a * n_cycles ** -b
+                       / ((1 - r_ratios ** 2) * transform(angles, r_ratios)))
+
+
+def get_matrix_weights(laminate: Laminate,
+                       angles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''Shares of the transverse and shear stresses in the Hashin-Rotem
+    matrix mode at angles in degrees, relative to the static strengths.'''
+    theta = np.radians(angles)
+    transverse = (laminate.shear * np.sin(theta)) ** 2
+    shear = (laminate.tensile_transverse * np.cos(theta)) ** 2
+    return transverse / (transverse + shear), shear / (transverse + shear)
+
+
+def evaluate_hashin_rotem(inputs: FailureInputs,
+                          angles: np.ndarray,
+                          r_ratios: np.ndarray,
+                          n_cycles: np.ndarray) -> np.ndarray:
+    '''
+    Matrix mode of Hashin and Rotem. Each of two tests, among the transverse,
+    shear and reference ones, gives a linear equation in 1/ft^2 and 1/fs^2,
+    ft and fs being the transverse and shear fatigue functions. As in the
+    Fortran program, the S-N curves are of a single R ratio, and the
+    compressive strengths are used when it is >= 1.
+    '''
+    criterion = FailureCriterion.HASHIN_ROTEM
+    inputs.require(criterion, 'laminate')
+    laminate = inputs.laminate
+    tests = [(90.0, inputs.transverse, None),
+             (0.0, inputs.shear, laminate.shear),
+             (inputs.reference_angle, inputs.reference,
+              inputs.reference_strength)]
+    tests = [test for test in tests if test[1] is not None]
+    if len(tests) != 2:
+        raise ValueError(f'{criterion.value} needs two of transverse, shear '
+                         'and reference')
+    if tests[0][1].r_ratio >= 1:
+        if None in [laminate.compressive_axial,
+                    laminate.compressive_transverse]:
+            raise ValueError(f'{criterion.value} needs the compressive '
+                             'strengths for R >= 1')
+        laminate = Laminate(abs(laminate.compressive_axial),
+                            abs(laminate.compressive_transverse),
+                            laminate.shear)
+    coefficients = []
+    for angle, dataset, strength in tests:
+        if strength is None:
+            strength = get_static_strength(laminate, angle)
+        ratio = fit_sn(dataset, inputs.model).stress(n_cycles) / strength
+        coefficients.append([ratio ** 2 * weight
+                             for weight in get_matrix_weights(laminate,
+                                                              angle)])
+    (a1, b1), (a2, b2) = coefficients
+    transverse, shear = get_matrix_weights(laminate, angles)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        determinant = a1 * b2 - a2 * b1
+        # 1/ft^2 and 1/fs^2
+        u, v = (b2 - b1) / determinant, (a1 - a2) / determinant
+        stress = (get_static_strength(laminate, angles)
+                  / np.sqrt(transverse * u + shear * v))
+        return np.where((u > 0) & (v > 0), stress, np.nan)
+
+
+CRITERIA: Dict[FailureCriterion, Callable[..., np.ndarray]] = {
+    FailureCriterion.FTPF: evaluate_ftpf,
+    FailureCriterion.SIMS_BROGDON: evaluate_sims_brogdon,
+    FailureCriterion.FAWAZ_ELLYIN: evaluate_fawaz_ellyin,
+    FailureCriterion.KAWAI: evaluate_kawai,
+    FailureCriterion.SHOKRIEH_TAHERI: evaluate_shokrieh_taheri,
+    FailureCriterion.HASHIN_ROTEM: evaluate_hashin_rotem,
+}
+
+
+def evaluate(criterion: FailureCriterion,
+             inputs: FailureInputs,
+             angles: List[float],
+             r_ratios: List[float],
+             n_cycles: List[float]) -> np.ndarray:
+    '''Maximum cyclic stress over the (angle, R ratio, N) grid.'''
+    grid = np.meshgrid(np.asarray(angles, dtype=float),
+                       np.asarray(r_ratios, dtype=float),
+                       np.asarray(n_cycles, dtype=float),
+                       indexing='ij', sparse=True)
+    stress = CRITERIA[criterion](inputs, *grid)
+    return np.broadcast_to(stress, (len(angles), len(r_ratios),
+                                    len(n_cycles)))
+
+
+def to_list(values: np.ndarray) -> List[Optional[float]]:
+    return [v if np.isfinite(v) else None for v in values.tolist()]
+
+
+def run_failure(criterion: FailureCriterion,
+                inputs: FailureInputs,
+                angles: List[float],
+                r_ratios: List[float],
+                n_cycles: List[float]) -> FailureResult:
+    stress = evaluate(criterion, inputs, angles, r_ratios, n_cycles)
+    plot = Plot(
+        title=f'{criterion.value} failure envelopes',
+        x_axis=DataKey.ANGLE,
+        y_axis=DataKey.STRESS_PARAM,
+        tooltips=[DataKey.ANGLE, DataKey.STRESS_PARAM],
+    )
+    envelopes = []
+    for j, r_ratio in enumerate(r_ratios):
+        for k, n in enumerate(n_cycles):
+            envelopes.append(FailureEnvelope(
+                r_ratio=r_ratio, n_cycles=n, angles=angles,
+                stress=to_list(stress[:, j, k])))
+            plot.lines.append(Line(
+                data={DataKey.ANGLE: np.asarray(angles, dtype=float),
+                      DataKey.STRESS_PARAM: stress[:, j, k]},
+                legend_label=f'R={r_ratio} N={n:g}',
+            ))
+    return FailureResult(envelopes=envelopes,
+                         plot=plotter.export_plot(plot))
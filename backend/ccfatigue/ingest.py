@@ -0,0 +1,287 @@
+'''
+Bulk ingestion of TST experiment folders into the database.
+
+    pipenv run python -m ccfatigue.ingest ../Data/TST_Khalooei_2021-10_FA
+
+Test files are read by chunks of ingest_batch_size rows and loaded with
+COPY on PostgreSQL, or with one executemany per chunk on other databases.
+Ingesting a folder again replaces its experiment.
+
+The metrics derived from the machine columns (see ccfatigue.metrics) are
+stored with each test, and as its HYS rows when the test has no HYS file.
+'''
+import argparse
+import glob
+import io
+import json
+import os
+from typing import Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+from pandas.core.frame import DataFrame
+from sqlalchemy import (
+    BigInteger, Table, create_engine, delete, insert, select, update)
+from sqlalchemy.engine import Connection, Engine
+
+from ccfatigue import metrics
+from ccfatigue.catalogue import (
+    find_files, parse_folder_name, read_experiment_metadata)
+from ccfatigue.config import settings
+from ccfatigue.models.database import (
+    Experiment, ExperimentMetadata, HysMeasurement, Measurement, Test)
+from ccfatigue.services import database
+
+MEASUREMENT_COLUMNS: Dict[str, str] = {
+    'Machine_N_cycles': 'machine_n_cycles',
+    'Machine_Load': 'machine_load',
+    'Machine_Displacement': 'machine_displacement',
+    'index': 'image_index',
+    'Camera_N_cycles': 'camera_n_cycles',
+    'exx': 'exx',
+    'eyy': 'eyy',
+    'exy': 'exy',
+    'crack_length': 'crack_length',
+    'Th_time': 'th_time',
+    'Th_N_cycles': 'th_n_cycles',
+    'Th_specimen_max': 'th_specimen_max',
+    'Th_specimen_mean': 'th_specimen_mean',
+    'Th_chamber': 'th_chamber',
+    'Th_uppergrips': 'th_uppergrips',
+    'Th_lowergrips': 'th_lowergrips',
+}
+MACHINE_COLUMNS: List[str] = ['machine_n_cycles', 'machine_load',
+                              'machine_displacement']
+HYS_COLUMNS: Dict[str, str] = {
+    'n_cycles': 'n_cycles',
+    'creep': 'creep',
+    'hysteresis_area': 'hysteresis_area',
+    'stiffness': 'stiffness',
+}
+TEST_COLUMNS: Dict[str, str] = {
+    'Specimen number': 'number',
+    'Stress Ratio': 'stress_ratio',
+    'Maximum Stress': 'maximum_stress',
+    'Loading rate': 'loading_rate',
+    'Run-out': 'run_out',
+}
+
+
+def read_test_metadata(folder: str) -> DataFrame:
+    paths = glob.glob(os.path.join(folder, '*_metadata.csv'))
+    if not paths:
+        return DataFrame(columns=list(TEST_COLUMNS.values()))
+    df = pd.read_csv(paths[0], encoding='utf-8-sig')
+    df.columns = df.columns.str.strip()
+    df = df[[c for c in TEST_COLUMNS if c in df.columns]]
+    df = df.rename(columns=TEST_COLUMNS)
+    if 'run_out' in df:
+        df['run_out'] = df['run_out'].str.strip().str.lower() == 'yes'
+    return df.set_index('number')
+
+
+def read_batches(path: str,
+                 columns: Dict[str, str],
+                 batch_size: int) -> Iterator[DataFrame]:
+    '''Chunks of the known columns of path, with their row numbers.'''
+    row = 0
+    with pd.read_csv(path, encoding='utf-8-sig', chunksize=batch_size,
+                     usecols=lambda c: c in columns) as reader:
+        for df in reader:
+            df = df.rename(columns=columns)
+            df.insert(0, 'row', range(row, row + len(df)))
+            row += len(df)
+            yield df
+
+
+def copy_batch(connection: Connection, table: Table, df: DataFrame) -> None:
+    '''Load df into table with COPY on PostgreSQL, executemany otherwise.'''
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        columns = ', '.join(f'"{column}"' for column in df.columns)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            f'COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT csv)',
+            buffer)
+        return
+    records = df.astype(object).where(df.notna(), None).to_dict('records')
+    connection.execute(insert(table), records)
+
+
+def round_integers(table: Table, df: DataFrame) -> DataFrame:
+    '''Cast the bigint columns of df, COPY would reject the 1234.0 that
+    pandas writes for float columns.'''
+    integers = [column.name for column in table.columns
+                if isinstance(column.type, BigInteger)
+                and column.name in df.columns]
+    df[integers] = df[integers].round().astype('Int64')
+    return df
+
+
+def load_file(connection: Connection,
+              table: Table,
+              test_id: int,
+              path: str,
+              columns: Dict[str, str],
+              batch_size: int,
+              collect: Optional[Callable[[DataFrame], None]] = None) -> int:
+    n_rows = 0
+    for df in read_batches(path, columns, batch_size):
+        if collect is not None:
+            collect(df)
+        df.insert(0, 'test_id', test_id)
+        copy_batch(connection, table, round_integers(table, df))
+        n_rows += len(df)
+    return n_rows
+
+
+def load_metrics(connection: Connection,
+                 test_id: int,
+                 machine: DataFrame,
+                 derive_hys: bool) -> int:
+    '''Store the metrics derived from the machine columns of a test, and
+    its per-cycle metrics as HYS rows when it has no HYS file.'''
+    cycles = metrics.get_cycle_metrics(
+        machine['machine_n_cycles'].to_numpy(dtype=float),
+        machine['machine_displacement'].to_numpy(dtype=float),
+        machine['machine_load'].to_numpy(dtype=float))
+    connection.execute(update(Test.__table__).where(Test.id == test_id)
+                       .values(**metrics.get_test_metrics(cycles)))
+    if not derive_hys or len(cycles) == 0:
+        return 0
+    hys = cycles[metrics.CYCLE_COLUMNS].copy()
+    hys.insert(0, 'row', range(len(hys)))
+    hys.insert(0, 'test_id', test_id)
+    copy_batch(connection, HysMeasurement.__table__,
+               round_integers(HysMeasurement.__table__, hys))
+    return len(hys)
+
+
+def get_metadata_rows(experiment_id: int,
+                      metadata: Dict[str, Dict]) -> List[Dict]:
+    return [
+        {'experiment_id': experiment_id, 'section': section.strip(),
+         'name': name.strip(),
+         'value': None if value is None else json.dumps(value)}
+        for section, values in metadata.items()
+        for name, value in values.items()
+    ]
+
+
+def get_test_row(experiment_id: int,
+                 number: int,
+                 tests: DataFrame) -> Dict:
+    row = {'experiment_id': experiment_id, 'number': number}
+    if number in tests.index:
+        values = tests.loc[[number]].to_dict('records')[0]
+        row.update({k: None if pd.isna(v) else v for k, v in values.items()})
+    return row
+
+
+def ingest_test(connection: Connection,
+                experiment_id: int,
+                number: int,
+                path: str,
+                hys_path: Optional[str],
+                tests: DataFrame,
+                batch_size: int) -> Dict[str, int]:
+    '''Load one test file, and its HYS file if any.'''
+    test_id = connection.execute(
+        insert(Test.__table__).values(
+            **get_test_row(experiment_id, number, tests))
+    ).inserted_primary_key[0]
+    counts = {'tests': 1, 'measurements': 0, 'hys_measurements': 0}
+    machine = []
+    counts['measurements'] += load_file(
+        connection, Measurement.__table__, test_id, path,
+        MEASUREMENT_COLUMNS, batch_size,
+        lambda df: machine.append(df[MACHINE_COLUMNS]))
+    counts['hys_measurements'] += load_metrics(
+        connection, test_id, pd.concat(machine), hys_path is None)
+    if hys_path is not None:
+        counts['hys_measurements'] += load_file(
+            connection, HysMeasurement.__table__, test_id, hys_path,
+            HYS_COLUMNS, batch_size)
+    return counts
+
+
+def add_counts(counts: Dict[str, int], added: Dict[str, int]) -> None:
+    for name, count in added.items():
+        counts[name] += count
+
+
+def ingest_folder(engine: Engine,
+                  folder: str,
+                  batch_size: Optional[int] = None) -> Dict[str, int]:
+    '''Load one experiment folder in a single transaction.'''
+    batch_size = batch_size or settings.ingest_batch_size
+    experiment = parse_folder_name(folder)
+    metadata = read_experiment_metadata(folder)
+    experiment['laboratory'] = metadata.get('Experience', {}).get(
+        'Laboratory')
+    tests = read_test_metadata(folder)
+    hys_files = dict(find_files(folder, 'HYS'))
+    counts = {'tests': 0, 'measurements': 0, 'hys_measurements': 0}
+    with engine.begin() as connection:
+        connection.execute(delete(Experiment.__table__).where(
+            Experiment.name == experiment['name']))
+        experiment_id = connection.execute(
+            insert(Experiment.__table__).values(**experiment)
+        ).inserted_primary_key[0]
+        metadata_rows = get_metadata_rows(experiment_id, metadata)
+        if metadata_rows:
+            connection.execute(insert(ExperimentMetadata.__table__),
+                               metadata_rows)
+        for number, path in find_files(folder, 'TST'):
+            add_counts(counts, ingest_test(
+                connection, experiment_id, number, path,
+                hys_files.get(number), tests, batch_size))
+    return counts
+
+
+def ingest_tests(engine: Engine,
+                 folder: str,
+                 numbers: List[int],
+                 batch_size: Optional[int] = None) -> Dict[str, int]:
+    '''Reload the given tests of a folder, in a single transaction; tests
+    without a file anymore are removed. A folder not ingested yet is
+    ingested whole.'''
+    batch_size = batch_size or settings.ingest_batch_size
+    name = parse_folder_name(folder)['name']
+    with engine.connect() as connection:
+        experiment_id = connection.execute(
+            select(Experiment.id).where(Experiment.name == name)).scalar()
+    if experiment_id is None:
+        return ingest_folder(engine, folder, batch_size)
+    tests = read_test_metadata(folder)
+    test_files = dict(find_files(folder, 'TST'))
+    hys_files = dict(find_files(folder, 'HYS'))
+    counts = {'tests': 0, 'measurements': 0, 'hys_measurements': 0}
+    with engine.begin() as connection:
+        connection.execute(delete(Test.__table__).where(
+            Test.experiment_id == experiment_id, Test.number.in_(numbers)))
+        for number in numbers:
+            if number in test_files:
+                add_counts(counts, ingest_test(
+                    connection, experiment_id, number, test_files[number],
+                    hys_files.get(number), tests, batch_size))
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('folders', nargs='+',
+                        help='TST_{Researcher}_{Date}_{Type} folders')
+    parser.add_argument('--url', help='database URL, the settings by default')
+    parser.add_argument('--batch-size', type=int,
+                        default=settings.ingest_batch_size)
+    args = parser.parse_args(argv)
+    engine = create_engine(args.url) if args.url else database.engine
+    for folder in args.folders:
+        counts = ingest_folder(engine, folder, args.batch_size)
+        print(f'{folder}: {counts}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+'''
+Timings and resource use of the hot paths, exported by /metrics in the
+Prometheus text format.
+
+    with instrumentation.span('read_csv') as s:
+        df = ...
+        s.rows = len(df)
+
+observes the duration of the stage, and the rows it processed, in the
+ccfatigue_stage_* histograms. A request sent with an X-Profile header also
+collects its spans and gets them back as a Server-Timing header. Functions
+run on an executor must be wrapped with in_context() for their spans to
+reach the profile of the request.
+
+Only the standard library is imported here, so the app imports it at
+startup. Every gunicorn worker keeps its own registry.
+'''
+import contextvars
+import resource
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SECONDS_BUCKETS: List[float] = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                                1, 2.5, 5, 10, 30, 60]
+BYTES_BUCKETS: List[float] = [1024 * 4 ** i for i in range(11)]
+ROWS_BUCKETS: List[float] = [10 ** i for i in range(9)]
+
+Labels = Tuple[Tuple[str, str], ...]
+
+lock = threading.Lock()
+# stage -> [seconds, count] of the current request, when it is profiled
+profile: contextvars.ContextVar[Optional[Dict[str, List[float]]]] = \
+    contextvars.ContextVar('profile', default=None)
+
+
+def format_labels(labels: Labels, extra: str = '') -> str:
+    pairs = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{format_labels(labels)} '
+                         f'{format_value(value)}')
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, buckets: List[float]):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # labels -> (bucket counts, sum, count)
+        self.values: Dict[Labels, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with lock:
+            counts, total, count = self.values.get(
+                key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = format_labels(labels, f'le="{format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{le} {bucket_count}')
+            le = format_labels(labels, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{le} {count}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} '
+                         f'{format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {count}')
+        return lines
+
+
+request_seconds = Histogram('ccfatigue_request_seconds',
+                            'Latency of the HTTP requests.', SECONDS_BUCKETS)
+response_bytes = Histogram('ccfatigue_response_bytes',
+                           'Size of the uncompressed response bodies.',
+                           BYTES_BUCKETS)
+stage_seconds = Histogram('ccfatigue_stage_seconds',
+                          'Duration of the hot path stages.',
+                          SECONDS_BUCKETS)
+stage_rows = Histogram('ccfatigue_stage_rows',
+                       'Rows or points processed by the hot path stages.',
+                       ROWS_BUCKETS)
+subprocess_total = Counter('ccfatigue_subprocess_total',
+                           'Subprocesses run, by executable and outcome.')
+subprocess_seconds = Histogram('ccfatigue_subprocess_seconds',
+                               'Duration of the subprocesses.',
+                               SECONDS_BUCKETS)
+metrics = [request_seconds, response_bytes, stage_seconds, stage_rows,
+           subprocess_total, subprocess_seconds]
+
+
+class span:
+    '''Time the enclosed stage; set rows to also observe its size.'''
+
+    def __init__(self, stage: str, rows: Optional[int] = None):
+        self.stage = stage
+        self.rows = rows
+
+    def __enter__(self) -> 'span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        seconds = time.perf_counter() - self.start
+        stage_seconds.observe(seconds, stage=self.stage)
+        if self.rows is not None:
+            stage_rows.observe(self.rows, stage=self.stage)
+        record(self.stage, seconds)
+
+
+def record(stage: str, seconds: float) -> None:
+    '''Add seconds to stage in the profile of the request, if any.'''
+    stages = profile.get()
+    if stages is not None:
+        with lock:
+            total = stages.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+
+def in_context(function: Callable) -> Callable:
+    '''function, run in a copy of the context of the caller.'''
+    context = contextvars.copy_context()
+
+    def run(*args: Any, **kwargs: Any) -> Any:
+        return context.copy().run(function, *args, **kwargs)
+    return run
+
+
+def format_server_timing(stages: Dict[str, List[float]]) -> str:
+    '''Server-Timing entries of a profile, slowest first.'''
+    return ', '.join(
+        f'{stage};dur={seconds * 1000:.1f};desc="{count}x"'
+        for stage, (seconds, count) in sorted(
+            stages.items(), key=lambda item: -item[1][0]))
+
+
+def render_process() -> List[str]:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    lines = [
+        '# TYPE process_cpu_seconds_total counter',
+        f'process_cpu_seconds_total {usage.ru_utime + usage.ru_stime}',
+        '# TYPE process_max_resident_memory_bytes gauge',
+        # kB on Linux
+        f'process_max_resident_memory_bytes {usage.ru_maxrss * 1024}',
+        '# TYPE process_threads gauge',
+        f'process_threads {threading.active_count()}',
+    ]
+    # the caches are only reported once an endpoint imported them
+    if 'ccfatigue.cache' in sys.modules:
+        caches = sys.modules['ccfatigue.cache'].caches.values()
+        stats = [c.stats() for c in caches]
+        for field, name, kind in [
+                ('hits', 'ccfatigue_cache_hits_total', 'counter'),
+                ('disk_hits', 'ccfatigue_cache_disk_hits_total', 'counter'),
+                ('misses', 'ccfatigue_cache_misses_total', 'counter'),
+                ('evictions', 'ccfatigue_cache_evictions_total', 'counter'),
+                ('bytes', 'ccfatigue_cache_bytes', 'gauge')]:
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{{cache="{s.name}"}} {getattr(s, field)}'
+                         for s in stats)
+    return lines
+
+
+def render() -> str:
+    with lock:
+        lines = [line for metric in metrics for line in metric.render()]
+    return '\n'.join(lines + render_process()) + '\n'
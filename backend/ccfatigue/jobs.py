@@ -0,0 +1,352 @@
+'''
+Background analysis jobs, for the runs too long to fit in a request.
+
+    pipenv run python -m ccfatigue.jobs
+
+runs the queued jobs on jobs_max_workers threads, in a process of its own:
+the web workers, which gunicorn recycles, only queue them.
+
+A job is identified by the digest of its kind, input files and parameters:
+submitting the same analysis again returns the existing job, unless it
+failed. Jobs are stored under jobs_directory, one folder per job holding
+inputs.pkl (input files and parameters), job.json (status and progress) and
+result.json, so that any process of the host can answer the polls. A worker
+queues a job by creating its job.json, which only one of the workers
+submitting it at once succeeds in; a runner starts an attempt by creating
+its claim-{attempt}.json file, which only one runner succeeds in. A running job
+whose runner is gone is queued again, and reported failed after
+jobs_max_attempts attempts.
+'''
+import argparse
+import hashlib
+import io
+import json
+import os
+import pickle
+import re
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import (
+    Any, AnyStr, Callable, Dict, List, Optional, Set, Tuple)
+
+from pydantic import BaseModel
+
+from ccfatigue.config import settings
+from ccfatigue.model import Job, JobKind, JobStatus
+
+JOB_FILE: str = 'job.json'
+RESULT_FILE: str = 'result.json'
+INPUTS_FILE: str = 'inputs.pkl'
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+Progress = Callable[[float], None]
+
+
+def get_job_id(kind: JobKind,
+               inputs: List[bytes],
+               params: Dict[str, Any]) -> str:
+    digest = hashlib.sha256(kind.value.encode())
+    for data in inputs:
+        digest.update(hashlib.sha256(data).digest())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:32]
+
+
+def get_job_directory(job_id: str) -> str:
+    return os.path.join(settings.jobs_directory, job_id)
+
+
+def write_tmp_file(path: str, data: AnyStr) -> str:
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb' if isinstance(data, bytes) else 'w') as file:
+        file.write(data)
+    return tmp_path
+
+
+def write_file(path: str, data: AnyStr) -> None:
+    '''Replace path at once, readers never see a partial file.'''
+    os.replace(write_tmp_file(path, data), path)
+
+
+def create_file(path: str, data: AnyStr) -> bool:
+    '''Create path at once, False when it already exists.'''
+    tmp_path = write_tmp_file(path, data)
+    try:
+        # an exclusive create that publishes the complete file
+        os.link(tmp_path, path)
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp_path)
+    return True
+
+
+def read_boot_id() -> str:
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as file:
+            return file.read().strip()
+    except OSError:
+        return ''
+
+
+BOOT_ID: str = read_boot_id()
+
+
+def get_start_token(pid: int) -> Optional[str]:
+    '''Boot and start time of process pid, which tell it from a later
+    process given the same pid; None where /proc is not available.'''
+    try:
+        with open(f'/proc/{pid}/stat') as file:
+            stat = file.read()
+    except OSError:
+        return None
+    # the fields following the command name, which may contain spaces
+    fields = stat.rsplit(')', 1)[1].split()
+    return f'{BOOT_ID}:{fields[19]}'
+
+
+def serialize_job(job: Job, attempts: int) -> str:
+    '''job.json of job, attempts being the number of attempts started.'''
+    data = json.loads(job.json())
+    data['pid'] = os.getpid()
+    data['token'] = get_start_token(os.getpid())
+    data['attempts'] = attempts
+    return json.dumps(data)
+
+
+def write_job(job: Job, attempts: int) -> None:
+    write_file(os.path.join(get_job_directory(job.id), JOB_FILE),
+               serialize_job(job, attempts))
+
+
+def is_alive(pid: int, token: Optional[str]) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return token is None or get_start_token(pid) == token
+
+
+def read_job(job_id: str) -> Tuple[Optional[Job], int]:
+    '''
+    Job and number of attempts started. A running job whose runner exited
+    is queued again, or failed once it used its jobs_max_attempts.
+    '''
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return None, 0
+    try:
+        with open(os.path.join(get_job_directory(job_id), JOB_FILE)) as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return None, 0
+    pid, token = data.pop('pid'), data.pop('token', None)
+    attempts = data.pop('attempts', 0)
+    job = Job.parse_obj(data)
+    if job.status == JobStatus.RUNNING and not is_alive(pid, token):
+        if attempts < settings.jobs_max_attempts:
+            job.status = JobStatus.QUEUED
+            job.progress = 0.0
+        else:
+            job.status = JobStatus.FAILED
+            job.error = 'the process running the job exited'
+    return job, attempts
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    return read_job(job_id)[0]
+
+
+def get_result_path(job_id: str) -> str:
+    return os.path.join(get_job_directory(job_id), RESULT_FILE)
+
+
+def update(job: Job, attempts: int, **changes: Any) -> None:
+    for name, value in changes.items():
+        setattr(job, name, value)
+    job.updated = datetime.now(timezone.utc)
+    write_job(job, attempts)
+
+
+def run_sn_curve(inputs: List[bytes],
+                 params: Dict[str, Any],
+                 progress: Progress) -> BaseModel:
+    from ccfatigue import analyzer
+
+    return analyzer.run_sn_curve(io.BytesIO(inputs[0]), progress=progress,
+                                 **params)
+
+
+def run_fatigue_life(inputs: List[bytes],
+                     params: Dict[str, Any],
+                     progress: Progress) -> BaseModel:
+    from ccfatigue import pipeline
+    from ccfatigue.cld import StaticStrength
+
+    static = StaticStrength(params['ucs'], params['uts'],
+                            params['r_critical'])
+    return pipeline.run_fatigue_life(
+        io.BytesIO(inputs[0]), io.BytesIO(inputs[1]), params['sn_methods'],
+        params['cld_methods'], static, params['factors'],
+        params['counting_method'], progress)
+
+
+RUNNERS: Dict[JobKind, Callable[[List[bytes], Dict[str, Any], Progress],
+                                BaseModel]] = {
+    JobKind.SN_CURVE: run_sn_curve,
+    JobKind.FATIGUE_LIFE: run_fatigue_life,
+}
+
+
+def execute(job: Job, attempts: int) -> None:
+    try:
+        with open(os.path.join(get_job_directory(job.id), INPUTS_FILE),
+                  'rb') as file:
+            inputs, params = pickle.load(file)
+        result = RUNNERS[job.kind](
+            inputs, params,
+            lambda fraction: update(job, attempts, progress=fraction))
+        write_file(get_result_path(job.id), result.json())
+        update(job, attempts, status=JobStatus.DONE, progress=1.0)
+    except Exception as e:
+        traceback.print_exc()
+        update(job, attempts, status=JobStatus.FAILED,
+               error=str(e) or repr(e))
+
+
+def purge() -> None:
+    '''Remove the finished jobs older than jobs_retention_seconds.'''
+    if not os.path.isdir(settings.jobs_directory):
+        return
+    oldest = (datetime.now(timezone.utc)
+              - timedelta(seconds=settings.jobs_retention_seconds))
+    for job_id in os.listdir(settings.jobs_directory):
+        job = get_job(job_id)
+        if (job is not None
+                and job.status in [JobStatus.DONE, JobStatus.FAILED]
+                and job.updated < oldest):
+            shutil.rmtree(get_job_directory(job_id), ignore_errors=True)
+
+
+def claim(job: Job, failed: Optional[Job], attempts: int) -> bool:
+    '''
+    Create the job.json of job, or replace that of the failed attempt. Both
+    are exclusive creates: False when another worker claimed the job first.
+    '''
+    directory = get_job_directory(job.id)
+    path = os.path.join(directory, JOB_FILE)
+    if failed is None:
+        return create_file(path, serialize_job(job, attempts))
+    # the failed attempt is kept under a name of its own, which only exists
+    # once it was replaced
+    try:
+        os.link(path, os.path.join(
+            directory, f'job-{failed.created:%Y%m%dT%H%M%S%f}.json'))
+    except (FileExistsError, FileNotFoundError):
+        return False
+    write_job(job, attempts)
+    return True
+
+
+def submit(kind: JobKind,
+           inputs: List[bytes],
+           params: Dict[str, Any]) -> Job:
+    '''
+    Queue the RUNNERS[kind] run of inputs with params, unless it was already
+    submitted. params are passed as keyword arguments of the analysis.
+    '''
+    job_id = get_job_id(kind, inputs, params)
+    purge()
+    while True:
+        previous, attempts = read_job(job_id)
+        if previous is not None and previous.status != JobStatus.FAILED:
+            return previous
+        os.makedirs(get_job_directory(job_id), exist_ok=True)
+        # in place before the job is visible to the runners
+        write_file(os.path.join(get_job_directory(job_id), INPUTS_FILE),
+                   pickle.dumps((inputs, params), pickle.HIGHEST_PROTOCOL))
+        now = datetime.now(timezone.utc)
+        job = Job(id=job_id, kind=kind, status=JobStatus.QUEUED,
+                  progress=0.0, created=now, updated=now)
+        if claim(job, previous, attempts):
+            return job
+
+
+def find_queued() -> List[Tuple[Job, int]]:
+    '''Queued jobs and their numbers of attempts, oldest first.'''
+    if not os.path.isdir(settings.jobs_directory):
+        return []
+    queued = []
+    for job_id in os.listdir(settings.jobs_directory):
+        job, attempts = read_job(job_id)
+        if job is not None and job.status == JobStatus.QUEUED:
+            queued.append((job, attempts))
+    return sorted(queued, key=lambda item: item[0].created)
+
+
+def is_claimed(path: str) -> bool:
+    '''Whether the runner of a claim file is still running.'''
+    try:
+        with open(path) as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        # being written
+        return True
+    return is_alive(data['pid'], data['token'])
+
+
+def start(job: Job, attempts: int) -> Optional[int]:
+    '''
+    Claim the next attempt of a queued job and return the number of attempts
+    started, None when another runner claimed it first. The claim of a
+    runner that exited before marking the job running counts as an attempt.
+    '''
+    directory = get_job_directory(job.id)
+    while attempts < settings.jobs_max_attempts:
+        path = os.path.join(directory, f'claim-{attempts}.json')
+        attempts += 1
+        if create_file(path, serialize_job(job, attempts)):
+            update(job, attempts, status=JobStatus.RUNNING, progress=0.0)
+            return attempts
+        if is_claimed(path):
+            return None
+    update(job, attempts, status=JobStatus.FAILED,
+           error='the process running the job exited')
+    return None
+
+
+def run(workers: int, interval: float) -> None:
+    '''Start the queued jobs while fewer than workers are running.'''
+    running: Set[Future] = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            running = {future for future in running if not future.done()}
+            try:
+                for job, attempts in find_queued():
+                    if len(running) >= workers:
+                        break
+                    started = start(job, attempts)
+                    if started is not None:
+                        running.add(executor.submit(execute, job, started))
+            except Exception:
+                traceback.print_exc()
+            time.sleep(interval)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int,
+                        default=settings.jobs_max_workers)
+    parser.add_argument('--interval', type=float,
+                        default=settings.jobs_interval_seconds)
+    args = parser.parse_args(argv)
+    run(args.workers, args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,35 @@
+'''
+Only FastAPI, pydantic and the settings are imported with the app: the
+modules pulling in pandas, NumPy, Bokeh or the database are imported by the
+endpoints that use them, see ccfatigue.startup.
+'''
+import copy
 import json
+import os
+import sys
+import time
 from datetime import date
-from typing import List
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional
 
-from fastapi import FastAPI, File, Query, UploadFile
+from fastapi import (
+    FastAPI, File, Header, HTTPException, Query, Request, Response,
+    UploadFile)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 
-from ccfatigue import analyzer
-from ccfatigue import dashboarder
 from ccfatigue.model import (
-    Dashboard, Experience, Plot, SnCurveMethod, SnCurveResult, Test)
+    CacheStats, CldMethod, CycleCountingMethod, CycleCountingResult,
+    Dashboard, ExperiencePage, FailureCriterion, FailureResult,
+    FatigueLifeResult, HysColumn, Job, JobKind, JobStatus, Plot, PlotFormat,
+    SeriesRange, SnCurveEngine, SnCurveMethod, SnCurveResult, SnModel, Test)
+from ccfatigue import instrumentation
 from ccfatigue.config import settings
-from ccfatigue.services.database import Base, database, engine
 
+if TYPE_CHECKING:
+    from ccfatigue.sncurve import Dataset
 
 app = FastAPI()
 
@@ -25,50 +43,131 @@ else:
         allow_credentials=True,
         allow_methods=['*'],
         allow_headers=['*'],
+        expose_headers=['ETag', 'Server-Timing'],
     )
 
 
-Base.metadata.create_all(engine)
+# inside the gzip middleware: the payload sizes are the uncompressed ones
+@app.middleware('http')
+async def instrument(request: Request, call_next) -> Response:
+    '''Latency and size of every response. With an X-Profile header, the
+    stages of the request are also returned in Server-Timing.'''
+    profiled = settings.profiling_enabled and 'x-profile' in request.headers
+    token = instrumentation.profile.set({} if profiled else None)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        stages = instrumentation.profile.get()
+        instrumentation.profile.reset(token)
+    seconds = time.perf_counter() - start
+    route = request.scope.get('route')
+    path = route.path if route is not None else 'unmatched'
+    instrumentation.request_seconds.observe(
+        seconds, method=request.method, path=path,
+        status=str(response.status_code))
+    if 'content-length' in response.headers:
+        instrumentation.response_bytes.observe(
+            int(response.headers['content-length']), path=path)
+    if stages is not None:
+        timings = [response.headers.get('server-timing'),
+                   instrumentation.format_server_timing(stages),
+                   f'total;dur={seconds * 1000:.1f}']
+        response.headers['Server-Timing'] = ', '.join(
+            timing for timing in timings if timing)
+    return response
 
-@app.on_event("startup")
-async def startup():
-    await database.connect()
+
+# Bokeh JSON is mostly digits and compresses ~5x; nginx passes it through
+app.add_middleware(GZipMiddleware, minimum_size=settings.gzip_minimum_size,
+                   compresslevel=settings.gzip_level)
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await database.disconnect()
+    # the pool is opened by the first query, see services.measurements
+    if 'ccfatigue.services.measurements' in sys.modules:
+        await sys.modules['ccfatigue.services.measurements'].disconnect()
+
+
+@lru_cache(maxsize=32)
+def read_experience(path: str, mtime_ns: int) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
 
+def load_experience(path: str) -> dict:
+    return copy.deepcopy(read_experience(path, os.stat(path).st_mtime_ns))
 
-@app.get('/experiences', response_model=List[Experience])
-async def get_experiences() -> List[Experience]:
-    return []
+
+@app.get('/experiences', response_model=ExperiencePage)
+async def get_experiences(
+        researcher: Optional[str] = None,
+        experience_type: Optional[str] = Query(None, alias='experienceType'),
+        date_min: Optional[date] = Query(None, alias='dateMin'),
+        date_max: Optional[date] = Query(None, alias='dateMax'),
+        min_tests: Optional[int] = Query(None, alias='minTests', ge=0),
+        max_tests: Optional[int] = Query(None, alias='maxTests', ge=0),
+        offset: int = Query(0, ge=0),
+        limit: int = Query(50, ge=1, le=1000)
+) -> ExperiencePage:
+    from ccfatigue import catalogue
+
+    return await run_in_threadpool(
+        catalogue.catalogue.query, researcher, experience_type, date_min,
+        date_max, min_tests, max_tests, offset, limit)
 
 
 @app.get('/dashboard', response_model=Dashboard)
 async def get_dashboard(
+        response: Response,
         laboratory: str,
         researcher: str,
         experience_type: str = Query(..., alias='experienceType'),
         date: date = Query(...),
         test_numbers: List[int] = Query(...,
-                                        alias='testNumbers', ge=0, lt=1000)
+                                        alias='testNumbers', ge=0, lt=1000),
+        plot_format: PlotFormat = Query(PlotFormat.BOKEH, alias='plotFormat'),
+        if_none_match: Optional[str] = Header(None)
 ) -> Dashboard:
+    '''
+    plotFormat=compact returns every plot as its spec and its lines as
+    base64 little-endian float32 (or float64) arrays instead of Bokeh
+    json_item documents.
+
+    The ETag only depends on the source files and the parameters: a
+    matching If-None-Match is answered 304 before anything is loaded.
+    '''
+    from ccfatigue import conditional, dashboarder
+
     experience_source_file = '../Preprocessing/vahid_CA_skel.json'
-    with open(experience_source_file) as f:
-        experience_data = json.load(f)
-
-    # TODO
-    # Add Strain at failure from HYS*.csv on the fly
-    # Scott prepares this in Fatigue_test_dashboard/Hysteresis_loops.py
-    # strain_at_failure()
-    strain_at_failure = 1.17
+    etag = conditional.make_etag(
+        dashboarder.get_dashboard_etag(laboratory, researcher,
+                                       experience_type, date, test_numbers,
+                                       plot_format),
+        os.stat(experience_source_file).st_mtime_ns)
+    if conditional.matches(if_none_match, etag):
+        return conditional.not_modified(etag)
+    conditional.set_etag(response, etag)
+    experience_data = load_experience(experience_source_file)
+
+    dashboard = await run_in_threadpool(
+        dashboarder.generate_dashboard,
+        laboratory, researcher, experience_type, date, test_numbers,
+        plot_format)
+    # merged with the request stages by the instrument middleware
+    if instrumentation.profile.get() is not None:
+        response.headers['Server-Timing'] = ', '.join(
+            f'{stage};dur={ms:.1f}'
+            for stage, ms in dashboard.timings.items())
+
+    # derived from the STD files once, then read from the storage cache
+    strains = [test.strain_at_failure for test in dashboard.tests
+               if test.strain_at_failure is not None]
     (experience_data['Experiment']
         ['Standard Fatigue']
-        ['Strain at Failure']) = strain_at_failure
-
-    dashboard = dashboarder.generate_dashboard(
-        laboratory, researcher, experience_type, date, test_numbers)
+        ['Strain at Failure']) = (sum(strains) / len(strains)
+                                  if strains else None)
 
     return Dashboard(
         experience=experience_data,
@@ -77,7 +176,7 @@ async def get_dashboard(
                 number=test.number,
                 color=test.color,
                 total_dissipated_energy=test.total_dissipated_energy,
-                strain_at_failure=strain_at_failure
+                strain_at_failure=test.strain_at_failure
             )
             for test in dashboard.tests
         ],
@@ -90,9 +189,288 @@ async def get_dashboard(
     )
 
 
+async def find_ingested_test(laboratory: str,
+                             researcher: str,
+                             experience_type: str,
+                             date: date,
+                             test_number: int) -> Optional[int]:
+    '''Id of an ingested test, None when it is only available as files or
+    when the database cannot be used: unreachable, or without the schema.'''
+    import asyncio
+
+    from asyncpg import PostgresError
+    from ccfatigue.services import measurements
+
+    if not measurements.is_available():
+        return None
+    try:
+        return await measurements.find_test(laboratory, researcher,
+                                            experience_type, date,
+                                            test_number)
+    except (OSError, asyncio.TimeoutError, PostgresError):
+        measurements.set_unavailable()
+        return None
+
+
+@app.get('/dashboard/range', response_model=SeriesRange)
+async def get_dashboard_range(
+        response: Response,
+        laboratory: str,
+        researcher: str,
+        column: HysColumn,
+        experience_type: str = Query(..., alias='experienceType'),
+        date: date = Query(...),
+        test_number: int = Query(..., alias='testNumber', ge=0, lt=1000),
+        n_cycles_min: float = Query(0, alias='nCyclesMin'),
+        n_cycles_max: Optional[float] = Query(None, alias='nCyclesMax'),
+        max_points: Optional[int] = Query(None, alias='maxPoints', gt=2),
+        if_none_match: Optional[str] = Header(None)
+) -> SeriesRange:
+    from ccfatigue import conditional, dashboarder, plotter, pyramid
+    from ccfatigue.services import measurements
+
+    max_points = max_points or plotter.MAX_POINTS
+    if n_cycles_max is None:
+        n_cycles_max = float('inf')
+    test_id = await find_ingested_test(laboratory, researcher,
+                                       experience_type, date, test_number)
+    params = (column.value, n_cycles_min, n_cycles_max, max_points)
+    if test_id is None:
+        etag = dashboarder.get_series_range_etag(
+            laboratory, researcher, experience_type, date, test_number,
+            *params)
+    else:
+        # a reloaded test gets a new id, its rows never change
+        etag = conditional.make_etag('database', test_id, params)
+    if conditional.matches(if_none_match, etag):
+        return conditional.not_modified(etag)
+    conditional.set_etag(response, etag)
+    if test_id is None:
+        level, n_cycles, values = await run_in_threadpool(
+            dashboarder.get_series_range,
+            laboratory, researcher, experience_type, date, test_number,
+            *params)
+    else:
+        level = 0
+        n_cycles, values = pyramid.thin(*await measurements.fetch_hys_range(
+            test_id, column.value, n_cycles_min, n_cycles_max), max_points)
+    return SeriesRange(
+        column=column,
+        level=level,
+        n_cycles=n_cycles.tolist(),
+        values=values.tolist(),
+    )
+
+
 @app.post('/snCurve/file')
-async def run_sn_curve_file(file: UploadFile = File(...),
-                            methods: List[SnCurveMethod] = Query(...),
-                            r_ratios: List[float] = Query(..., alias='rRatios')
-                            ) -> SnCurveResult:
-    return analyzer.run_sn_curve(file.file, methods, r_ratios)
+async def run_sn_curve_file(
+        file: UploadFile = File(...),
+        methods: List[SnCurveMethod] = Query(...),
+        r_ratios: List[float] = Query(..., alias='rRatios'),
+        engine: SnCurveEngine = SnCurveEngine.FORTRAN,
+        replicates: int = Query(0, ge=0,
+                                le=settings.bootstrap_max_replicates),
+        confidence: float = Query(95, gt=0, lt=100),
+        seed: int = Query(0, ge=0)
+) -> SnCurveResult:
+    '''
+    replicates > 0 adds the confidence % bootstrap band of every method,
+    from that many resamplings drawn with seed.
+    '''
+    from ccfatigue import analyzer
+
+    return await run_in_threadpool(
+        analyzer.run_sn_curve, file.file, methods, r_ratios, engine,
+        replicates, confidence, seed)
+
+
+@app.post('/cycleCounting/file')
+async def run_cycle_counting_file(
+        file: UploadFile = File(...),
+        method: CycleCountingMethod = CycleCountingMethod.RAINFLOW,
+        matrix_size: Optional[int] = Query(
+            None, alias='matrixSize', ge=1,
+            le=settings.cycle_counting_max_matrix_size)
+) -> CycleCountingResult:
+    from ccfatigue import cyclecounter
+
+    matrix_size = matrix_size or cyclecounter.MATRIX_SIZE
+    try:
+        return await run_in_threadpool(
+            cyclecounter.run_cycle_counting, file.file, method, matrix_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post('/fatigueLife/file')
+async def run_fatigue_life_file(
+        file: UploadFile = File(...),
+        spectrum: UploadFile = File(...),
+        sn_methods: List[SnCurveMethod] = Query(..., alias='snMethods'),
+        cld_methods: List[CldMethod] = Query(..., alias='cldMethods'),
+        ucs: float = Query(...),
+        uts: float = Query(...),
+        r_critical: float = Query(..., alias='rCritical'),
+        factors: List[float] = Query([1.0]),
+        counting_method: CycleCountingMethod = Query(
+            CycleCountingMethod.RAINFLOW, alias='countingMethod')
+) -> FatigueLifeResult:
+    from ccfatigue import pipeline
+    from ccfatigue.cld import StaticStrength
+
+    static = StaticStrength(ucs, uts, r_critical)
+    try:
+        return await run_in_threadpool(
+            pipeline.run_fatigue_life, file.file, spectrum.file, sn_methods,
+            cld_methods, static, factors, counting_method)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post('/jobs/snCurve', response_model=Job, status_code=202)
+async def submit_sn_curve_job(
+        file: UploadFile = File(...),
+        methods: List[SnCurveMethod] = Query(...),
+        r_ratios: List[float] = Query(..., alias='rRatios'),
+        engine: SnCurveEngine = SnCurveEngine.FORTRAN,
+        replicates: int = Query(0, ge=0,
+                                le=settings.bootstrap_max_replicates),
+        confidence: float = Query(95, gt=0, lt=100),
+        seed: int = Query(0, ge=0)
+) -> Job:
+    '''Run /snCurve/file in the background, see /jobs/{jobId}.'''
+    from ccfatigue import jobs
+
+    input_data = await file.read()
+    params = {'methods': methods, 'r_ratios': r_ratios, 'engine': engine,
+              'replicates': replicates, 'confidence': confidence,
+              'seed': seed}
+    return await run_in_threadpool(
+        jobs.submit, JobKind.SN_CURVE, [input_data], params)
+
+
+@app.post('/jobs/fatigueLife', response_model=Job, status_code=202)
+async def submit_fatigue_life_job(
+        file: UploadFile = File(...),
+        spectrum: UploadFile = File(...),
+        sn_methods: List[SnCurveMethod] = Query(..., alias='snMethods'),
+        cld_methods: List[CldMethod] = Query(..., alias='cldMethods'),
+        ucs: float = Query(...),
+        uts: float = Query(...),
+        r_critical: float = Query(..., alias='rCritical'),
+        factors: List[float] = Query([1.0]),
+        counting_method: CycleCountingMethod = Query(
+            CycleCountingMethod.RAINFLOW, alias='countingMethod')
+) -> Job:
+    '''Run /fatigueLife/file in the background, see /jobs/{jobId}.'''
+    from ccfatigue import jobs
+
+    input_data = await file.read()
+    spectrum_data = await spectrum.read()
+    params = {'sn_methods': sn_methods, 'cld_methods': cld_methods,
+              'ucs': ucs, 'uts': uts, 'r_critical': r_critical,
+              'factors': factors, 'counting_method': counting_method}
+    return await run_in_threadpool(
+        jobs.submit, JobKind.FATIGUE_LIFE, [input_data, spectrum_data],
+        params)
+
+
+@app.get('/jobs/{job_id}', response_model=Job)
+async def get_job(job_id: str) -> Job:
+    from ccfatigue import jobs
+
+    job = await run_in_threadpool(jobs.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='unknown job')
+    return job
+
+
+@app.get('/jobs/{job_id}/result')
+async def get_job_result(job_id: str) -> FileResponse:
+    '''The result of a done job, as the synchronous endpoint returns it.'''
+    from ccfatigue import jobs
+
+    job = await run_in_threadpool(jobs.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='unknown job')
+    if job.status != JobStatus.DONE:
+        raise HTTPException(status_code=409,
+                            detail=f'job is {job.status.value}')
+    return FileResponse(jobs.get_result_path(job_id),
+                        media_type='application/json')
+
+
+def read_dataset(file: Optional[UploadFile]) -> Optional['Dataset']:
+    from ccfatigue import analyzer, sncurve
+
+    if file is None:
+        return None
+    return sncurve.read_input(analyzer.read_input(file.file))[0]
+
+
+@app.post('/fatigueFailure/file')
+async def run_fatigue_failure_file(
+        criterion: FailureCriterion,
+        file: Optional[UploadFile] = File(None),
+        transverse: Optional[UploadFile] = File(None),
+        shear: Optional[UploadFile] = File(None),
+        sn_model: SnModel = Query(SnModel.LOG_LOG, alias='snModel'),
+        reference_angle: float = Query(0, alias='referenceAngle'),
+        reference_strength: Optional[float] = Query(
+            None, alias='referenceStrength'),
+        tensile_axial: Optional[float] = Query(None, alias='tensileAxial'),
+        compressive_axial: Optional[float] = Query(
+            None, alias='compressiveAxial'),
+        tensile_transverse: Optional[float] = Query(
+            None, alias='tensileTransverse'),
+        compressive_transverse: Optional[float] = Query(
+            None, alias='compressiveTransverse'),
+        shear_strength: Optional[float] = Query(None, alias='shearStrength'),
+        angles: List[float] = Query(list(range(0, 91, 5))),
+        r_ratios: List[float] = Query([0.1], alias='rRatios'),
+        n_cycles: List[float] = Query([1e3, 1e4, 1e5, 1e6, 1e7],
+                                      alias='nCycles'),
+) -> FailureResult:
+    '''
+    FTPF and SB take the axial (file), transverse and shear S-N tests; HR
+    takes two of the transverse, shear and off-axis tests at referenceAngle
+    (file), and the static strengths; the other criteria take the off-axis
+    tests at referenceAngle (file) and the static strengths.
+    '''
+    from ccfatigue import failure
+
+    laminate = None
+    if None not in [tensile_axial, tensile_transverse, shear_strength]:
+        laminate = failure.Laminate(tensile_axial, tensile_transverse,
+                                    shear_strength, compressive_axial,
+                                    compressive_transverse)
+    dataset = read_dataset(file)
+    inputs = failure.FailureInputs(
+        model=sn_model,
+        laminate=laminate,
+        reference=dataset,
+        reference_angle=reference_angle,
+        reference_strength=reference_strength,
+        axial=dataset,
+        transverse=read_dataset(transverse),
+        shear=read_dataset(shear),
+    )
+    try:
+        return await run_in_threadpool(failure.run_failure, criterion, inputs,
+                                       angles, r_ratios, n_cycles)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    '''Prometheus text format, of this worker only.'''
+    return PlainTextResponse(instrumentation.render(),
+                             media_type='text/plain; version=0.0.4')
+
+
+@app.get('/cache/stats', response_model=List[CacheStats])
+async def get_cache_stats() -> List[CacheStats]:
+    from ccfatigue import cache
+
+    return [c.stats() for c in cache.caches.values()]
@@ -0,0 +1,76 @@
+'''
+Derived metrics of a test, computed from the raw machine columns.
+
+Rows are sorted by cycle number once and every metric is then reduced over
+all the cycles at once: the shoelace area of the hysteresis loop, the secant
+stiffness between the extreme stress points, the creep (mean strain of the
+loop) and, over the whole test, the strain at failure.
+'''
+from typing import Dict, List, Optional
+
+import numpy as np
+from pandas.core.frame import DataFrame
+
+CYCLE_COLUMNS: List[str] = ['n_cycles', 'creep', 'hysteresis_area',
+                             'stiffness']
+TEST_METRICS: List[str] = ['total_dissipated_energy', 'strain_at_failure',
+                           'stiffness_degradation']
+
+
+def get_cycle_metrics(n_cycles: np.ndarray,
+                      strain: np.ndarray,
+                      stress: np.ndarray) -> DataFrame:
+    '''One row per cycle: the columns of a HYS file, and the peak_strain
+    at the maximum stress of the cycle.'''
+    valid = ~(np.isnan(n_cycles) | np.isnan(strain) | np.isnan(stress))
+    order = np.argsort(n_cycles[valid], kind='stable')
+    n_cycles = n_cycles[valid][order]
+    x, y = strain[valid][order], stress[valid][order]
+    if len(n_cycles) == 0:
+        return DataFrame(columns=CYCLE_COLUMNS + ['peak_strain'])
+    starts = np.flatnonzero(np.diff(n_cycles, prepend=np.nan))
+    ends = np.append(starts[1:], len(n_cycles)) - 1
+    group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts,
+                                                                len(x))))
+
+    # shoelace, every loop closed from its last point back to its first
+    cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+    cross[ends[:-1]] = 0
+    cross = np.append(cross, 0)
+    areas = np.add.reduceat(cross, starts)
+    areas += x[ends] * y[starts] - x[starts] * y[ends]
+    areas = np.abs(areas) / 2
+
+    # sorted by (cycle, stress): extremes are the first and last of a group
+    by_stress = np.lexsort((y, group))
+    low, high = by_stress[starts], by_stress[ends]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stiffness = (y[high] - y[low]) / (x[high] - x[low])
+    stiffness[~np.isfinite(stiffness)] = np.nan
+
+    return DataFrame({
+        'n_cycles': n_cycles[starts],
+        'creep': (x[high] + x[low]) / 2,
+        'hysteresis_area': areas,
+        'stiffness': stiffness,
+        'peak_strain': x[high],
+    })
+
+
+def get_test_metrics(cycles: DataFrame) -> Dict[str, Optional[float]]:
+    '''Scalars of a test from its per-cycle metrics. The strain at failure
+    is the strain at the maximum stress of the last cycle.'''
+    def value(x: float) -> Optional[float]:
+        return float(x) if np.isfinite(x) else None
+
+    if len(cycles) == 0:
+        return dict.fromkeys(TEST_METRICS)
+    stiffness = cycles['stiffness'].dropna().to_numpy()
+    degradation = (1 - stiffness[-1] / stiffness[0]
+                   if len(stiffness) > 0 and stiffness[0] else np.nan)
+    return {
+        'total_dissipated_energy': value(
+            np.nansum(cycles['hysteresis_area'])),
+        'strain_at_failure': value(cycles['peak_strain'].iloc[-1]),
+        'stiffness_degradation': value(degradation),
+    }
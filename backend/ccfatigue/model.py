@@ -1,23 +1,32 @@
-from datetime import date
+from datetime import date, datetime
 from enum import Enum
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 
 
 class Experience(BaseModel):
     id: str
-    laboratory: str
+    laboratory: Optional[str]
     researcher: str
     type: str
     date: date
+    n_tests: int
+    test_numbers: List[int]
+
+
+class ExperiencePage(BaseModel):
+    total: int
+    offset: int
+    limit: int
+    experiences: List[Experience]
 
 
 class Test(BaseModel):
     number: int
     color: str
     total_dissipated_energy: int
-    strain_at_failure: float
+    strain_at_failure: Optional[float]
 
 
 class Plot(BaseModel):
@@ -33,6 +42,24 @@ class Dashboard(BaseModel):
     plot: Plot
 
 
+class HysColumn(str, Enum):
+    CREEP = 'creep'
+    HYSTERESIS_AREA = 'hysteresis_area'
+    STIFFNESS = 'stiffness'
+
+
+class PlotFormat(str, Enum):
+    BOKEH = 'bokeh'
+    COMPACT = 'compact'
+
+
+class SeriesRange(BaseModel):
+    column: HysColumn
+    level: int
+    n_cycles: List[float]
+    values: List[float]
+
+
 class SnCurveMethod(str, Enum):
     LIN_LOG = 'LinLog'
     LOG_LOG = 'LogLog'
@@ -40,6 +67,134 @@ class SnCurveMethod(str, Enum):
     WHITNEY = 'Whitney'
 
 
+class SnCurveEngine(str, Enum):
+    FORTRAN = 'fortran'
+    NUMPY = 'numpy'
+
+
+class SnCurve(BaseModel):
+    r_ratio: float
+    n_cycles: List[float]
+    stress_parameter: List[Optional[float]]
+    low: Optional[List[Optional[float]]]
+    high: Optional[List[Optional[float]]]
+
+
+class SnCurveBand(BaseModel):
+    r_ratio: float
+    n_cycles: List[float]
+    low: List[Optional[float]]
+    high: List[Optional[float]]
+
+
 class SnCurveResult(BaseModel):
     outputs: Dict[SnCurveMethod, bytes]
+    curves: Dict[SnCurveMethod, List[SnCurve]]
+    bands: Dict[SnCurveMethod, List[SnCurveBand]] = {}
+    plot: Any
+
+
+class CycleCountingMethod(str, Enum):
+    RAINFLOW = 'Rainflow'
+    SIMPLIFIED_RAINFLOW = 'SimplifiedRainflow'
+    RANGE_PAIR = 'RangePair'
+    RANGE_MEAN = 'RangeMean'
+
+
+class CycleBin(BaseModel):
+    range: float
+    mean: float
+    r_ratio: float
+    n_cycles: float
+    cumulative: float
+
+
+class CycleCountingResult(BaseModel):
+    method: CycleCountingMethod
+    n_samples: int
+    n_turning_points: int
+    n_cycles: float
+    bins: List[CycleBin]
+
+
+class CldMethod(str, Enum):
+    LINEAR = 'Linear'
+    KAWAI = 'Kawai'
+    PIECEWISE_LINEAR = 'PiecewiseLinear'
+
+
+class FatigueLife(BaseModel):
+    factor: float
+    max_stress: float
+    damage: float
+    n_blocks: Optional[float]
+
+
+class LifePrediction(BaseModel):
+    sn_method: SnCurveMethod
+    cld_method: CldMethod
+    lives: List[FatigueLife]
+
+
+class FatigueLifeResult(BaseModel):
+    cycle_counting: CycleCountingResult
+    predictions: List[LifePrediction]
+
+
+class FailureCriterion(str, Enum):
+    FTPF = 'FTPF'
+    SIMS_BROGDON = 'SB'
+    FAWAZ_ELLYIN = 'FawazEllyin'
+    KAWAI = 'Kawai'
+    SHOKRIEH_TAHERI = 'ShokriehTaheri'
+    HASHIN_ROTEM = 'HR'
+
+
+class SnModel(str, Enum):
+    LIN_LOG = 'Lin-Log'
+    LOG_LOG = 'Log-Log'
+
+
+class FailureEnvelope(BaseModel):
+    r_ratio: float
+    n_cycles: float
+    angles: List[float]
+    stress: List[Optional[float]]
+
+
+class FailureResult(BaseModel):
+    envelopes: List[FailureEnvelope]
     plot: Any
+
+
+class CacheStats(BaseModel):
+    name: str
+    hits: int
+    disk_hits: int
+    misses: int
+    evictions: int
+    entries: int
+    bytes: int
+    max_bytes: int
+
+
+class JobKind(str, Enum):
+    SN_CURVE = 'snCurve'
+    FATIGUE_LIFE = 'fatigueLife'
+
+
+class JobStatus(str, Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class Job(BaseModel):
+    id: str
+    kind: JobKind
+    status: JobStatus
+    progress: float
+    created: datetime
+    updated: datetime
+    error: Optional[str]
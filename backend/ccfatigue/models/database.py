@@ -1,8 +1,96 @@
 '''
 Define the model as it is saved in the DB
 '''
+from sqlalchemy import (
+    BigInteger, Boolean, Column, Date, Float, ForeignKey, Index, Integer,
+    String, Text, UniqueConstraint)
 
 from ccfatigue.services.database import Base
 
 
-# Here will come Model definitions
+class Experiment(Base):
+    '''One TST_{Researcher}_{Date}_{Type} folder.'''
+    __tablename__ = 'experiment'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+    laboratory = Column(String)
+    researcher = Column(String, nullable=False)
+    type = Column(String, nullable=False)
+    date = Column(Date, nullable=False)
+
+
+class ExperimentMetadata(Base):
+    '''One entry of the metadata file of an experiment.'''
+    __tablename__ = 'experiment_metadata'
+
+    experiment_id = Column(Integer,
+                           ForeignKey('experiment.id', ondelete='CASCADE'),
+                           primary_key=True)
+    section = Column(String, primary_key=True)
+    name = Column(String, primary_key=True)
+    value = Column(Text)
+
+
+class Test(Base):
+    '''One specimen of an experiment.'''
+    __tablename__ = 'test'
+    __table_args__ = (UniqueConstraint('experiment_id', 'number'),)
+
+    id = Column(Integer, primary_key=True)
+    experiment_id = Column(Integer,
+                           ForeignKey('experiment.id', ondelete='CASCADE'),
+                           nullable=False)
+    number = Column(Integer, nullable=False)
+    stress_ratio = Column(Float)
+    maximum_stress = Column(Float)
+    loading_rate = Column(Float)
+    run_out = Column(Boolean)
+    # derived from the machine columns at ingest time
+    total_dissipated_energy = Column(Float)
+    strain_at_failure = Column(Float)
+    stiffness_degradation = Column(Float)
+
+
+class Measurement(Base):
+    '''One row of a TST test file.'''
+    __tablename__ = 'measurement'
+    __table_args__ = (
+        Index('ix_measurement_test_n_cycles', 'test_id', 'machine_n_cycles'),
+    )
+
+    test_id = Column(Integer, ForeignKey('test.id', ondelete='CASCADE'),
+                     primary_key=True)
+    row = Column(Integer, primary_key=True, autoincrement=False)
+    machine_n_cycles = Column(BigInteger)
+    machine_load = Column(Float)
+    machine_displacement = Column(Float)
+    image_index = Column(Float)
+    camera_n_cycles = Column(Float)
+    exx = Column(Float)
+    eyy = Column(Float)
+    exy = Column(Float)
+    crack_length = Column(Float)
+    th_time = Column(Float)
+    th_n_cycles = Column(Float)
+    th_specimen_max = Column(Float)
+    th_specimen_mean = Column(Float)
+    th_chamber = Column(Float)
+    th_uppergrips = Column(Float)
+    th_lowergrips = Column(Float)
+
+
+class HysMeasurement(Base):
+    '''One cycle of a HYS file, the cyclic evolution of a test.'''
+    __tablename__ = 'hys_measurement'
+    __table_args__ = (
+        Index('ix_hys_measurement_test_n_cycles', 'test_id', 'n_cycles'),
+    )
+
+    test_id = Column(Integer, ForeignKey('test.id', ondelete='CASCADE'),
+                     primary_key=True)
+    row = Column(Integer, primary_key=True, autoincrement=False)
+    n_cycles = Column(BigInteger)
+    creep = Column(Float)
+    hysteresis_area = Column(Float)
+    stiffness = Column(Float)
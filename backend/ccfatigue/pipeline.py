@@ -0,0 +1,82 @@
+'''
+In-process fatigue life prediction: S-N curve fitting, constant life
+diagram and Miner damage summation of a counted load spectrum.
+
+Stages exchange NumPy arrays instead of the text files of the Fortran
+programs. Every S-N method is fitted once, then each (S-N, CLD) branch is
+evaluated on the worker pool as soon as its curves are available.
+'''
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from tempfile import SpooledTemporaryFile
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pandas.core.frame import DataFrame
+
+from ccfatigue import analyzer, cld, cyclecounter, damage, sncurve
+from ccfatigue.config import settings
+from ccfatigue.model import (
+    CldMethod, CycleBin, CycleCountingMethod, FatigueLife, FatigueLifeResult,
+    LifePrediction, SnCurveMethod)
+
+executor = ThreadPoolExecutor(max_workers=settings.pipeline_max_workers)
+
+
+def predict_life(curves: DataFrame,
+                 cld_method: CldMethod,
+                 static: cld.StaticStrength,
+                 bins: List[CycleBin],
+                 factors: List[float]) -> List[FatigueLife]:
+    amplitude = cld.create(curves, cld_method, static)
+    return damage.sum_damage(amplitude, bins, factors)
+
+
+def run_fatigue_life(file: SpooledTemporaryFile,
+                     spectrum: SpooledTemporaryFile,
+                     sn_methods: List[SnCurveMethod],
+                     cld_methods: List[CldMethod],
+                     static: cld.StaticStrength,
+                     factors: List[float],
+                     counting_method: CycleCountingMethod,
+                     progress: Optional[Callable[[float], None]] = None
+                     ) -> FatigueLifeResult:
+    '''progress, if given, is called with the fraction of the stages done:
+    the counting, every fit and every branch.'''
+    sn_methods = list(dict.fromkeys(sn_methods))
+    cld_methods = list(dict.fromkeys(cld_methods))
+    datasets = sncurve.read_input(analyzer.read_input(file))
+    fits: Dict[Future, SnCurveMethod] = {
+        executor.submit(sncurve.fit, datasets, method): method
+        for method in sn_methods
+    }
+    # count the spectrum while the S-N curves are fitted
+    cycle_counting = cyclecounter.run_cycle_counting(spectrum,
+                                                     counting_method)
+    n_stages = 1 + len(sn_methods) * (1 + len(cld_methods))
+    done = 1
+
+    def report() -> None:
+        if progress is not None:
+            progress(done / n_stages)
+    report()
+    branches: Dict[Tuple[SnCurveMethod, CldMethod], Future] = {}
+    for fit in as_completed(fits):
+        curves, _ = fit.result()
+        for cld_method in cld_methods:
+            branches[(fits[fit], cld_method)] = executor.submit(
+                predict_life, curves, cld_method, static,
+                cycle_counting.bins, factors)
+        done += 1
+        report()
+    for _ in as_completed(branches.values()):
+        done += 1
+        report()
+    return FatigueLifeResult(
+        cycle_counting=cycle_counting,
+        predictions=[
+            LifePrediction(sn_method=sn_method,
+                           cld_method=cld_method,
+                           lives=branches[(sn_method, cld_method)].result())
+            for sn_method in sn_methods
+            for cld_method in cld_methods
+        ],
+    )
@@ -1,8 +1,10 @@
+import base64
 import json
 import os
 from enum import Enum
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
+import numpy as np
 from bokeh import palettes
 from bokeh.embed import json_item
 from bokeh.models.sources import ColumnDataSource
@@ -10,10 +12,17 @@ from bokeh.models.tools import HoverTool
 from bokeh.plotting import figure, output_file, save
 from pydantic.main import BaseModel
 
+from ccfatigue import instrumentation
+from ccfatigue.model import PlotFormat
+
 OUTPUT_DIRECTORY: str = './output'
+MAX_POINTS: int = 2000
+# largest integer a float32 holds exactly
+MAX_FLOAT32_INTEGER: int = 2 ** 24
 
 
 class DataKey(Enum):
+    ANGLE = ('angle', 'Off-axis angle')
     CREEP = ('creep', 'Creep')
     HIGH = ('high', 'High')
     HYST_AREA = ('hyst_area', 'Hysteresis area')
@@ -30,8 +39,14 @@ class DataKey(Enum):
         self.label = label
 
 
+class Decimation(str, Enum):
+    NONE = 'none'
+    LTTB = 'lttb'
+    MIN_MAX = 'minMax'
+
+
 class Line(BaseModel):
-    data: Dict[DataKey, List[Any]]
+    data: Dict[DataKey, Any]
     legend_label: Optional[str]
     color: Optional[str]
 
@@ -44,6 +59,83 @@ class Plot(BaseModel):
     lines: List[Line] = []
     x_axis_type: str = 'auto'
     y_axis_type: str = 'auto'
+    decimation: Decimation = Decimation.NONE
+    max_points: int = MAX_POINTS
+
+
+def get_bucket_bounds(size: int, n_buckets: int) -> np.ndarray:
+    '''Split range(1, size - 1) into n_buckets contiguous buckets.'''
+    return np.linspace(1, size - 1, n_buckets + 1).astype(int)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    '''Largest-Triangle-Three-Buckets: indices of the points to keep.'''
+    size = len(x)
+    bounds = get_bucket_bounds(size, n_out - 2)
+    # centroid of every bucket, plus the last point as a final bucket
+    sums_x = np.add.reduceat(x[:-1], bounds[:-1])
+    sums_y = np.add.reduceat(y[:-1], bounds[:-1])
+    counts = np.diff(bounds)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = size - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = bounds[i], bounds[i + 1]
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        areas = np.abs((x[a] - avg_x[i + 1]) * (bucket_y - y[a])
+                       - (x[a] - bucket_x) * (avg_y[i + 1] - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+
+def min_max_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    '''Keep the minimum and the maximum of y in every bucket.'''
+    size = len(x)
+    bounds = get_bucket_bounds(size, max((n_out - 2) // 2, 1))
+    starts, ends = bounds[:-1], bounds[1:]
+    # buckets differ in length by at most one: view them as a padded matrix
+    offsets = np.arange(np.max(ends - starts))
+    rows = starts[:, np.newaxis] + offsets
+    valid = rows < ends[:, np.newaxis]
+    rows = np.where(valid, rows, starts[:, np.newaxis])
+    values = y[rows]
+    mins = np.argmin(np.where(valid, values, np.inf), axis=1)
+    maxs = np.argmax(np.where(valid, values, -np.inf), axis=1)
+    return np.concatenate(([0, size - 1], starts + mins, starts + maxs))
+
+
+DECIMATORS: Dict[Decimation, Callable[[np.ndarray, np.ndarray, int],
+                                      np.ndarray]] = {
+    Decimation.LTTB: lttb_indices,
+    Decimation.MIN_MAX: min_max_indices,
+}
+
+
+def decimate(data: Dict[DataKey, Any],
+             x_axis: DataKey,
+             y_axis: DataKey,
+             decimation: Decimation,
+             max_points: int) -> Dict[DataKey, Any]:
+    '''Reduce every column of a line to at most ~max_points points.
+
+    The first and last (failure) points and the extrema of y are always kept.
+    '''
+    if decimation == Decimation.NONE:
+        return data
+    x = np.asarray(data[x_axis], dtype=float)
+    y = np.asarray(data[y_axis], dtype=float)
+    if len(x) <= max(max_points, 3):
+        return data
+    filled_y = np.nan_to_num(y)
+    indices = DECIMATORS[decimation](x, filled_y, max_points)
+    peaks = [np.argmax(filled_y), np.argmin(filled_y)]
+    indices = np.unique(np.concatenate((indices, peaks)))
+    return {key: np.asarray(values)[indices] for key, values in data.items()}
 
 
 def save_json(json_data: Any, filename: str) -> None:
@@ -52,7 +144,53 @@ def save_json(json_data: Any, filename: str) -> None:
         json.dump(json_data, file)
 
 
-def export_plot(plot: Plot, save_html=False) -> Any:
+def encode_array(values: Any) -> Dict[str, str]:
+    '''Base64 of the little-endian float32 values, or float64 when they
+    hold integers too large for float32, such as cycle numbers.'''
+    values = np.asarray(values, dtype=float)
+    finite = values[np.isfinite(values)]
+    exact = (len(finite) == 0 or np.any(finite != np.round(finite))
+             or np.max(np.abs(finite)) <= MAX_FLOAT32_INTEGER)
+    dtype = '<f4' if exact else '<f8'
+    return {
+        'dtype': 'float32' if exact else 'float64',
+        'data': base64.b64encode(values.astype(dtype).tobytes()).decode(),
+    }
+
+
+def count_points(plot: Plot) -> int:
+    return sum(len(line.data[plot.x_axis]) for line in plot.lines)
+
+
+def export_compact(plot: Plot) -> Dict[str, Any]:
+    '''Plot spec and line data as typed arrays, for the client to draw.'''
+    def axis(key: DataKey, axis_type: str) -> Dict[str, str]:
+        return {'key': key.key, 'label': key.label, 'type': axis_type}
+
+    lines = []
+    with instrumentation.span('plot_compact', count_points(plot)):
+        for i, line in enumerate(plot.lines):
+            line_data = decimate(line.data, plot.x_axis, plot.y_axis,
+                                 plot.decimation, plot.max_points)
+            lines.append({
+                'legend_label': line.legend_label or plot.title,
+                'color': line.color or palettes.Category10_10[i % 10],
+                'length': len(line_data[plot.x_axis]),
+                'data': {k.key: encode_array(v)
+                         for k, v in line_data.items()},
+            })
+    return {
+        'format': PlotFormat.COMPACT.value,
+        'title': plot.title,
+        'x_axis': axis(plot.x_axis, plot.x_axis_type),
+        'y_axis': axis(plot.y_axis, plot.y_axis_type),
+        'tooltips': [{'key': key.key, 'label': key.label}
+                     for key in plot.tooltips],
+        'lines': lines,
+    }
+
+
+def build_figure(plot: Plot) -> Any:
     fig = figure(title=plot.title,
                  x_axis_label=plot.x_axis.label,
                  y_axis_label=plot.y_axis.label,
@@ -63,7 +201,9 @@ def export_plot(plot: Plot, save_html=False) -> Any:
         tooltips=[(key.label, '@' + key.key) for key in plot.tooltips]
     ))
     for i, line in enumerate(plot.lines):
-        data = {k.key: v for k, v in line.data.items()}
+        line_data = decimate(line.data, plot.x_axis, plot.y_axis,
+                             plot.decimation, plot.max_points)
+        data = {k.key: v for k, v in line_data.items()}
         source = ColumnDataSource(data=data)
         fig.line(x=plot.x_axis.key,
                  y=plot.y_axis.key,
@@ -73,9 +213,20 @@ def export_plot(plot: Plot, save_html=False) -> Any:
                  color=line.color
                  or palettes.Category10_10[i % 10],
                  )
+    return fig
+
+
+def export_plot(plot: Plot,
+                save_html=False,
+                plot_format: PlotFormat = PlotFormat.BOKEH) -> Any:
+    if plot_format == PlotFormat.COMPACT:
+        return export_compact(plot)
+    with instrumentation.span('plot_figure', count_points(plot)):
+        fig = build_figure(plot)
     if save_html:
         os.makedirs(OUTPUT_DIRECTORY, exist_ok=True)
         output_file(filename=os.path.join(OUTPUT_DIRECTORY,
                                           plot.title.lower() + '.html'))
         save(fig)
-    return json_item(fig)
+    with instrumentation.span('plot_serialize'):
+        return json_item(fig)
@@ -0,0 +1,121 @@
+'''
+Multi-resolution zoom pyramid of the HYS cyclic-evolution columns.
+
+Every level keeps about 1/LEVEL_FACTOR of the points of the previous one,
+selected with min/max decimation so peaks survive. Levels are stored as
+positions into the cycle-sorted rows, next to the columnar cache of the CSV,
+and are rebuilt together with it when the source file changes.
+'''
+import os
+import tempfile
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ccfatigue import plotter, storage
+
+X_COLUMN: str = 'n_cycles'
+LEVEL_FACTOR: int = 4
+MIN_LEVEL_POINTS: int = 1000
+
+
+def save_array(path: str, array: np.ndarray) -> None:
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                     suffix='.npy',
+                                     delete=False) as file:
+        np.save(file, array)
+    os.replace(file.name, path)
+
+
+def get_pyramid_directory(entry_directory: str, column: str) -> str:
+    return os.path.join(entry_directory, 'pyramid', column)
+
+
+def get_order(x: np.ndarray) -> Optional[np.ndarray]:
+    '''Row order sorting x, or None when x is already sorted.'''
+    if len(x) > 1 and np.any(x[1:] < x[:-1]):
+        return np.argsort(x, kind='stable')
+    return None
+
+
+def build_levels(sorted_x: np.ndarray,
+                 sorted_y: np.ndarray) -> List[np.ndarray]:
+    '''Positions kept by each level, from the finest to the coarsest.'''
+    levels = []
+    filled_y = np.nan_to_num(sorted_y)
+    size = len(sorted_x) // LEVEL_FACTOR
+    while size >= MIN_LEVEL_POINTS:
+        levels.append(np.unique(
+            plotter.min_max_indices(sorted_x, filled_y, size)))
+        size //= LEVEL_FACTOR
+    return levels
+
+
+def load_pyramid(csv_path: str,
+                 column: str) -> Tuple[np.ndarray, np.ndarray,
+                                       Optional[np.ndarray],
+                                       List[np.ndarray]]:
+    '''Return x, y, the sorting order and the levels of column, building
+    the levels on first use.'''
+    columns = storage.read_columns(csv_path, [X_COLUMN, column])
+    x, y = columns[X_COLUMN], columns[column]
+    entry_directory, _ = storage.get_entry(csv_path)
+    directory = get_pyramid_directory(entry_directory, column)
+    order_path = os.path.join(directory, 'order.npy')
+    # written last, marks a complete pyramid
+    count_path = os.path.join(directory, 'levels.npy')
+    if not os.path.exists(count_path):
+        os.makedirs(directory, exist_ok=True)
+        order = get_order(x)
+        if order is None:
+            levels = build_levels(x, y)
+        else:
+            save_array(order_path, order)
+            levels = build_levels(x[order], y[order])
+        for i, level in enumerate(levels):
+            save_array(os.path.join(directory, f'level_{i + 1}.npy'), level)
+        save_array(count_path, np.array([len(levels)]))
+    count = int(np.load(count_path)[0])
+    order = (np.load(order_path, mmap_mode='r')
+             if os.path.exists(order_path) else None)
+    levels = [np.load(os.path.join(directory, f'level_{i + 1}.npy'),
+                      mmap_mode='r')
+              for i in range(count)]
+    return x, y, order, levels
+
+
+def thin(x: np.ndarray,
+         y: np.ndarray,
+         max_points: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''Keep the extrema of y by buckets when there are over max_points.'''
+    if len(x) <= max_points:
+        return x, y
+    keep = np.unique(plotter.min_max_indices(x, np.nan_to_num(y),
+                                             max_points))
+    return x[keep], y[keep]
+
+
+def query(csv_path: str,
+          column: str,
+          n_cycles_min: float,
+          n_cycles_max: float,
+          max_points: int) -> Tuple[int, np.ndarray, np.ndarray]:
+    '''Return the level used and the (n_cycles, column) points of the finest
+    level holding at most max_points points within the cycle range.'''
+    x, y, order, levels = load_pyramid(csv_path, column)
+    sorted_x = x if order is None else x[order]
+    low, high = (np.searchsorted(sorted_x, n_cycles_min, side='left'),
+                 np.searchsorted(sorted_x, n_cycles_max, side='right'))
+    level = 0
+    positions = np.arange(low, high)
+    if high - low > max_points:
+        for level, level_positions in enumerate(levels, start=1):
+            start, end = np.searchsorted(level_positions, [low, high])
+            positions = np.asarray(level_positions[start:end])
+            if end - start <= max_points:
+                break
+    rows = positions if order is None else np.asarray(order)[positions]
+    # even the coarsest level may be too dense for this window
+    window_x, window_y = thin(np.asarray(x[rows]), np.asarray(y[rows]),
+                              max_points)
+    return level, window_x, window_y
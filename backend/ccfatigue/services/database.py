@@ -1,5 +1,11 @@
 """
 Database Service
+
+Importing this module does not touch the database: the asyncpg pool opens on
+the first query (see services.measurements) and the schema is created once by
+running
+
+    pipenv run python -m ccfatigue.services.database
 """
 from urllib.parse import quote_plus
 
@@ -17,14 +23,36 @@ __port = settings.postgres_port
 __hostname = f'{quote_plus(__password)}@{__host}'
 __url = f'postgresql://{__username}:{__hostname}:{__port}/{__database}'
 
-database = databases.Database(__url)
+# asyncpg keeps a per-connection cache of prepared statements, so repeated
+# dashboard queries are parsed and planned once per pooled connection
+database = databases.Database(
+    __url,
+    min_size=settings.postgres_pool_min_size,
+    max_size=settings.postgres_pool_max_size,
+    statement_cache_size=settings.postgres_statement_cache_size,
+    command_timeout=settings.postgres_command_timeout,
+)
 
-if not database_exists(__url):
-    print('DB does not exist -> create !')
-    create_database(__url)
-else:
-    print('DB already exists')
-
-engine = sqlalchemy.create_engine(__url, echo=True)
+# lazy: the first connection is opened by the first query
+engine = sqlalchemy.create_engine(__url, echo=settings.postgres_echo,
+                                  pool_pre_ping=True)
 
 Base = declarative_base(bind=engine)
+
+
+def create_schema() -> None:
+    '''Create the database and its tables if they do not exist.'''
+    from ccfatigue.models import database as models  # noqa: F401
+
+    if not database_exists(__url):
+        print('DB does not exist -> create !')
+        create_database(__url)
+    else:
+        print('DB already exists')
+    Base.metadata.create_all(engine)
+    # do not hand these connections down to forked workers
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    create_schema()
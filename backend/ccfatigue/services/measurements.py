@@ -0,0 +1,89 @@
+"""
+Async reads of ingested tests, on the asyncpg pool of the database service
+"""
+import asyncio
+import math
+import time
+from datetime import date
+from typing import Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from ccfatigue.config import settings
+from ccfatigue.models.database import Experiment, HysMeasurement, Test
+from ccfatigue.services.database import database
+
+# created on first use, inside the event loop of the worker
+connect_lock: Optional[asyncio.Lock] = None
+# monotonic time before which the database is not tried again
+unavailable_until: float = 0.0
+
+
+def is_available() -> bool:
+    return time.monotonic() >= unavailable_until
+
+
+def set_unavailable() -> None:
+    '''Skip the database for postgres_retry_seconds, rather than wait for
+    a connection timeout on every request.'''
+    global unavailable_until
+    unavailable_until = time.monotonic() + settings.postgres_retry_seconds
+
+
+async def connect() -> None:
+    '''Open the pool on the first query rather than at worker startup.'''
+    global connect_lock
+    if database.is_connected:
+        return
+    if connect_lock is None:
+        connect_lock = asyncio.Lock()
+    async with connect_lock:
+        if not database.is_connected:
+            await database.connect()
+
+
+async def disconnect() -> None:
+    if database.is_connected:
+        await database.disconnect()
+
+
+async def find_test(laboratory: str,
+                    researcher: str,
+                    experience_type: str,
+                    date: date,
+                    test_number: int) -> Optional[int]:
+    '''Id of an ingested test, None when it is only available as files.'''
+    query = (select(Test.id)
+             .join(Experiment, Test.experiment_id == Experiment.id)
+             .where(Experiment.laboratory == laboratory,
+                    Experiment.researcher == researcher,
+                    Experiment.type == experience_type,
+                    Experiment.date == date.replace(day=1),
+                    Test.number == test_number))
+    await connect()
+    return await database.fetch_val(query)
+
+
+async def fetch_hys_range(test_id: int,
+                          column: str,
+                          n_cycles_min: float,
+                          n_cycles_max: float) -> Tuple[np.ndarray,
+                                                        np.ndarray]:
+    '''(n_cycles, column) points of a test within a cycle range, read
+    through the (test_id, n_cycles) index.'''
+    # asyncpg only binds integers to the bigint n_cycles column
+    query = (select(HysMeasurement.n_cycles,
+                    getattr(HysMeasurement, column))
+             .where(HysMeasurement.test_id == test_id,
+                    HysMeasurement.n_cycles >= math.ceil(n_cycles_min))
+             .order_by(HysMeasurement.n_cycles))
+    if math.isfinite(n_cycles_max):
+        query = query.where(
+            HysMeasurement.n_cycles <= math.floor(n_cycles_max))
+    await connect()
+    rows = await database.fetch_all(query)
+    points = np.array([tuple(row) for row in rows], dtype=float)
+    if len(points) == 0:
+        return np.empty(0), np.empty(0)
+    return points[:, 0], points[:, 1]
@@ -0,0 +1,409 @@
+'''
+Native NumPy implementation of the S-N curve fits of
+CCFatigue_modules/2_S-NCurves (LinLog, LogLog, Sendeckyj and Whitney).
+
+The input is the whitespace separated file read by the Fortran programs:
+R ratio, reliability level, stress level, stress, number of cycles and
+residual strength, one specimen per row, R ratios grouped together.
+'''
+import io
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+from ccfatigue.model import SnCurveMethod
+from ccfatigue.plotter import DataKey
+
+CONFIDENCE: int = 95
+WHITNEY_RUNOUT: float = 5e7
+
+SENDECKYJ_S_START: float = 0.001
+SENDECKYJ_S_END: float = 0.5
+SENDECKYJ_S_STEP: float = 0.0005
+SENDECKYJ_C_START: float = 1e-6
+SENDECKYJ_C_END: float = 10
+SENDECKYJ_MAX_STALLED: int = 500
+SENDECKYJ_CHUNK: int = 32
+# (relative gain of the best shape, next C step), checked in this order
+SENDECKYJ_C_STEPS: List[Tuple[float, float]] = [
+    (1e-2, 1e-6),
+    (1e-3, 1e-5),
+    (1e-4, 1e-4),
+    (1e-5, 1e-3),
+    (1e-6, 1e-2),
+    (1e-7, 1e-1),
+]
+
+# F distribution at 95% confidence (ASTM E739-91),
+# F_TABLE_95[denominator dof - 1][numerator dof - 1]
+F_TABLE_95 = np.array([
+    [161.45, 199.50, 215.71, 224.58, 230.16, 233.99],
+    [18.513, 19.000, 19.164, 19.247, 19.296, 19.330],
+    [10.128, 9.5521, 9.2766, 9.1172, 9.0135, 8.9406],
+    [7.7086, 6.9443, 6.5914, 6.3883, 6.2560, 6.1631],
+    [6.6079, 5.7861, 5.4095, 5.1922, 5.0503, 4.9503],
+    [5.9874, 5.1433, 4.7571, 4.5337, 4.3874, 4.2839],
+    [5.5914, 4.7374, 4.3468, 4.1203, 3.9715, 3.8660],
+    [5.3177, 4.459, 4.0662, 3.8378, 3.6875, 3.5806],
+    [5.1174, 4.2565, 3.8626, 3.6331, 3.4817, 3.3738],
+    [4.9646, 4.1028, 3.7083, 3.478, 3.3258, 3.2172],
+    [4.8443, 3.9823, 3.5874, 3.3567, 3.2039, 3.0946],
+    [4.7472, 3.8853, 3.4903, 3.2592, 3.1059, 2.9961],
+    [4.6672, 3.8056, 3.4105, 3.1791, 3.0254, 2.9153],
+    [4.6001, 3.7389, 3.3439, 3.1122, 2.9582, 2.8477],
+    [4.5431, 3.6823, 3.2874, 3.0556, 2.9013, 2.7905],
+    [4.4940, 3.6337, 3.2389, 3.0069, 2.8524, 2.7413],
+    [4.4513, 3.5915, 3.1968, 2.9647, 2.8100, 2.6987],
+    [4.4139, 3.5546, 3.1599, 2.9277, 2.7729, 2.6613],
+    [4.3808, 3.5219, 3.1274, 2.8951, 2.7401, 2.6283],
+    [4.3513, 3.4928, 3.0984, 2.8661, 2.7109, 2.5990],
+    [4.3248, 3.4668, 3.0725, 2.8401, 2.6848, 2.5727],
+    [4.3009, 3.4434, 3.0491, 2.8167, 2.6613, 2.5491],
+    [4.2793, 3.4221, 3.0280, 2.7955, 2.6400, 2.5277],
+    [4.2597, 3.4028, 3.0088, 2.7763, 2.6207, 2.5082],
+    [4.2417, 3.3852, 2.9912, 2.7587, 2.6030, 2.4904],
+])
+
+
+class Dataset:
+    '''Specimens of one R ratio.'''
+
+    def __init__(self, rows: np.ndarray):
+        self.r_ratio: float = float(rows[0, 0])
+        self.reliability: float = float(rows[0, 1])
+        self.stress_level: np.ndarray = rows[:, 2]
+        self.stress: np.ndarray = rows[:, 3]
+        self.n_cycles: np.ndarray = rows[:, 4]
+        self.residual_strength: np.ndarray = (rows[:, 5] if rows.shape[1] > 5
+                                              else rows[:, 3])
+
+    def get_level_bounds(self) -> np.ndarray:
+        '''Bounds of the runs of consecutive equal stress levels.'''
+        changes = np.flatnonzero(np.diff(self.stress_level) != 0) + 1
+        return np.concatenate(([0], changes, [len(self.stress_level)]))
+
+
+def read_input(input_data: bytes) -> List[Dataset]:
+    rows = np.atleast_2d(np.loadtxt(io.BytesIO(input_data)))
+    changes = np.flatnonzero(np.diff(rows[:, 0]) != 0) + 1
+    return [Dataset(group) for group in np.split(rows, changes)]
+
+
+def get_n_cycles(method: SnCurveMethod) -> np.ndarray:
+    '''Number of cycles at which the Fortran programs print the curve.'''
+    tail_start = (2000000
+                  if method in [SnCurveMethod.LIN_LOG, SnCurveMethod.LOG_LOG]
+                  else 3000000)
+    return np.concatenate((
+        np.arange(1, 1000, 50),
+        [1000],
+        np.arange(10000, 2000001, 10000),
+        np.arange(tail_start, 20000001, 1000000),
+        np.arange(30000000, 1400000001, 100000000),
+    )).astype(float)
+
+
+def fit_linear(dataset: Dataset,
+               method: SnCurveMethod,
+               n_cycles: np.ndarray) -> Tuple[Dict[str, float],
+                                              np.ndarray,
+                                              np.ndarray,
+                                              np.ndarray]:
+    '''ASTM E739 fit of log(N) = A + B * S (LinLog) or B * log(S) (LogLog)
+    with its confidence band.'''
+    log_scale = method == SnCurveMethod.LOG_LOG
+    x = np.log10(dataset.stress) if log_scale else dataset.stress
+    y = np.log10(dataset.n_cycles)
+    count = len(x)
+    x_mean = x.mean()
+    q = np.sum((x - x_mean) ** 2)
+    b = np.sum((x - x_mean) * (y - y.mean())) / q
+    a = y.mean() - b * x_mean
+    variance = np.sqrt(np.sum((y - (a + b * x)) ** 2) / (count - 2))
+    levels = len(dataset.get_level_bounds()) - 1
+    row, column = count - levels - 1, levels - 3
+    if 0 <= row < F_TABLE_95.shape[0] and 0 <= column < F_TABLE_95.shape[1]:
+        fp = F_TABLE_95[row, column]
+    else:
+        # the Fortran programs read their zero-initialised table: the band
+        # collapses onto the curve
+        fp = 0.0
+    pp = 2 * fp * variance ** 2
+
+    log_n = np.log10(n_cycles)
+    term_i = count * q * a * b - count * q * log_n * b + pp * count * x_mean
+    with np.errstate(invalid='ignore'):
+        term_ii = np.sqrt(count * pp * q * (
+            2 * count * a * b * x_mean
+            - 2 * count * log_n * b * x_mean
+            + q * b ** 2
+            + count * b ** 2 * x_mean ** 2
+            + count * log_n ** 2
+            - 2 * count * log_n * a
+            - pp
+            + count * a ** 2))
+    term_iii = count * (b ** 2 * q - pp)
+    low = -(term_i + term_ii) / term_iii
+    high = -(term_i - term_ii) / term_iii
+    if log_scale:
+        stress = 10 ** (-a / b) * n_cycles ** (1 / b)
+        low, high = 10 ** low, 10 ** high
+    else:
+        stress = -a / b + log_n / b
+    parameters = {'a': a, 'b': b, 'linearity_criterion': fp}
+    return parameters, stress, low, high
+
+
+def sendeckyj_alpha(dataset: Dataset,
+                    s: np.ndarray,
+                    c: np.ndarray) -> Tuple[np.ndarray, np.ndarray,
+                                            np.ndarray]:
+    '''Weibull shape of the equivalent static strengths for every (S, C)
+    pair, returned with the geometric means G and the normalized strengths.'''
+    count = len(dataset.stress)
+    failed = count - np.count_nonzero(
+        dataset.stress != dataset.residual_strength)
+    s = s[:, np.newaxis]
+    c = c[:, np.newaxis]
+    ratio = dataset.residual_strength / dataset.stress
+    equivalent = dataset.stress * (
+        (dataset.n_cycles - 1) * c + ratio ** (1 / s)) ** s
+    g = np.exp(np.mean(np.log(equivalent[:, :failed]), axis=1))
+    x = equivalent / g[:, np.newaxis]
+    log_x = np.log(x)
+    alpha = (np.log(np.log(count / (count + 1)) / np.log(1 / (count + 1)))
+             / np.log(x.min(axis=1) / x.max(axis=1)))
+    active = np.ones(len(alpha), dtype=bool)
+    for _ in range(100):
+        power = np.exp(alpha[:, np.newaxis] * log_x)
+        a = power.sum(axis=1)
+        b = (log_x * power).sum(axis=1)
+        d = (log_x ** 2 * power).sum(axis=1)
+        delta = (a - alpha * b) / (alpha * d)
+        active &= np.abs(delta / alpha) > 1e-6
+        alpha = np.where(active, alpha + delta, alpha)
+        if not active.any():
+            break
+    alpha[active] = np.nan
+    return alpha, g, x
+
+
+def sweep_sendeckyj(dataset: Dataset,
+                    s_values: np.ndarray,
+                    c: float,
+                    hint: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''Shapes along S for a given C, evaluated by growing chunks until the
+    shape starts to decrease; also return where it decreases. The first
+    chunk covers the hint, where the previous sweep stopped.'''
+    alphas = np.empty(0)
+    chunk = hint + SENDECKYJ_CHUNK
+    while len(alphas) < len(s_values):
+        s_chunk = s_values[len(alphas):len(alphas) + chunk]
+        with np.errstate(all='ignore'):
+            chunk_alphas, _, _ = sendeckyj_alpha(
+                dataset, s_chunk, np.full(len(s_chunk), c))
+        alphas = np.concatenate((alphas, chunk_alphas))
+        drops = np.flatnonzero(alphas[2:] < alphas[1:-1]) + 2
+        if len(drops):
+            break
+        chunk *= 2
+    return alphas, drops
+
+
+def fit_sendeckyj(dataset: Dataset,
+                  method: SnCurveMethod,
+                  n_cycles: np.ndarray) -> Tuple[Dict[str, float],
+                                                 np.ndarray,
+                                                 None,
+                                                 None]:
+    '''Wear-out model: (S, C) maximizing the Weibull shape of the
+    equivalent static strengths.
+
+    Follows the search path of the Fortran program: C grows with an
+    adaptive step and, for each C, S is swept until the shape decreases.
+    Each sweep over S is evaluated at once.
+    '''
+    s_values = SENDECKYJ_S_START + SENDECKYJ_S_STEP * np.arange(
+        int(round((SENDECKYJ_S_END - SENDECKYJ_S_START) / SENDECKYJ_S_STEP)))
+    c = SENDECKYJ_C_START
+    c_step = SENDECKYJ_C_START
+    max_alpha = 0.0
+    s_best = c_best = np.nan
+    previous_alpha = previous_c = None
+    stalled = 0
+    end = 0
+    while c < SENDECKYJ_C_END:
+        alphas, drops = sweep_sendeckyj(dataset, s_values, c, end)
+        end = drops[0] if len(drops) else len(alphas) - 1
+        swept = alphas[:end + 1]
+        if not np.all(np.isnan(swept)):
+            best = np.nanargmax(swept)
+            if swept[best] > max_alpha:
+                max_alpha, s_best, c_best = swept[best], s_values[best], c
+        peak = alphas[end - 1] if len(drops) else alphas[end]
+        if previous_alpha is not None:
+            gain = peak - previous_alpha
+            if gain / (c - previous_c) >= 0:
+                for threshold, step in SENDECKYJ_C_STEPS:
+                    if gain < threshold * max_alpha:
+                        c_step = step
+                stalled = 0
+            else:
+                stalled += 1
+                if stalled > SENDECKYJ_MAX_STALLED:
+                    break
+        previous_alpha = max_alpha
+        previous_c = c
+        c += c_step
+
+    alpha, g, x = sendeckyj_alpha(dataset,
+                                  np.array([s_best]),
+                                  np.array([c_best]))
+    alpha, g, x = alpha[0], g[0], x[0]
+    failed = len(x) - np.count_nonzero(
+        dataset.stress != dataset.residual_strength)
+    beta = g * (np.sum(x ** alpha) / failed) ** (1 / alpha)
+    a = -(1 - c_best) / c_best
+    stress = (beta
+              * (-np.log(dataset.reliability / 100)) ** (1 / alpha)
+              * (1 / ((n_cycles - a) * c_best)) ** s_best)
+    parameters = {'alpha': alpha, 'beta': beta, 's': s_best, 'c': c_best}
+    return parameters, stress, None, None
+
+
+def first_root(shapes: np.ndarray, values: np.ndarray) -> float:
+    '''First shape of the grid where the likelihood equation turns >= 0.'''
+    roots = np.flatnonzero(values >= 0)
+    return shapes[roots[0]] if len(roots) else shapes[-1]
+
+
+def fit_whitney(dataset: Dataset,
+                method: SnCurveMethod,
+                n_cycles: np.ndarray) -> Tuple[Dict[str, float],
+                                               np.ndarray,
+                                               None,
+                                               None]:
+    '''Pooled Weibull fit of the lives normalized per stress level.'''
+    bounds = dataset.get_level_bounds()
+    sizes = np.diff(bounds)
+    stress = np.repeat(np.add.reduceat(dataset.stress, bounds[:-1]) / sizes,
+                       sizes)
+    levels, first_rows = np.unique(stress, return_index=True)
+    levels = levels[np.argsort(first_rows)]
+    lives = [dataset.n_cycles[stress == level] for level in levels]
+    failures = [life[life < WHITNEY_RUNOUT] for life in lives]
+    specimens = np.array([len(life) for life in lives], dtype=float)
+    failed = np.array([len(failure) for failure in failures], dtype=float)
+    runouts = specimens - failed
+    means = np.array([failure.sum() for failure in failures]) / specimens
+    runout_ratios = WHITNEY_RUNOUT / means
+
+    with np.errstate(all='ignore'):
+        shapes = 0.001 * np.arange(1, 90001)
+        level_shapes = []
+        for failure, mean, runout, runout_ratio, n_failed in zip(
+                failures, means, runouts, runout_ratios, failed):
+            normalized = failure / mean
+            power = normalized ** shapes[:, np.newaxis]
+            runout_power = runout * runout_ratio ** shapes
+            likelihood = ((np.sum(power * np.log(normalized), axis=1)
+                           + runout_power * np.log(runout_ratio))
+                          / (power.sum(axis=1) + runout_power)
+                          - np.sum(np.log(normalized)) / n_failed
+                          - 1 / shapes)
+            level_shapes.append(first_root(shapes, likelihood))
+
+        characteristic = np.empty(len(levels))
+        # the Fortran program does not reset this sum between stress levels
+        cumulated = 0.0
+        for i, (failure, mean, shape) in enumerate(zip(failures, means,
+                                                       level_shapes)):
+            cumulated += np.sum((failure / mean) ** shape)
+            scale = ((cumulated + runouts[i] * runout_ratios[i] ** shape)
+                     / failed[i]) ** (1 / shape)
+            characteristic[i] = scale * mean
+
+        normalized = np.concatenate([failure / life for failure, life
+                                     in zip(failures, characteristic)])
+        runout_lives = WHITNEY_RUNOUT / characteristic
+        total_failed = failed.sum()
+        shapes = 0.0001 * np.arange(1, 300001)
+        power = normalized ** shapes[:, np.newaxis]
+        runout_power = runouts * runout_lives ** shapes[:, np.newaxis]
+        likelihood = ((np.sum(power * np.log(normalized), axis=1)
+                       + np.sum(runout_power * np.log(runout_lives), axis=1))
+                      / (power.sum(axis=1) + runout_power.sum(axis=1))
+                      - np.sum(np.log(normalized)) / total_failed
+                      - 1 / shapes)
+        pooled_shape = first_root(shapes, likelihood)
+
+    scale = ((np.sum(normalized ** pooled_shape)
+              + np.sum(runouts * runout_lives ** pooled_shape))
+             / total_failed) ** (1 / pooled_shape)
+    slope, intercept = np.polyfit(np.log10(levels),
+                                  np.log10(scale * characteristic), 1)
+    so = 10 ** (-intercept / slope)
+    power_law = -1 / slope
+    stress_parameter = (so
+                        * (-np.log(dataset.reliability / 100))
+                        ** (power_law / pooled_shape)
+                        * n_cycles ** (-power_law))
+    parameters = {'so': so, 'power': power_law,
+                  'shape': pooled_shape, 'scale': scale}
+    return parameters, stress_parameter, None, None
+
+
+FITS: Dict[SnCurveMethod, Callable] = {
+    SnCurveMethod.LIN_LOG: fit_linear,
+    SnCurveMethod.LOG_LOG: fit_linear,
+    SnCurveMethod.SENDECKYJ: fit_sendeckyj,
+    SnCurveMethod.WHITNEY: fit_whitney,
+}
+
+
+def fit(datasets: List[Dataset],
+        method: SnCurveMethod) -> Tuple[DataFrame, List[Dict[str, float]]]:
+    '''Fit method on every R ratio; return the curve points in the layout
+    of analyzer.create_dataframe and the fitted parameters.'''
+    n_cycles = get_n_cycles(method)
+    frames = []
+    parameters = []
+    for dataset in datasets:
+        fitted, stress, low, high = FITS[method](dataset, method, n_cycles)
+        frame = {
+            DataKey.R_RATIO.key: np.full(len(n_cycles), dataset.r_ratio),
+            DataKey.N_CYCLES.key: n_cycles,
+            DataKey.STRESS_PARAM.key: stress,
+        }
+        if low is not None:
+            frame[DataKey.LOW.key] = low
+            frame[DataKey.HIGH.key] = high
+        frames.append(pd.DataFrame(frame))
+        parameters.append({'r_ratio': dataset.r_ratio, **fitted})
+    return pd.concat(frames, ignore_index=True), parameters
+
+
+def fit_batch(input_data: List[bytes],
+              methods: List[SnCurveMethod]
+              ) -> List[Dict[SnCurveMethod, DataFrame]]:
+    '''Fit every method on several input files at once.'''
+    all_datasets = [read_input(data) for data in input_data]
+    return [{method: fit(datasets, method)[0] for method in methods}
+            for datasets in all_datasets]
+
+
+def render(df: DataFrame, parameters: List[Dict[str, float]]) -> bytes:
+    '''Text output laid out like the Fortran programs: a '0' separator and
+    the fitted parameters, then one curve point per line, for each R ratio.'''
+    lines = []
+    for fitted in parameters:
+        lines.append(' 0')
+        lines.extend(f'{value:16.9G}' for value in fitted.values())
+        selected = df[df[DataKey.R_RATIO.key] == fitted['r_ratio']]
+        for row in selected.itertuples(index=False):
+            r_ratio, n_cycles, *values = row
+            lines.append(f'{r_ratio:16.9G}{int(n_cycles):12d}'
+                         + ''.join(f'{value:17.9G}' for value in values))
+    return ('\n'.join(lines) + '\n').encode()
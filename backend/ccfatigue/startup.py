@@ -0,0 +1,77 @@
+'''
+Worker startup: preloading and benchmark.
+
+ccfatigue.main only imports FastAPI, pydantic and the settings; the
+endpoints import the heavy modules on first use. Under gunicorn, preload()
+runs once in the master (see deploy/test/gunicorn.conf.py) so that every
+forked worker, recycled ones included, starts with them already imported.
+
+    pipenv run python -m ccfatigue.startup
+
+measures, in fresh interpreters, the import time of the app and the latency
+of a first request to a few endpoints.
+'''
+import argparse
+import importlib
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+HEAVY_MODULES: List[str] = [
+    'ccfatigue.analyzer',
+    'ccfatigue.catalogue',
+    'ccfatigue.cyclecounter',
+    'ccfatigue.dashboarder',
+    'ccfatigue.failure',
+    'ccfatigue.jobs',
+    'ccfatigue.pipeline',
+    'ccfatigue.pyramid',
+    'ccfatigue.services.measurements',
+]
+FIRST_REQUESTS: List[str] = ['/cache/stats', '/experiences']
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import ccfatigue.main
+timings = {'import': time.perf_counter() - start}
+from fastapi.testclient import TestClient
+client = TestClient(ccfatigue.main.app)
+for path in sys.argv[1:]:
+    start = time.perf_counter()
+    client.get(path)
+    timings[path] = time.perf_counter() - start
+print(json.dumps(timings))
+'''
+
+
+def preload() -> None:
+    '''Import every module the endpoints import lazily.'''
+    for module in HEAVY_MODULES:
+        importlib.import_module(module)
+
+
+def probe(paths: List[str]) -> Dict[str, float]:
+    '''Seconds to import the app, then to serve each path once, measured
+    in a new interpreter.'''
+    output = subprocess.run([sys.executable, '-c', PROBE, *paths],
+                            capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description='Worker startup benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('paths', nargs='*', default=FIRST_REQUESTS)
+    args = parser.parse_args(argv)
+    runs = [probe(args.paths) for _ in range(args.runs)]
+    for stage in runs[0]:
+        values = [run[stage] * 1000 for run in runs]
+        print(f'{stage:>20}: median {statistics.median(values):8.1f} ms'
+              f'  max {max(values):8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+'''
+Columnar binary cache of the TST CSV files.
+
+Each CSV is converted once to one .npy file per numeric column, stored in a
+directory named after the source path. Later reads memory-map only the
+requested columns. The cache entry is rebuilt whenever the mtime or size of
+the source CSV changes.
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+CACHE_DIRECTORY: str = './cache/csv'
+MANIFEST_FILENAME: str = 'manifest.json'
+
+
+def get_entry_directory(csv_path: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(csv_path).encode()).hexdigest()
+    return os.path.join(CACHE_DIRECTORY, digest)
+
+
+def get_fingerprint(csv_path: str) -> Dict[str, int]:
+    stat = os.stat(csv_path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def read_manifest(entry_directory: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(entry_directory, MANIFEST_FILENAME)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(manifest: Optional[Dict], csv_path: str) -> bool:
+    return (manifest is not None
+            and manifest['fingerprint'] == get_fingerprint(csv_path))
+
+
+def convert(csv_path: str) -> Dict:
+    '''Write every numeric column of csv_path to the cache.'''
+    fingerprint = get_fingerprint(csv_path)
+    df: DataFrame = pd.read_csv(csv_path, encoding='utf-8-sig')
+    entry_directory = get_entry_directory(csv_path)
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(dir=CACHE_DIRECTORY)
+    columns = {}
+    for i, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        if values.dtype.kind not in 'biuf':
+            continue
+        filename = f'{i}.npy'
+        np.save(os.path.join(tmp_directory, filename), values)
+        columns[column] = filename
+    manifest = {
+        'source': os.path.abspath(csv_path),
+        'fingerprint': fingerprint,
+        'rows': len(df),
+        'columns': columns,
+    }
+    with open(os.path.join(tmp_directory, MANIFEST_FILENAME), 'w') as file:
+        json.dump(manifest, file)
+    # a directory cannot replace a non-empty one: the stale entry is moved
+    # aside first, and only deleted once the new one is published
+    old_directory = f'{tmp_directory}.old'
+    try:
+        os.rename(entry_directory, old_directory)
+    except FileNotFoundError:
+        pass
+    try:
+        os.replace(tmp_directory, entry_directory)
+    except OSError:
+        # another process published the same entry first
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+    shutil.rmtree(old_directory, ignore_errors=True)
+    return manifest
+
+
+def write_json(entry_directory: str, filename: str, data: Dict) -> bool:
+    '''Replace a file of a cache entry at once; False when the entry was
+    removed meanwhile by convert() in another process.'''
+    try:
+        with tempfile.NamedTemporaryFile('w', dir=entry_directory,
+                                         delete=False) as file:
+            json.dump(data, file)
+        os.replace(file.name, os.path.join(entry_directory, filename))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def has_fingerprint(entry_directory: str,
+                    fingerprint: Dict[str, int]) -> bool:
+    manifest = read_manifest(entry_directory)
+    return manifest is not None and manifest['fingerprint'] == fingerprint
+
+
+def update_fingerprint(csv_path: str) -> bool:
+    '''Keep the cache entry of a csv_path touched without changing its
+    content; False when there is no entry to keep.'''
+    entry_directory = get_entry_directory(csv_path)
+    manifest = read_manifest(entry_directory)
+    if manifest is None:
+        return False
+    manifest['fingerprint'] = get_fingerprint(csv_path)
+    # an entry converted meanwhile holds the same content
+    return write_json(entry_directory, MANIFEST_FILENAME, manifest)
+
+
+def get_entry(csv_path: str) -> Tuple[str, Dict]:
+    '''Return the up-to-date cache directory and manifest of csv_path.'''
+    entry_directory = get_entry_directory(csv_path)
+    manifest = read_manifest(entry_directory)
+    if not is_fresh(manifest, csv_path):
+        manifest = convert(csv_path)
+    return entry_directory, manifest
+
+
+def read_columns(csv_path: str,
+                 columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    '''Return the requested columns of csv_path as memory-mapped arrays.'''
+    entry_directory, manifest = get_entry(csv_path)
+    if columns is None:
+        columns = list(manifest['columns'])
+    missing = [column for column in columns
+               if column not in manifest['columns']]
+    if missing:
+        raise KeyError(f'{csv_path} has no numeric column {missing}')
+    try:
+        return load_columns(entry_directory, manifest, columns)
+    except FileNotFoundError:
+        # the entry was being replaced by another process: a cache miss
+        return load_columns(entry_directory, convert(csv_path), columns)
+
+
+def load_columns(entry_directory: str,
+                 manifest: Dict,
+                 columns: List[str]) -> Dict[str, np.ndarray]:
+    return {
+        column: np.load(os.path.join(entry_directory,
+                                     manifest['columns'][column]),
+                        mmap_mode='r')
+        for column in columns
+    }
+
+
+def read_csv(csv_path: str, columns: Optional[List[str]] = None) -> DataFrame:
+    '''Drop-in replacement of pd.read_csv served from the columnar cache.'''
+    return DataFrame(read_columns(csv_path, columns), copy=False)
+
+
+def read_derived(csv_path: str,
+                 name: str,
+                 compute: Callable[[], Dict]) -> Dict:
+    '''Values derived from csv_path, computed once and kept in its cache
+    entry, so they are dropped with it when the source CSV changes.'''
+    entry_directory, manifest = get_entry(csv_path)
+    filename = f'{name}.json'
+    try:
+        with open(os.path.join(entry_directory, filename)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        pass
+    values = compute()
+    fingerprint = manifest['fingerprint']
+    if not has_fingerprint(entry_directory, fingerprint):
+        # the source was replaced while computing: the new entry is not
+        # given values of the old one
+        return values
+    if (write_json(entry_directory, filename, values)
+            and not has_fingerprint(entry_directory, fingerprint)):
+        # replaced while writing
+        try:
+            os.remove(os.path.join(entry_directory, filename))
+        except FileNotFoundError:
+            pass
+    return values
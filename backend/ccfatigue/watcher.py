@@ -0,0 +1,323 @@
+'''
+Ingestion service: prepares new and changed TST experiment folders before
+anyone opens them.
+
+    pipenv run python -m ccfatigue.watcher
+    pipenv run python -m ccfatigue.watcher --once --database
+
+polls catalogue_directory every watcher_interval_seconds. The files of each
+folder are checked against the Data/Readme.md conventions, converted to the
+columnar storage and their derived metrics computed, on watcher_max_workers
+processes; with --database, their tests are also loaded in the database.
+
+The manifest (watcher_manifest) keeps the size, mtime and SHA-256 of every
+file: a file is hashed again only when its size or mtime changed, and
+processed again only when its content did. With --database, it also keeps
+the changed files of a folder until its tests are loaded: while the folder
+is invalid or the database cannot be reached, they stay pending.
+'''
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from ccfatigue import ingest, metrics, storage
+from ccfatigue.catalogue import (
+    TEST_PATTERN, find_files, parse_folder_name)
+from ccfatigue.config import settings
+
+MANDATORY_COLUMNS: Dict[str, List[str]] = {
+    'TST': ['Machine_N_cycles', 'Machine_Load', 'Machine_Displacement'],
+    'HYS': list(ingest.HYS_COLUMNS),
+}
+KNOWN_COLUMNS: Dict[str, List[str]] = {
+    'TST': list(ingest.MEASUREMENT_COLUMNS),
+    'HYS': list(ingest.HYS_COLUMNS),
+}
+INTEGER_COLUMNS: List[str] = ['Machine_N_cycles', 'index', 'Camera_N_cycles',
+                              'Th_time', 'Th_N_cycles', 'n_cycles']
+HASH_BLOCK_SIZE: int = 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def validate_columns(path: str, kind: str) -> List[str]:
+    '''Errors of the column names and types of a converted file.'''
+    header = pd.read_csv(path, encoding='utf-8-sig', nrows=0).columns
+    errors = [f'missing column {column}'
+              for column in MANDATORY_COLUMNS[kind]
+              if column not in header]
+    errors += [f'unknown column {column}' for column in header
+               if column not in KNOWN_COLUMNS[kind]]
+    if errors:
+        return errors
+    _, manifest = storage.get_entry(path)
+    for column in header:
+        if column not in manifest['columns']:
+            errors.append(f'column {column} is not numeric')
+        elif column in INTEGER_COLUMNS:
+            values = storage.read_columns(path, [column])[column]
+            values = values[~np.isnan(values)]
+            if np.any(values != np.round(values)):
+                errors.append(f'column {column} is not integer')
+    return errors
+
+
+def get_test_metrics(path: str) -> Dict:
+    '''Derived metrics of a test file, kept in its storage entry.'''
+    def compute() -> Dict:
+        df = storage.read_csv(path, MANDATORY_COLUMNS['TST'])
+        cycles = metrics.get_cycle_metrics(
+            df['Machine_N_cycles'].to_numpy(dtype=float),
+            df['Machine_Displacement'].to_numpy(dtype=float),
+            df['Machine_Load'].to_numpy(dtype=float))
+        return metrics.get_test_metrics(cycles)
+    return storage.read_derived(path, 'metrics', compute)
+
+
+def process_file(path: str,
+                 kind: str,
+                 previous_sha256: Optional[str]) -> Dict:
+    '''Validate and convert a file, run in a worker process. Unchanged
+    content only has its storage entry kept.'''
+    entry = {**storage.get_fingerprint(path), 'sha256': hash_file(path)}
+    if (entry['sha256'] == previous_sha256
+            and storage.update_fingerprint(path)):
+        return {**entry, 'changed': False}
+    try:
+        entry['errors'] = validate_columns(path, kind)
+        if not entry['errors']:
+            entry['rows'] = storage.get_entry(path)[1]['rows']
+            if kind == 'TST':
+                entry['metrics'] = get_test_metrics(path)
+    except (OSError, ValueError, KeyError) as e:
+        entry['errors'] = [str(e)]
+    return {**entry, 'changed': True}
+
+
+def validate_folder(folder: str, files: Dict[str, str]) -> List[str]:
+    '''Errors of the folder and file names.'''
+    try:
+        experiment = parse_folder_name(folder)
+    except ValueError as e:
+        return [str(e)]
+    prefix = f'{experiment["date"]:%Y-%m}_{experiment["type"]}'
+    test_pattern = re.compile(rf'(TST|HYS)_{prefix}_\d+\.csv$')
+    metadata_pattern = re.compile(rf'TST_{prefix}_metadata\.(xls|csv|json)$')
+    names = [os.path.basename(path) for path in files]
+    errors = [f'{name} is not a TST_{prefix}_###.csv file' for name in names
+              if not test_pattern.match(name)
+              and not metadata_pattern.match(name)]
+    if not any(metadata_pattern.match(name) for name in names):
+        errors.append(f'no TST_{prefix}_metadata file')
+    return errors
+
+
+def list_files(folder: str) -> Dict[str, str]:
+    '''Kind of every file of folder, by path relative to folder.'''
+    files = {}
+    for kind in ['TST', 'HYS']:
+        for _, path in find_files(folder, kind):
+            files[os.path.relpath(path, folder)] = kind
+    for name in os.listdir(folder):
+        if '_metadata.' in name:
+            files[name] = 'metadata'
+    return files
+
+
+def get_test_number(path: str) -> int:
+    return int(TEST_PATTERN.search(path)['number'])
+
+
+class Watcher:
+
+    def __init__(self,
+                 directory: str,
+                 manifest_path: str,
+                 executor: ProcessPoolExecutor,
+                 engine: Optional[Engine] = None):
+        self.directory = directory
+        self.manifest_path = manifest_path
+        self.executor = executor
+        self.engine = engine
+        self.manifest: Dict[str, Dict] = self.read_manifest()
+
+    def read_manifest(self) -> Dict[str, Dict]:
+        try:
+            with open(self.manifest_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def write_manifest(self) -> None:
+        os.makedirs(os.path.dirname(self.manifest_path) or '.',
+                    exist_ok=True)
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.manifest, file, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def submit(self, folder: str) -> Tuple[Dict[str, str],
+                                           Dict[str, Future]]:
+        '''Files of folder and the processing of those whose size or mtime
+        changed.'''
+        files = list_files(folder)
+        known = self.manifest.get(os.path.basename(folder), {}).get(
+            'files', {})
+        futures = {}
+        for name, kind in files.items():
+            path = os.path.join(folder, name)
+            previous = known.get(name)
+            if previous is not None and all(
+                    previous[key] == value
+                    for key, value in storage.get_fingerprint(path).items()):
+                continue
+            if kind == 'metadata':
+                futures[name] = self.executor.submit(hash_file, path)
+            else:
+                futures[name] = self.executor.submit(
+                    process_file, path, kind,
+                    previous['sha256'] if previous else None)
+        return files, futures
+
+    def finish(self,
+               folder: str,
+               files: Dict[str, str],
+               futures: Dict[str, Future]) -> Optional[Dict[str, int]]:
+        '''Record the processed files of folder and reload its changed
+        and pending tests in the database; return the counts of the update,
+        None when there is nothing to update.'''
+        name = os.path.basename(folder)
+        previous = self.manifest.get(name, {}).get('files', {})
+        pending = set(self.manifest.get(name, {}).get('pending', []))
+        entries = {n: e for n, e in previous.items() if n in files}
+        changed = set(previous) - set(files)
+        for file_name, future in futures.items():
+            if files[file_name] == 'metadata':
+                path = os.path.join(folder, file_name)
+                result = {**storage.get_fingerprint(path),
+                          'sha256': future.result()}
+                result['changed'] = (previous.get(file_name, {}).get(
+                    'sha256') != result['sha256'])
+            else:
+                result = future.result()
+            if result.pop('changed'):
+                entries[file_name] = result
+                changed.add(file_name)
+            else:
+                entries[file_name] = {**previous[file_name], **result}
+        errors = validate_folder(folder, files)
+        self.manifest[name] = {'errors': errors, 'files': entries}
+        valid = not errors and not any(entry.get('errors')
+                                       for entry in entries.values())
+        if self.engine is None:
+            return {'files': len(changed)} if changed else None
+        if not changed and not (pending and valid):
+            if pending:
+                self.manifest[name]['pending'] = sorted(pending)
+            return None
+        changed |= pending
+        # recorded before loading, in case the load fails
+        self.manifest[name]['pending'] = sorted(changed)
+        counts = {'files': len(changed)}
+        if valid:
+            counts.update(self.load(folder, changed))
+            del self.manifest[name]['pending']
+        return counts
+
+    def load(self, folder: str, changed: Set[str]) -> Dict[str, int]:
+        '''Reload the tests of the changed files, or the whole folder when
+        its metadata changed.'''
+        if any('_metadata.' in name for name in changed):
+            return ingest.ingest_folder(self.engine, folder)
+        numbers = {get_test_number(name) for name in changed}
+        return ingest.ingest_tests(self.engine, folder, sorted(numbers))
+
+    def run_once(self) -> Dict[str, Dict[str, int]]:
+        '''Process every new or changed folder once.'''
+        if not os.path.isdir(self.directory):
+            return {}
+        folders = sorted(
+            entry.path for entry in os.scandir(self.directory)
+            if entry.is_dir() and entry.name.startswith('TST_'))
+        submitted = [(folder, *self.submit(folder)) for folder in folders]
+        updates = {}
+        for folder, files, futures in submitted:
+            name = os.path.basename(folder)
+            known = self.manifest.get(name)
+            try:
+                counts = self.finish(folder, files, futures)
+            finally:
+                if self.manifest.get(name) != known:
+                    self.write_manifest()
+            if counts is not None:
+                updates[name] = counts
+        removed = set(self.manifest) - {os.path.basename(f) for f in folders}
+        for name in removed:
+            del self.manifest[name]
+        if removed:
+            self.write_manifest()
+        return updates
+
+    def watch(self, interval: float) -> None:
+        while True:
+            try:
+                updates = self.run_once()
+            except Exception:
+                # the changed files stay pending until the next pass
+                traceback.print_exc()
+                updates = {}
+            for name, counts in updates.items():
+                errors = self.manifest[name]['errors'] + [
+                    f'{file_name}: {error}'
+                    for file_name, entry in self.manifest[name][
+                        'files'].items()
+                    for error in entry.get('errors', [])]
+                print(f'{name}: {counts} {errors or ""}', flush=True)
+            time.sleep(interval)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--directory', default=settings.catalogue_directory)
+    parser.add_argument('--manifest', default=settings.watcher_manifest)
+    parser.add_argument('--interval', type=float,
+                        default=settings.watcher_interval_seconds)
+    parser.add_argument('--workers', type=int,
+                        default=settings.watcher_max_workers)
+    parser.add_argument('--database', action='store_true',
+                        help='also load the changed tests in the database')
+    parser.add_argument('--url', help='database URL, the settings by default')
+    parser.add_argument('--once', action='store_true',
+                        help='process the folders once and exit')
+    args = parser.parse_args(argv)
+    engine = None
+    if args.database:
+        from ccfatigue.services import database
+        engine = create_engine(args.url) if args.url else database.engine
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        watcher = Watcher(args.directory, args.manifest, executor, engine)
+        if args.once:
+            print(json.dumps(watcher.run_once(), indent=1))
+        else:
+            watcher.watch(args.interval)
+
+
+if __name__ == '__main__':
+    main()
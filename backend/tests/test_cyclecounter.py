@@ -0,0 +1,116 @@
+'''
+Cycle counting against the Fortran programs of
+CCFatigue_modules/1_CycleCounting, on their bundled input and output.
+'''
+import io
+import os
+
+import numpy as np
+import pytest
+
+from ccfatigue import cyclecounter
+from ccfatigue.model import CycleCountingMethod
+
+COUNTING_DIRECTORY: str = os.path.join(os.path.dirname(__file__), '..', '..',
+                                       'CCFatigue_modules',
+                                       '1_CycleCounting')
+
+
+def read_history() -> np.ndarray:
+    return np.loadtxt(os.path.join(COUNTING_DIRECTORY, 'input.txt'))
+
+
+def get_bins(cycles: cyclecounter.Cycles) -> np.ndarray:
+    '''(range, mean, R ratio, cycles) of the non-empty matrix cells.'''
+    bins = cyclecounter.create_bins(
+        *cyclecounter.create_matrix(cycles, cyclecounter.MATRIX_SIZE))
+    return np.array([[b.range, b.mean, b.r_ratio, b.n_cycles] for b in bins])
+
+
+def test_rainflow_matches_fortran():
+    cycles = cyclecounter.count_cycles(read_history(),
+                                       CycleCountingMethod.RAINFLOW)
+    actual = get_bins(cycles)
+    expected = np.loadtxt(os.path.join(COUNTING_DIRECTORY, 'output.txt'))
+    # the Fortran cells overlap by 1% of their width, so a cycle on a cell
+    # boundary is counted twice: it is the only extra cell of the output
+    matched = np.array([
+        np.any(np.all(np.isclose(expected[:, :4], row, rtol=1e-6), axis=1))
+        for row in actual])
+    assert matched.all()
+    assert len(expected) == len(actual) + 1
+    assert expected[:, 3].sum() == actual[:, 3].sum() + 1
+
+
+def get_fortran_bins(cycles: cyclecounter.Cycles) -> np.ndarray:
+    '''get_bins with the overlapping cells of the Fortran programs.'''
+    size = cyclecounter.MATRIX_SIZE
+
+    def get_cells(values: np.ndarray) -> np.ndarray:
+        low, high = cyclecounter.get_bounds(values)
+        width = (high - low) / size
+        edges = low + np.arange(size + 1) * width
+        return ((values[:, None] >= edges[:-1] - width / 100)
+                & (values[:, None] <= edges[1:] + width / 100))
+
+    ranges, means, counts = cycles
+    matrix = np.einsum('k,ki,kj->ij', counts, get_cells(ranges),
+                       get_cells(means))
+    bins = cyclecounter.create_bins(matrix, cyclecounter.get_bounds(ranges),
+                                    cyclecounter.get_bounds(means))
+    return np.array([[b.range, b.mean, b.r_ratio, b.n_cycles] for b in bins])
+
+
+@pytest.mark.parametrize('method, filename', [
+    (CycleCountingMethod.RAINFLOW, 'output.txt'),
+    (CycleCountingMethod.RANGE_MEAN, 'output-Range-Mean.txt'),
+    (CycleCountingMethod.RANGE_PAIR, 'output-Range-Pair.txt'),
+    (CycleCountingMethod.SIMPLIFIED_RAINFLOW,
+     'output-Simplified-Rainflow.txt'),
+])
+def test_cycles_match_fortran(method, filename):
+    cycles = cyclecounter.count_cycles(read_history(), method)
+    expected = np.loadtxt(os.path.join(COUNTING_DIRECTORY, filename))
+    # same cycles: with the Fortran cells, the matrices are identical
+    np.testing.assert_allclose(get_fortran_bins(cycles), expected[:, :4],
+                               rtol=1e-6)
+    # every cell of the port is a cell of the Fortran output
+    actual = get_bins(cycles)
+    assert all(
+        np.any(np.all(np.isclose(expected[:, :4], row, rtol=1e-6), axis=1))
+        for row in actual)
+
+
+def test_range_mean_counts_every_sample():
+    history = np.array([0, 1, 2, 2, 1], dtype=float)
+    ranges, means, counts = cyclecounter.count_cycles(
+        history, CycleCountingMethod.RANGE_MEAN)
+    np.testing.assert_array_equal(ranges, [1, 1, 0, 1])
+    np.testing.assert_array_equal(means, [0.5, 1.5, 2, 1.5])
+    np.testing.assert_array_equal(counts, [0.5] * 4)
+
+
+def test_rainflow_astm_example():
+    # ASTM E1049-85, figure 6
+    history = np.array([-2, 1, -3, 5, -1, 3, -4, 4, -2], dtype=float)
+    ranges, _, counts = cyclecounter.count_cycles(
+        history, CycleCountingMethod.RAINFLOW)
+    totals = {r: counts[ranges == r].sum() for r in np.unique(ranges)}
+    assert totals == {3: 0.5, 4: 1.5, 6: 0.5, 8: 1.0, 9: 0.5}
+
+
+@pytest.mark.parametrize('method', list(CycleCountingMethod))
+@pytest.mark.parametrize('chunk_size', [97, 4093])
+def test_chunked_counting_matches_whole_history(method, chunk_size):
+    path = os.path.join(COUNTING_DIRECTORY, 'input.txt')
+    with open(path, 'rb') as file:
+        data = file.read()
+    history = read_history()
+    cycles = cyclecounter.count_cycles(history, method)
+    whole = cyclecounter.create_bins(
+        *cyclecounter.create_matrix(cycles, cyclecounter.MATRIX_SIZE))
+    result = cyclecounter.run_cycle_counting(io.BytesIO(data), method,
+                                             chunk_size=chunk_size)
+    assert result.bins == whole
+    assert result.n_cycles == cycles[2].sum()
+    assert result.n_samples == len(history)
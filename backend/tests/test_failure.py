@@ -0,0 +1,89 @@
+'''
+Off-axis fatigue failure criteria, against the Fortran programs of
+CCFatigue_modules/4_FatigueFailure on their bundled inputs and outputs.
+'''
+import os
+from typing import Tuple
+
+import numpy as np
+import pytest
+
+from ccfatigue import failure
+from ccfatigue.model import FailureCriterion, SnModel
+from ccfatigue.sncurve import Dataset
+
+FAILURE_DIRECTORY: str = os.path.join(os.path.dirname(__file__), '..', '..',
+                                      'CCFatigue_modules', '4_FatigueFailure')
+N_CYCLES = [1e2, 1e4, 1e6]
+
+
+def create_dataset(model: SnModel, a: float, b: float,
+                   r_ratio: float = 0.1) -> Dataset:
+    '''Specimens lying on the S-N curve of parameters a and b.'''
+    n_cycles = np.array(N_CYCLES)
+    stress = failure.SnFit(model, a, b).stress(n_cycles)
+    return Dataset(np.column_stack([
+        np.full(len(n_cycles), r_ratio), np.full(len(n_cycles), 50),
+        np.arange(len(n_cycles)), stress, n_cycles]))
+
+
+def read_parameters(filename: str) -> Tuple[float, float]:
+    '''a and b of an S-N curve printed by the 2_S-NCurves programs.'''
+    with open(os.path.join(FAILURE_DIRECTORY, 'HR', filename)) as file:
+        lines = file.read().split()
+    return float(lines[3]), float(lines[4])
+
+
+def test_hashin_rotem_matches_fortran():
+    # transverse tests and off-axis tests at 45 degrees, predicted at 75
+    expected = np.loadtxt(os.path.join(FAILURE_DIRECTORY, 'HR', 'output.txt'),
+                          skiprows=12)
+    laminate = failure.Laminate(244.84, 84.94, 61.38, 216.68, 83.64)
+    inputs = failure.FailureInputs(
+        model=SnModel.LIN_LOG,
+        laminate=laminate,
+        transverse=create_dataset(SnModel.LIN_LOG,
+                                  *read_parameters('SN1.txt')),
+        reference=create_dataset(SnModel.LIN_LOG,
+                                 *read_parameters('SN2.txt')),
+        reference_angle=45,
+        reference_strength=139.12,
+    )
+    stress = failure.evaluate(FailureCriterion.HASHIN_ROTEM, inputs, [75],
+                              [0.1], expected[:, 1].tolist())[0, 0]
+    # the Fortran program takes the static strength at 75 degrees as an
+    # input, the port computes it
+    static = failure.get_static_strength(laminate, np.array(75.0))
+    np.testing.assert_allclose(stress * 89.47 / static, expected[:, 2],
+                               rtol=1e-5)
+
+
+def test_hashin_rotem_needs_two_tests():
+    inputs = failure.FailureInputs(
+        laminate=failure.Laminate(244.84, 84.94, 61.38),
+        transverse=create_dataset(SnModel.LOG_LOG, 80, 0.05))
+    with pytest.raises(ValueError, match='needs two of'):
+        failure.evaluate(FailureCriterion.HASHIN_ROTEM, inputs, [45], [0.1],
+                         N_CYCLES)
+
+
+@pytest.mark.parametrize('criterion', [FailureCriterion.FTPF,
+                                       FailureCriterion.SIMS_BROGDON,
+                                       FailureCriterion.HASHIN_ROTEM])
+def test_quadratic_criteria_on_the_axes(criterion):
+    # S-N curves of the bundled SB inputs, the off-axis one standing for
+    # the shear tests
+    inputs = failure.FailureInputs(
+        laminate=failure.Laminate(613.8195, 62.15738, 178.2426),
+        axial=create_dataset(SnModel.LOG_LOG, 613.8195, 0.1047379),
+        transverse=create_dataset(SnModel.LOG_LOG, 62.15738, 7.4895233e-2),
+        shear=create_dataset(SnModel.LOG_LOG, 178.2426, 9.2406474e-2))
+    stress = failure.evaluate(criterion, inputs, [0, 90], [0.1], N_CYCLES)
+    n_cycles = np.array(N_CYCLES)
+    np.testing.assert_allclose(stress[1, 0],
+                               62.15738 * n_cycles ** -7.4895233e-2,
+                               rtol=1e-9)
+    if criterion != FailureCriterion.HASHIN_ROTEM:
+        np.testing.assert_allclose(stress[0, 0],
+                                   613.8195 * n_cycles ** -0.1047379,
+                                   rtol=1e-9)
@@ -0,0 +1,105 @@
+'''
+Metrics derived from the machine columns, on synthetic loops of known
+geometry and on a bundled test of the Data folder.
+'''
+import os
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ccfatigue import metrics
+
+DATA_DIRECTORY: str = os.path.join(os.path.dirname(__file__), '..', '..',
+                                   'Data')
+N_LOOPS = 5
+PEAK_STRESS = 200.0
+
+
+def create_loop(creep: float,
+                amplitude: float,
+                width: float) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Strain and stress around the quadrilateral of diagonals from
+    (creep -+ amplitude, -+PEAK_STRESS) and from (creep -+ width, 0): its
+    area is 2 * PEAK_STRESS * width, its secant stiffness
+    PEAK_STRESS / amplitude. The midpoints of the edges are sampled too.
+    '''
+    corners = np.array([[creep - amplitude, -PEAK_STRESS],
+                        [creep + width, 0],
+                        [creep + amplitude, PEAK_STRESS],
+                        [creep - width, 0]])
+    midpoints = (corners + np.roll(corners, -1, axis=0)) / 2
+    points = np.stack([corners, midpoints], axis=1).reshape(-1, 2)
+    return points[:, 0], points[:, 1]
+
+
+def test_synthetic_loops():
+    creeps = 0.01 * np.arange(1, N_LOOPS + 1)
+    amplitudes = 0.02 * (1 + 0.1 * np.arange(N_LOOPS))
+    widths = 0.002 * np.arange(1, N_LOOPS + 1)
+    loops = [create_loop(*loop) for loop in zip(creeps, amplitudes, widths)]
+    n_cycles = np.concatenate([np.full(len(x), 10.0 * (k + 1))
+                               for k, (x, _) in enumerate(loops)])
+    strain = np.concatenate([x for x, _ in loops])
+    stress = np.concatenate([y for _, y in loops])
+    # rows of a cycle stay in order, the cycles do not need to
+    blocks = np.split(np.arange(len(n_cycles)), N_LOOPS)
+    order = np.concatenate([blocks[k] for k in [3, 0, 4, 1, 2]])
+    # incomplete rows are dropped
+    n_cycles = np.append(n_cycles[order], 60.0)
+    strain = np.append(strain[order], np.nan)
+    stress = np.append(stress[order], 0.0)
+
+    cycles = metrics.get_cycle_metrics(n_cycles, strain, stress)
+
+    stiffness = PEAK_STRESS / amplitudes
+    np.testing.assert_array_equal(cycles['n_cycles'],
+                                  10.0 * np.arange(1, N_LOOPS + 1))
+    np.testing.assert_allclose(cycles['hysteresis_area'],
+                               2 * PEAK_STRESS * widths, rtol=1e-12)
+    np.testing.assert_allclose(cycles['stiffness'], stiffness, rtol=1e-12)
+    np.testing.assert_allclose(cycles['creep'], creeps, rtol=1e-12)
+    np.testing.assert_allclose(cycles['peak_strain'], creeps + amplitudes,
+                               rtol=1e-12)
+    test = metrics.get_test_metrics(cycles)
+    assert test['total_dissipated_energy'] == pytest.approx(
+        2 * PEAK_STRESS * widths.sum(), rel=1e-12)
+    assert test['strain_at_failure'] == pytest.approx(
+        creeps[-1] + amplitudes[-1], rel=1e-12)
+    assert test['stiffness_degradation'] == pytest.approx(
+        1 - stiffness[-1] / stiffness[0], rel=1e-12)
+
+
+def test_bundled_test_matches_loop_by_loop_metrics():
+    df = pd.read_csv(os.path.join(DATA_DIRECTORY, 'TST_Khalooei_2021-10_FA',
+                                  'TST_2021-10_FA_01.csv'),
+                     encoding='utf-8-sig')
+    cycles = metrics.get_cycle_metrics(
+        df['Machine_N_cycles'].to_numpy(dtype=float),
+        df['Machine_Displacement'].to_numpy(dtype=float),
+        df['Machine_Load'].to_numpy(dtype=float))
+
+    # the HYS columns computed one loop at a time
+    expected = []
+    for n, loop in df.groupby('Machine_N_cycles', sort=True):
+        x = loop['Machine_Displacement'].to_numpy()
+        y = loop['Machine_Load'].to_numpy()
+        area = abs(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y)) / 2
+        # the first minimum and the last maximum of the stress
+        low, high = np.argmin(y), len(y) - 1 - np.argmax(y[::-1])
+        expected.append([n, (x[high] + x[low]) / 2, area,
+                         (y[high] - y[low]) / (x[high] - x[low]), x[high]])
+    expected = np.array(expected)
+
+    assert len(cycles) == len(expected) > 500
+    np.testing.assert_allclose(
+        cycles[metrics.CYCLE_COLUMNS + ['peak_strain']].to_numpy(),
+        expected, rtol=1e-9)
+    test = metrics.get_test_metrics(cycles)
+    assert test['total_dissipated_energy'] == pytest.approx(
+        expected[:, 2].sum(), rel=1e-9)
+    assert test['strain_at_failure'] == expected[-1, 4]
+    assert test['stiffness_degradation'] == pytest.approx(
+        1 - expected[-1, 3] / expected[0, 3], rel=1e-9)
@@ -0,0 +1,92 @@
+'''
+Parity of the NumPy S-N curve engine with the Fortran programs of
+CCFatigue_modules/2_S-NCurves, on their bundled input and outputs.
+'''
+import os
+
+import numpy as np
+import pytest
+
+from ccfatigue import analyzer, sncurve
+from ccfatigue.model import SnCurveMethod
+from ccfatigue.plotter import DataKey
+
+SN_DIRECTORY: str = os.path.join(os.path.dirname(__file__), '..', '..',
+                                 'CCFatigue_modules', '2_S-NCurves')
+# largest relative difference with the Fortran outputs, by method: they are
+# printed in single precision, and the Sendeckyj and Whitney parameters are
+# searched numerically
+TOLERANCES = {
+    SnCurveMethod.LIN_LOG: 1e-4,
+    SnCurveMethod.LOG_LOG: 1e-4,
+    # measured 0.23%: the grid search stops on a neighbouring C step
+    SnCurveMethod.SENDECKYJ: 5e-3,
+    SnCurveMethod.WHITNEY: 1e-3,
+}
+
+
+def read(filename: str) -> bytes:
+    with open(os.path.join(SN_DIRECTORY, filename), 'rb') as file:
+        return file.read()
+
+
+def fit(method: SnCurveMethod):
+    return sncurve.fit(sncurve.read_input(read('input.txt')), method)
+
+
+@pytest.mark.parametrize('method', list(SnCurveMethod))
+def test_fit_matches_fortran(method):
+    df, _ = fit(method)
+    expected = analyzer.create_dataframe(read(f'output-{method.value}.txt'),
+                                         method)
+    keys = [DataKey.R_RATIO.key, DataKey.N_CYCLES.key]
+    # the Fortran programs print the R ratio in single precision
+    for frame in [df, expected]:
+        frame[DataKey.R_RATIO.key] = frame[DataKey.R_RATIO.key].round(6)
+    if method == SnCurveMethod.WHITNEY:
+        # the debug lines of the Whitney program overwrite the first points
+        # of its output: the points left are compared
+        df = df.merge(expected[keys], on=keys)
+        assert len(df) == len(expected)
+    np.testing.assert_array_equal(df[keys].to_numpy(),
+                                  expected[keys].to_numpy())
+    for column in df.columns.drop(keys):
+        np.testing.assert_allclose(df[column].to_numpy(),
+                                   expected[column].to_numpy(),
+                                   rtol=TOLERANCES[method], err_msg=column)
+
+
+@pytest.mark.parametrize('method', list(SnCurveMethod))
+def test_render_round_trips(method):
+    df, parameters = fit(method)
+    parsed = analyzer.create_dataframe(sncurve.render(df, parameters),
+                                       method)
+    assert list(parsed.columns) == list(df.columns)
+    np.testing.assert_allclose(parsed.to_numpy(), df.to_numpy(), rtol=1e-8)
+
+
+@pytest.mark.parametrize('method', [SnCurveMethod.LIN_LOG,
+                                    SnCurveMethod.LOG_LOG])
+def test_band_outside_f_table(method):
+    # 40 specimens at 4 stress levels: 35 denominator degrees of freedom,
+    # beyond the 25 rows of the F table
+    rng = np.random.default_rng(0)
+    stress = np.repeat([300.0, 250.0, 200.0, 150.0], 10)
+    n_cycles = 10 ** (7 - stress / 60 + rng.normal(0, 0.1, len(stress)))
+    rows = np.column_stack([np.full(len(stress), 0.1),
+                            np.full(len(stress), 50), stress, stress,
+                            n_cycles])
+    df, _ = sncurve.fit([sncurve.Dataset(rows)], method)
+    # as in the Fortran programs, the band collapses onto the curve
+    np.testing.assert_allclose(df[DataKey.LOW.key],
+                               df[DataKey.STRESS_PARAM.key])
+    np.testing.assert_allclose(df[DataKey.HIGH.key],
+                               df[DataKey.STRESS_PARAM.key])
+
+
+def test_curves_are_json_compliant():
+    df, _ = fit(SnCurveMethod.LIN_LOG)
+    df.loc[df.index[:3], DataKey.STRESS_PARAM.key] = np.nan
+    curves = analyzer.create_curves(df, SnCurveMethod.LIN_LOG)
+    assert curves[0].stress_parameter[:3] == [None] * 3
+    assert 'NaN' not in curves[0].json()
@@ -14,3 +14,11 @@ loglevel = "error"
 user = "app"
 proc_name = "ccfatigue"
 timeout = 60
+preload_app = True
+
+
+def on_starting(server):
+    # import once in the master what the endpoints import lazily, so that
+    # every forked worker, recycled ones included, starts with it loaded
+    from ccfatigue import startup
+    startup.preload()